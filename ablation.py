@@ -0,0 +1,160 @@
+"""
+ablation.py
+===========
+Feature ablation for `build_model.py --ablation`: derives the reduced feature set.
+
+REDUCED_FEATURES is the paper's Sec. 4.6 / Table 10 result on the paper's
+data; retrained on regional data, another subset may be the right fallback.
+This stage recomputes the evidence on the data at hand:
+
+  * permutation importance of the full model over the CV folds: each fold's
+    forest is compiled once (inference.compile_forest) and its held-out rows'
+    forest cells are cached, so permuting a column only reorders that
+    column's cells before routing; the unpermuted accuracy comes from the
+    fold engine's cached probabilities
+  * drop-column: the CV accuracy of every subset missing one feature
+  * forward selection: starting from nothing, repeatedly add the feature
+    that raises CV accuracy most, until a subset is within `tolerance_pp` of
+    the full model (that subset is the reduced set)
+
+Every subset is scored on the same folds -- StratifiedKFold(10, shuffle=True,
+random_state=42), which are also build_model's out-of-fold splits and the
+first repeat of its 10x3 CV -- and declared on the shared FoldEngine, so:
+a subset reached by both searches is fitted once, the full-feature folds are
+the ones plan_fits needs anyway, the chosen subset's folds are reused by its
+own evaluation, and each round's candidates train in parallel across the
+engine's process pool.
+
+Usage
+-----
+    record = ablate(engine, FULL_FEATURES, tolerance_pp=1.0)
+    record["selected"]   # e.g. ["N", "P", "K", "humidity", "rainfall"]
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Sequence
+
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+
+from fold_engine import FoldEngine, FoldFit
+from inference import compile_forest
+
+TOLERANCE_PP = 1.0      # CV accuracy the reduced set may give up against the full model
+N_REPEATS = 10          # permutations per feature and fold
+
+
+def cv_folds(engine: FoldEngine, n_folds: int = 10, random_state: int = 42) -> list[tuple[np.ndarray, np.ndarray]]:
+    """The (train, test) row positions every subset is scored on."""
+    y = engine.frame[engine.target]
+    rows = np.arange(len(y))
+    skf = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state)
+    return list(skf.split(rows, y))
+
+
+def _subset(features: Sequence[str], chosen: set[str]) -> tuple[str, ...]:
+    """`chosen` in the order of `features`, so equal subsets share their fits."""
+    return tuple(f for f in features if f in chosen)
+
+
+def _declare(engine: FoldEngine, subset: tuple[str, ...], folds: list, declared: list[FoldFit],
+             keep: bool = False) -> list[tuple[FoldFit, np.ndarray]]:
+    fits = [(engine.fit(subset, train, predict=test, keep=keep), test) for train, test in folds]
+    declared.extend(fold for fold, _ in fits)
+    return fits
+
+
+def _cv_accuracy(fits: list[tuple[FoldFit, np.ndarray]], y: np.ndarray) -> tuple[float, float]:
+    """Mean and sd over folds, in percent, as build_model reports CV accuracy."""
+    scores = np.array([(fold.predict(test) == y[test]).mean() for fold, test in fits]) * 100
+    return float(scores.mean()), float(scores.std(ddof=1)) if len(scores) > 1 else 0.0
+
+
+def permutation_importance(fits: list[tuple[FoldFit, np.ndarray]], engine: FoldEngine,
+                           features: list[str], n_repeats: int = N_REPEATS,
+                           random_state: int = 42) -> dict[str, dict[str, float]]:
+    """Mean accuracy drop (pp) when one feature is shuffled within each held-out fold."""
+    rng = np.random.default_rng(random_state)
+    X = engine.frame[features].to_numpy(dtype=np.float64)
+    y = engine.frame[engine.target].to_numpy()
+    drops = {f: [] for f in features}
+    for fold, test in fits:
+        compiled = compile_forest(fold.model, features)
+        classes = np.asarray(fold.classes)
+        base = (fold.predict(test) == y[test]).mean()
+        cells = compiled.cells(X[test])
+        for j, f in enumerate(features):
+            for _ in range(n_repeats):
+                shuffled = cells.copy()
+                shuffled[:, j] = cells[rng.permutation(len(cells)), j]
+                proba = compiled.leaf_proba(compiled._route(shuffled))
+                drops[f].append(base - (classes[proba.argmax(axis=1)] == y[test]).mean())
+    return {f: {"mean_pp": round(float(np.mean(d)) * 100, 3), "sd_pp": round(float(np.std(d)) * 100, 3)}
+            for f, d in sorted(drops.items(), key=lambda item: -np.mean(item[1]))}
+
+
+def ablate(engine: FoldEngine, features: list[str], n_folds: int = 10,
+           tolerance_pp: float = TOLERANCE_PP, n_repeats: int = N_REPEATS,
+           random_state: int = 42) -> dict[str, Any]:
+    """Run the ablation on `engine`'s frame and return its record and the selected subset.
+
+    Declares fits on `engine` and runs it once per round; fits other callers
+    declared beforehand run in the first round.
+    """
+    started = time.perf_counter()
+    y = engine.frame[engine.target].to_numpy()
+    folds = cv_folds(engine, n_folds, random_state)
+    full = tuple(features)
+    declared: list[FoldFit] = []
+
+    # Round 1: the full model (kept for permutation) and every drop-one subset.
+    full_fits = _declare(engine, full, folds, declared, keep=True)
+    dropped = {f: _declare(engine, _subset(features, set(features) - {f}), folds, declared)
+               for f in features}
+    engine.run()
+    full_mean, full_sd = _cv_accuracy(full_fits, y)
+    drop_column = {}
+    for f, fits in dropped.items():
+        mean, _ = _cv_accuracy(fits, y)
+        drop_column[f] = {"cv_accuracy": round(mean, 3), "delta_pp": round(mean - full_mean, 3)}
+    importance = permutation_importance(full_fits, engine, features, n_repeats, random_state)
+
+    # Forward selection, one round (one parallel run) per added feature.
+    chosen: set[str] = set()
+    path = []
+    selected = None
+    while len(chosen) < len(features) - 1:
+        candidates = {f: _declare(engine, _subset(features, chosen | {f}), folds, declared)
+                      for f in features if f not in chosen}
+        engine.run()
+        scores = {f: _cv_accuracy(fits, y)[0] for f, fits in candidates.items()}
+        best = max(candidates, key=lambda f: (scores[f], -features.index(f)))
+        chosen.add(best)
+        path.append({"added": best, "features": list(_subset(features, chosen)),
+                     "cv_accuracy": round(scores[best], 3),
+                     "candidates": {f: round(s, 3) for f, s in scores.items()}})
+        if scores[best] >= full_mean - tolerance_pp:
+            selected = path[-1]
+            break
+    within = selected is not None
+    if not within:  # nothing smaller is close enough: the best subset one feature short
+        selected = path[-1]
+
+    return {
+        "n_folds": n_folds,
+        "n_repeats": n_repeats,
+        "tolerance_pp": tolerance_pp,
+        "full_cv_accuracy": round(full_mean, 3),
+        "full_cv_accuracy_sd": round(full_sd, 3),
+        "permutation_importance": importance,
+        "drop_column": drop_column,
+        "forward": path,
+        "selected": selected["features"],
+        "selected_cv_accuracy": selected["cv_accuracy"],
+        "selected_within_tolerance": within,
+        "fits_declared": len(declared),
+        "fits_distinct": len({id(fold) for fold in declared}),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
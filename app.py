@@ -1,79 +1,76 @@
 """
 Crop Recommendation System — Streamlit application
 ==================================================
-Consumes crop_model_v2.pkl, the artefact described in the manuscript:
+Consumes crop_model_v2.pkl, the artefact described in the manuscript, or its
+pickle-free array export crop_model_v2.arrays/, plus the 5-feature
+crop_model_v2_reduced variant when it sits next to it (registry.py):
 
     min-max scaler fitted on training folds only   (Sec. 2.2, Step 7)
     Random Forest, 100 trees, max_depth 10         (Table 3)
     isotonic-recalibrated probabilities            (Sec. 4.7)
-    exact TreeSHAP per-recommendation explanation  (Sec. 4.6)
+    compiled array-backed forest evaluation        (inference.py)
+    exact TreeSHAP per-recommendation explanation  (Sec. 4.6, tree_shap.py)
     rice/jute deferral inside the rainfall overlap (Sec. 4.5)
+    input drift and confidence monitoring          (monitor.py)
+    what-if sweeps over one or two features        (sweep.py)
+    live recommendation, panels rerun separately   (st.fragment)
     input rejection outside the trained ranges     (Sec. 5, Tier 2)
+    reduced-model answers without temperature/pH   (Sec. 4.6, registry.py)
+    artefacts swapped in when rebuilt, no restart  (registry.py)
 
 Class labels inside the artefact are crop-name strings, so this file contains no
 integer-to-name mapping. That mapping is what made the previous version display
 the wrong crop for every prediction.
 
-Repository layout:  app.py, crop_model_v2.pkl, requirements.txt
+Repository layout:  app.py, inference.py, cell_cache.py, tree_shap.py, sweep.py,
+                    registry.py, array_artifact.py, crop_model_v2.pkl, requirements.txt
 Run locally with:   streamlit run app.py
 """
 
 from __future__ import annotations
 
+import os
+import threading
 import time
 from pathlib import Path
 from typing import Any
 
-import joblib
+# Before the heavy imports below: where the cold-start clock begins when the
+# process start time cannot be read (see `startup_clock`).
+SCRIPT_STARTED = time.perf_counter()
+
+import altair as alt
 import numpy as np
 import pandas as pd
 import streamlit as st
-
-try:  # optional: falls back to global importances if unavailable
-    import shap
-
-    SHAP_AVAILABLE = True
-except Exception:
-    shap = None
-    SHAP_AVAILABLE = False
+from streamlit.logger import get_logger
+
+from array_artifact import FORMAT_NAME
+from audit import AUDIT
+from cell_cache import CellCache
+from inference import CROP_NOTES, FEATURE_META, predict_proba, triggered_rule, validate
+from monitor import MONITOR
+from registry import VARIANTS, ModelRegistry, locate
+from sweep import grid_axes, runs, sweep
+from telemetry import TELEMETRY
+from tree_shap import ShapEngine
 
 MODEL_FILENAME = "crop_model_v2.pkl"
-
-# Display metadata only; the artefact is the authority on features and ranges.
-FEATURE_META = {
-    "N": {"label": "Nitrogen (N)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
-    "P": {"label": "Phosphorus (P)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
-    "K": {"label": "Potassium (K)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
-    "temperature": {"label": "Temperature", "unit": "°C", "step": 0.1, "fmt": "%.2f"},
-    "humidity": {"label": "Relative humidity", "unit": "%", "step": 0.1, "fmt": "%.2f"},
-    "ph": {"label": "Soil pH", "unit": "", "step": 0.01, "fmt": "%.2f"},
-    "rainfall": {"label": "Rainfall", "unit": "mm", "step": 1.0, "fmt": "%.2f"},
-}
-
-CROP_NOTES = {
-    "apple": "Temperate; needs winter chill and well-drained loam.",
-    "banana": "Warm and humid throughout; heavy potassium feeder.",
-    "blackgram": "Short-duration pulse; warm conditions and fertile loamy soil.",
-    "chickpea": "Cool, dry finish; sensitive to waterlogging.",
-    "coconut": "Coastal humid tropics; sandy soils with steady moisture.",
-    "coffee": "Shaded highlands; well-distributed rainfall, acidic soil.",
-    "cotton": "Long warm season; deep soils, high nitrogen demand.",
-    "grapes": "Dry ripening period; very high P and K requirement.",
-    "jute": "Warm and humid with moderate rainfall; alluvial soils.",
-    "kidneybeans": "Moderate temperature; avoid waterlogged fields.",
-    "lentil": "Cool season pulse; low input, drought tolerant.",
-    "maize": "Wide adaptability; responsive to nitrogen.",
-    "mango": "Dry flowering period followed by warm humid growth.",
-    "mothbeans": "Arid and semi-arid; highly drought tolerant.",
-    "mungbean": "Short duration; warm season, low water need.",
-    "muskmelon": "Hot dry weather; sandy loam with irrigation.",
-    "orange": "Subtropical; well-drained soil, moderate rainfall.",
-    "papaya": "Continuous warmth; frost and waterlogging intolerant.",
-    "pigeonpeas": "Deep-rooted, drought hardy; long duration.",
-    "pomegranate": "Semi-arid; tolerates poor soils, dislikes humidity at ripening.",
-    "rice": "High rainfall or assured irrigation; puddled fields.",
-    "watermelon": "Hot dry season; sandy loam and steady irrigation.",
-}
+# Pickle-free export of the same model (array_artifact.py); served when written last.
+ARRAY_MODEL_DIRNAME = "crop_model_v2.arrays"
+# When the TreeSHAP explainer is built, and `shap` imported if it is needed:
+#   eager       while loading the artefact, before the first page renders
+#   lazy        on the first explained recommendation
+#   background  in a worker thread started after the first render (default)
+EXPLAINER_STARTUP = os.environ.get("CROP_EXPLAINER_STARTUP", "background")
+# Distinct split-threshold cells remembered across all sessions (cell_cache.py).
+CACHE_CELLS = 4096
+# Input changes closer together than this are coalesced into one prediction.
+DEBOUNCE_SECONDS = 0.25
+
+# Streamlit's logger, with its handler and level: a plain logging.getLogger
+# would drop INFO lines, since Streamlit configures neither for it.
+log = get_logger(__name__)
 
 
 # --------------------------------------------------------------------------- #
@@ -90,27 +87,111 @@ def find_model() -> Path | None:
     """
     here = Path(__file__).resolve().parent
     for directory in (here, here / "models", Path.cwd(), Path.cwd() / "models"):
-        candidate = directory / MODEL_FILENAME
-        if candidate.is_file():
-            return candidate
+        found = locate(directory, VARIANTS["full"])  # newest of .arrays/, .slim/, .pkl
+        if found is not None:
+            return found
     return None
 
 
-@st.cache_resource(show_spinner="Loading model…")
-def load_artifact(path_str: str) -> dict[str, Any]:
-    """Unpickle the artefact and attach a TreeSHAP explainer for the forest."""
-    artifact = joblib.load(Path(path_str))
-    artifact["_explainer"] = None
-    if SHAP_AVAILABLE:
+def process_age_seconds() -> float | None:
+    """Seconds since this process started, from /proc (Linux); None elsewhere."""
+    try:
+        fields = Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+        return max(uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@st.cache_resource
+def startup_clock() -> dict[str, Any]:
+    """Process-wide cold-start timings, measured from process start.
+
+    Where the start time cannot be read, the clock starts before the first
+    script run's heavy imports, so their cost is counted either way.
+    """
+    age = process_age_seconds()
+    started = time.perf_counter() - age if age is not None else SCRIPT_STARTED
+    return {"started": started, "origin": "process start" if age is not None else "first import",
+            "first_render_ms": None, "first_prediction_ms": None}
+
+
+def prepare_artifact(artifact: dict[str, Any]) -> None:
+    """Per-artefact serving state, attached before the registry swaps it in.
+
+    The TreeSHAP explainer is not built here unless EXPLAINER_STARTUP is
+    "eager"; see `get_explainer`.
+    """
+    engine = artifact["_engine"]
+    artifact["_cache"] = CellCache(engine, CACHE_CELLS) if engine is not None else None
+    artifact["_explainer_lock"] = threading.Lock()
+    if EXPLAINER_STARTUP == "eager":
+        get_explainer(artifact)
+
+
+@st.cache_resource(show_spinner="Loading models…")
+def get_registry(directory: str) -> ModelRegistry:
+    """Every model variant in `directory`, loaded once per process and kept current.
+
+    Sessions share the registry; a rebuilt artefact is picked up by its
+    watcher thread and swapped in without a restart (registry.py).
+    """
+    registry = ModelRegistry(directory, prepare=prepare_artifact)
+    registry.load()
+    registry.start()
+
+    def cache_gauges() -> dict[str, float]:
+        cache = registry.primary()[1]["_cache"] if registry.loaded() else None
+        if cache is None:
+            return {}
+        return {f"cell_cache_{key}": value for key, value in cache.stats().items() if key != "maxsize"}
+
+    TELEMETRY.add_collector(cache_gauges)
+    return registry
+
+
+def build_explainer(artifact: dict[str, Any]):
+    """The compiled single-class engine, else shap's TreeExplainer, else None."""
+    engine = artifact["_engine"]
+    if engine is not None:
         try:
-            artifact["_explainer"] = shap.TreeExplainer(artifact["pipeline"][-1])
+            return ShapEngine.from_artifact(artifact, engine)
         except Exception:
-            artifact["_explainer"] = None
-    return artifact
+            TELEMETRY.count("explainer_fallbacks", reason="shap")
+    if "pipeline" not in artifact:
+        return None
+    try:  # optional: falls back to global importances if unavailable
+        import shap
+
+        return shap.TreeExplainer(artifact["pipeline"][-1])
+    except Exception:
+        return None
+
+
+def get_explainer(artifact: dict[str, Any]):
+    """Build the explainer on first use; later callers, and sessions, share it."""
+    with artifact["_explainer_lock"]:
+        if "_explainer" not in artifact:
+            started = time.perf_counter()
+            artifact["_explainer"] = build_explainer(artifact)
+            artifact["_timings"]["explainer_ms"] = (time.perf_counter() - started) * 1000
+        return artifact["_explainer"]
+
+
+def warm_explainer(artifact: dict[str, Any]) -> None:
+    """Start building the explainer in the background, once per process."""
+    with artifact["_explainer_lock"]:
+        if "_explainer" in artifact or artifact.get("_warming"):
+            return
+        artifact["_warming"] = True
+    threading.Thread(target=get_explainer, args=(artifact,), daemon=True,
+                     name="explainer-warmup").start()
 
 
 def version_note(artifact: dict[str, Any]) -> str | None:
     """Pickled estimators are version-sensitive; surface a mismatch plainly."""
+    if artifact.get("format") == FORMAT_NAME:  # plain arrays: no sklearn involved
+        return None
     try:
         import sklearn
 
@@ -132,43 +213,42 @@ def version_note(artifact: dict[str, Any]) -> str | None:
 # --------------------------------------------------------------------------- #
 
 
-def validate(values: dict[str, float], stats: dict[str, dict]) -> list[str]:
-    """Reject inputs outside the trained ranges (Table 4; Sec. 5, Tier 2)."""
-    problems = []
-    for name, value in values.items():
-        info = stats[name]
-        label = FEATURE_META.get(name, {}).get("label", name)
-        unit = FEATURE_META.get(name, {}).get("unit", "")
-        if value is None or not np.isfinite(value):
-            problems.append(f"{label}: enter a number.")
-        elif value < info["min"] or value > info["max"]:
-            problems.append(
-                f"{label} = {value:g} is outside the trained range "
-                f"{info['min']:g}–{info['max']:g} {unit}."
-            )
-    return problems
-
-
 def top_contributions(artifact: dict[str, Any], frame: pd.DataFrame,
                       class_index: int, k: int = 3):
     """Top-k exact TreeSHAP contributions for this decision (Sec. 4.6).
 
-    Attribution runs on the forest inside the pipeline, so the inputs must be
-    pushed through the fitted scaler first.
+    The precomputed single-class engine (tree_shap.py) is used when the
+    artefact compiles; otherwise `shap` attributes the forest inside the
+    pipeline, so the inputs are pushed through the fitted scaler first.
+    Attributions are constant inside a split-threshold cell, so repeats are
+    served from the artefact's cell cache.
     """
-    explainer = artifact.get("_explainer")
+    explainer = get_explainer(artifact)
     if explainer is None:
+        TELEMETRY.count("explainer_fallbacks", reason="unavailable")
         return None
     features = artifact["feature_names"]
-    try:
-        scaled = artifact["pipeline"][:-1].transform(frame[features])
-        raw = explainer.shap_values(scaled, check_additivity=False)
-        if isinstance(raw, list):  # older shap: one array per class
-            contrib = np.asarray(raw[class_index])[0]
-        else:
+
+    def explain():
+        if isinstance(explainer, ShapEngine):
+            return explainer.shap_values(frame[features].to_numpy(), class_index)[0]
+        try:
+            scaled = artifact["pipeline"][:-1].transform(frame[features])
+            raw = explainer.shap_values(scaled, check_additivity=False)
+            if isinstance(raw, list):  # older shap: one array per class
+                return np.asarray(raw[class_index])[0]
             arr = np.asarray(raw)
-            contrib = arr[0, :, class_index] if arr.ndim == 3 else arr[0]
-    except Exception:
+            return arr[0, :, class_index] if arr.ndim == 3 else arr[0]
+        except Exception:
+            return None
+
+    cache = artifact.get("_cache")
+    if cache is not None:
+        contrib = cache.contributions(frame.to_numpy()[0], class_index, explain)
+    else:
+        contrib = explain()
+    if contrib is None:
+        TELEMETRY.count("explainer_fallbacks", reason="failed")
         return None
     order = np.argsort(np.abs(contrib))[::-1][:k]
     return [
@@ -181,23 +261,12 @@ def top_contributions(artifact: dict[str, Any], frame: pd.DataFrame,
     ]
 
 
-def triggered_rule(artifact: dict[str, Any], values: dict[str, float],
-                   classes: np.ndarray, crop: str):
-    """The deferral rule this input triggers, if any (Sec. 4.5)."""
-    for rule in artifact.get("ambiguity_rules", []):
-        feature = rule["feature"]
-        if crop in rule["classes"] and feature in values:
-            if rule["low"] <= values[feature] <= rule["high"]:
-                if all(name in classes for name in rule["classes"]):
-                    return rule
-    return None
-
-
 # --------------------------------------------------------------------------- #
 # Interface                                                                   #
 # --------------------------------------------------------------------------- #
 
 st.set_page_config(page_title="Crop Recommendation System", page_icon="🌱", layout="wide")
+clock = startup_clock()
 
 st.title("🌱 Crop Recommendation System")
 st.caption(
@@ -210,8 +279,8 @@ model_path = find_model()
 if model_path is None:
     here = Path(__file__).resolve().parent
     st.error(
-        f"**`{MODEL_FILENAME}` not found.** Commit it to the repository root, next "
-        "to `app.py`, then reboot the app."
+        f"**`{MODEL_FILENAME}` not found** (nor `{ARRAY_MODEL_DIRNAME}/`). Commit it to "
+        "the repository root, next to `app.py`, then reboot the app."
     )
     try:
         visible = sorted(p.name for p in here.iterdir())
@@ -221,7 +290,13 @@ if model_path is None:
         pass
     st.stop()
 
-artifact = load_artifact(str(model_path))
+registry = get_registry(str(model_path.parent))
+try:
+    primary_variant, artifact = registry.primary()
+except LookupError as exc:
+    st.error(f"**The model could not be loaded.** {exc}")
+    st.caption("Rebuild it with `build_model.py` in this environment, then reboot the app.")
+    st.stop()
 features = artifact["feature_names"]
 stats = artifact["feature_stats"]
 classes = np.asarray(artifact["class_names"])
@@ -233,18 +308,28 @@ if note:
 
 with st.sidebar:
     st.header("Model")
-    st.metric("Cross-validated accuracy", f"{metrics.get('cv_accuracy_mean', float('nan')):.2f}%")
-    ci = metrics.get("cv_accuracy_ci95")
-    if ci:
+    # Compressed and build_large artefacts carry no repeated-CV estimate;
+    # they headline the held-out figure instead.
+    if "cv_accuracy_mean" in metrics:
+        st.metric("Cross-validated accuracy", f"{metrics['cv_accuracy_mean']:.2f}%")
+        ci = metrics.get("cv_accuracy_ci95")
+        if ci:
+            st.caption(
+                f"95% CI [{ci[0]:.2f}, {ci[1]:.2f}] · SD {metrics.get('cv_accuracy_sd', 0):.2f} pp"
+            )
+        st.caption("Repeated stratified 10-fold cross-validation, three repeats (30 folds)")
+    elif "holdout_accuracy" in metrics:
+        st.metric("Held-out accuracy", f"{metrics['holdout_accuracy']:.2f}%")
+        if "holdout_errors" in metrics:
+            st.caption(f"{metrics['holdout_errors']} errors on the held-out rows")
+    if "oof_accuracy" in metrics:
         st.caption(
-            f"95% CI [{ci[0]:.2f}, {ci[1]:.2f}] · SD {metrics.get('cv_accuracy_sd', 0):.2f} pp"
+            f"Out-of-fold: {metrics['oof_accuracy']:.2f}% over "
+            f"{artifact.get('n_training_records', '—')} records "
+            f"({metrics.get('oof_errors', '—')} errors)"
         )
-    st.caption("Repeated stratified 10-fold cross-validation, three repeats (30 folds)")
-    st.caption(
-        f"Out-of-fold: {metrics.get('oof_accuracy', float('nan')):.2f}% over "
-        f"{artifact.get('n_training_records', '—')} records "
-        f"({metrics.get('oof_errors', '—')} errors)"
-    )
+    if "deployed_oob_accuracy" in metrics:
+        st.caption(f"Out-of-bag on the deployed trees: {metrics['deployed_oob_accuracy']:.2f}%")
     st.caption(
         f"Calibration ECE {metrics.get('holdout_ece_calibrated', float('nan')):.4f} "
         f"(before recalibration {metrics.get('holdout_ece_uncalibrated', float('nan')):.4f})"
@@ -258,71 +343,145 @@ with st.sidebar:
     st.caption(f"Built {str(artifact.get('created_utc', ''))[:10]} · "
                f"scikit-learn {artifact['library_versions']['scikit-learn']}")
     st.divider()
-    show_why = st.checkbox("Explain the recommendation", value=True)
     n_alternatives = st.slider("Alternatives to show", 3, 10, 5)
-    if not SHAP_AVAILABLE:
-        st.info("`shap` is not installed, so explanations use global importances.")
-
-left, right = st.columns(2, gap="large")
-
-with left:
-    st.subheader("Field measurements")
-    st.caption("Each range below is the range covered by the training data.")
-    values: dict[str, float] = {}
-    for name in features:
-        meta = FEATURE_META.get(name, {"label": name, "unit": "", "step": 0.1, "fmt": "%.2f"})
-        info = stats[name]
-        title = f"{meta['label']} ({meta['unit']})" if meta["unit"] else meta["label"]
-        values[name] = st.number_input(
-            title,
-            min_value=float(info["min"]),
-            max_value=float(info["max"]),
-            value=float(info["median"]),
-            step=float(meta["step"]),
-            format=meta["fmt"],
-            help=(f"Trained range {info['min']:g}–{info['max']:g}; "
-                  f"typical values {info['q1']:g}–{info['q3']:g}"),
-        )
+    if "_explainer" in artifact and artifact["_explainer"] is None:
+        st.info("No TreeSHAP explainer is available, so explanations use global importances.")
+
+# --------------------------------------------------------------------------- #
+# Panels                                                                      #
+# --------------------------------------------------------------------------- #
+# Each panel is a fragment, so a widget inside one reruns that panel rather
+# than the script: the header, model lookup and sidebar above run only on a
+# full rerun (page load, a sidebar setting). The input panel contains the
+# recommendation and what-if panels, so a changed measurement reruns the
+# inputs and what depends on them; the explain toggle reruns only the
+# recommendation, a sweep setting only the sweep. Results are kept in session
+# state and reused by any rerun whose inputs have not changed.
 
-    problems = validate(values, stats)
-    for problem in problems:
-        st.error(problem)
 
-    go = st.button("Recommend crop", type="primary", disabled=bool(problems))
+def feature_label(name: str) -> str:
+    return FEATURE_META.get(name, {}).get("label", name)
 
-with right:
-    st.subheader("Recommendation")
 
-    if not go:
-        st.info("Enter the measurements, then select **Recommend crop**.")
-    else:
+def recommend(model: dict[str, Any], variant: str, values: dict[str, float]) -> dict[str, Any]:
+    """Score `values` once per distinct input; reruns with the same inputs reuse it.
+
+    Scoring is where a recommendation is counted, monitored and audited, so a
+    rerun that only redraws records nothing. A change arriving within
+    DEBOUNCE_SECONDS of the previous one waits out the interval and then
+    reaches a Streamlit yield point, where a newer change preempts the run
+    instead of letting it score inputs that are already stale.
+    """
+    key = (variant, id(model), tuple(values.items()))
+    last = st.session_state.get("recommendation")
+    if last is not None and last["key"] == key:
+        return last
+    now = time.perf_counter()
+    burst = now - st.session_state.get("inputs_changed", -np.inf) < DEBOUNCE_SECONDS
+    st.session_state["inputs_changed"] = now
+    if burst:
+        time.sleep(DEBOUNCE_SECONDS)
+        st.empty()  # a yield point: a newer change preempts this run here
+
+    features = model["feature_names"]
+    classes = np.asarray(model["class_names"])
+    with TELEMETRY.stage("frame_build"):
         frame = pd.DataFrame([[values[f] for f in features]], columns=features)
 
-        started = time.perf_counter()
-        probabilities = artifact["calibrated"].predict_proba(frame)[0]
-        elapsed_ms = (time.perf_counter() - started) * 1000
-
-        best = int(np.argmax(probabilities))
-        crop = str(classes[best])
-        rule = triggered_rule(artifact, values, classes, crop)
-
-        if rule is not None:
-            pair = rule["classes"]
-            st.warning("### " + " or ".join(name.title() for name in pair))
-            columns = st.columns(len(pair))
-            for column, name in zip(columns, pair):
-                index = int(np.where(classes == name)[0][0])
-                column.metric(name.title(), f"{probabilities[index] * 100:.1f}%")
-            st.caption(rule["note"])
-        else:
-            st.success(f"### {crop.title()}")
-            # Isotonic regression can saturate at exactly 1.0; never claim certainty.
-            st.metric("Calibrated confidence", f"{min(float(probabilities[best]), 0.999) * 100:.1f}%")
-            st.caption(CROP_NOTES.get(crop, ""))
-
-        if show_why:
+    started = time.perf_counter()
+    cache = model["_cache"]
+    if cache is not None:
+        probabilities = cache.probabilities(frame.to_numpy()[0])
+    else:
+        probabilities = predict_proba(model, frame.to_numpy())[0]
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    best = int(np.argmax(probabilities))
+    crop = str(classes[best])
+    rule = triggered_rule(model, values, classes, crop)
+    TELEMETRY.count("predictions")
+    MONITOR.observe(model, frame.to_numpy()[0], probabilities)
+    AUDIT.record(source="app", variant=variant, created_utc=model.get("created_utc"),
+                 inputs=values, proba=probabilities, crop=crop,
+                 rule="/".join(rule["classes"]) if rule is not None else None,
+                 latency_ms=elapsed_ms)
+    result = {"key": key, "frame": frame, "probabilities": probabilities, "best": best,
+              "crop": crop, "rule": rule, "elapsed_ms": elapsed_ms}
+    st.session_state["recommendation"] = result
+    if clock["first_prediction_ms"] is None:
+        clock["first_prediction_ms"] = (time.perf_counter() - clock["started"]) * 1000
+        log.info("startup: first prediction %.0f ms after %s",
+                 clock["first_prediction_ms"], clock["origin"])
+    return result
+
+
+@st.fragment
+def recommendation_panel(model: dict[str, Any], variant: str, values: dict[str, float],
+                         skipped: list[str], problems: list[str], n_alternatives: int) -> None:
+    st.subheader("Recommendation")
+    show_why = st.toggle("Explain the recommendation", value=True, key="show_why")
+    if problems:
+        st.info("Correct the measurements to get a recommendation.")
+        return
+
+    result = recommend(model, variant, values)
+    features = model["feature_names"]
+    classes = np.asarray(model["class_names"])
+    frame, probabilities, best = result["frame"], result["probabilities"], result["best"]
+    crop, rule = result["crop"], result["rule"]
+    # Everything from here on is rendering, less the explanation.
+    render_started, explain_seconds = time.perf_counter(), 0.0
+
+    if rule is not None:
+        pair = rule["classes"]
+        st.warning("### " + " or ".join(name.title() for name in pair))
+        columns = st.columns(len(pair))
+        for column, name in zip(columns, pair):
+            index = int(np.where(classes == name)[0][0])
+            column.metric(name.title(), f"{probabilities[index] * 100:.1f}%")
+        st.caption(rule["note"])
+    else:
+        st.success(f"### {crop.title()}")
+        # Isotonic regression can saturate at exactly 1.0; never claim certainty.
+        st.metric("Calibrated confidence", f"{min(float(probabilities[best]), 0.999) * 100:.1f}%")
+        st.caption(CROP_NOTES.get(crop, ""))
+
+    # Filled last, so the answer and its alternatives show while an explainer builds.
+    why = st.container()
+
+    st.markdown("**Other candidates**")
+    order = np.argsort(probabilities)[::-1][:n_alternatives]
+    st.dataframe(
+        pd.DataFrame(
+            {
+                "Crop": [str(classes[i]).title() for i in order],
+                "Probability": [float(probabilities[i]) for i in order],
+            }
+        ),
+        hide_index=True,
+        column_config={
+            "Probability": st.column_config.ProgressColumn(
+                "Probability", min_value=0.0, max_value=1.0, format="%.3f"
+            )
+        },
+    )
+    answered = f"Answered in {result['elapsed_ms']:.1f} ms."
+    if variant != primary_variant:
+        answered += (f" {variant.title()} model ({len(features)} features): "
+                     + ", ".join(feature_label(f) for f in skipped)
+                     + " not measured.")
+    cache = model["_cache"]
+    if cache is not None:
+        counts = cache.stats()
+        answered += f" Cell cache: {counts['hits']} hits, {counts['misses']} misses."
+    st.caption(answered)
+    if show_why:
+        with why, st.spinner("Preparing the explanation…"):
             st.markdown("**Why this crop**")
-            contributions = top_contributions(artifact, frame, best)
+            explain_started = time.perf_counter()
+            contributions = top_contributions(model, frame, best)
+            explain_seconds = time.perf_counter() - explain_started
+            TELEMETRY.observe("top_contributions", explain_seconds)
             if contributions:
                 for item in contributions:
                     positive = item["contribution"] >= 0
@@ -334,30 +493,154 @@ with right:
                     )
                 st.caption("Exact TreeSHAP contributions for this specific prediction.")
             else:
+                global_importances = model.get("feature_importances")
+                if global_importances is None:
+                    global_importances = model["pipeline"][-1].feature_importances_
                 importances = pd.DataFrame(
-                    {"Importance": artifact["pipeline"][-1].feature_importances_},
-                    index=[FEATURE_META.get(f, {}).get("label", f) for f in features],
+                    {"Importance": global_importances},
+                    index=[feature_label(f) for f in features],
                 ).sort_values("Importance", ascending=False)
                 st.bar_chart(importances)
                 st.caption("Global feature importances — not specific to this prediction.")
-
-        st.markdown("**Other candidates**")
-        order = np.argsort(probabilities)[::-1][:n_alternatives]
-        st.dataframe(
-            pd.DataFrame(
-                {
-                    "Crop": [str(classes[i]).title() for i in order],
-                    "Probability": [float(probabilities[i]) for i in order],
-                }
-            ),
-            hide_index=True,
-            column_config={
-                "Probability": st.column_config.ProgressColumn(
-                    "Probability", min_value=0.0, max_value=1.0, format="%.3f"
-                )
-            },
+    TELEMETRY.observe("render", time.perf_counter() - render_started - explain_seconds)
+    TELEMETRY.maybe_write()
+
+
+@st.fragment
+def what_if_panel(model: dict[str, Any], values: dict[str, float], problems: list[str],
+                  n_alternatives: int) -> None:
+    features, stats = model["feature_names"], model["feature_stats"]
+    classes = np.asarray(model["class_names"])
+    st.caption("Vary one or two measurements across their trained range; the others "
+               "stay at the values entered above. The whole grid is scored at once.")
+    # Off until asked for: an expander runs its body even while collapsed.
+    if not st.toggle("Run the sweep", key="what_if"):
+        return
+    swept = st.multiselect("Features to sweep", features, max_selections=2,
+                           default=["rainfall"] if "rainfall" in features else features[:1],
+                           format_func=feature_label)
+    points = st.slider("Grid points per feature", 20, 500 if len(swept) < 2 else 200,
+                       200 if len(swept) < 2 else 100, step=10)
+    if problems:
+        st.info("Correct the measurements above to run a sweep.")
+        return
+    if not swept:
+        return
+    key = (id(model), tuple(values.items()), tuple(swept), points)
+    last = st.session_state.get("sweep")
+    if last is not None and last["key"] == key:
+        result, sweep_ms = last["result"], last["ms"]
+    else:
+        started = time.perf_counter()
+        result = sweep(model, values, grid_axes(stats, swept, points))
+        sweep_ms = (time.perf_counter() - started) * 1000
+        st.session_state["sweep"] = {"key": key, "result": result, "ms": sweep_ms}
+    rules = model.get("ambiguity_rules", [])
+
+    if len(swept) == 1:
+        axis, label = result.axes[0], feature_label(swept[0])
+        shown = result.top_classes(n_alternatives)
+        curves = pd.DataFrame({
+            label: np.repeat(axis, len(shown)),
+            "Crop": np.tile([str(classes[i]).title() for i in shown], len(axis)),
+            "Probability": result.proba[:, shown].ravel(),
+        })
+        chart = alt.Chart(curves).mark_line().encode(
+            x=alt.X(f"{label}:Q", scale=alt.Scale(domain=[axis[0], axis[-1]])),
+            y=alt.Y("Probability:Q", scale=alt.Scale(domain=[0, 1]), title="Calibrated probability"),
+            color="Crop:N",
+            tooltip=[label, "Crop", alt.Tooltip("Probability:Q", format=".3f")],
+        )
+        bands = pd.DataFrame([
+            {"start": axis[a], "end": axis[b],
+             "Deferral": " / ".join(rules[result.rule[a]]["classes"]).title()}
+            for a, b in runs(result.deferred)
+        ])
+        if len(bands):
+            shading = alt.Chart(bands).mark_rect(opacity=0.15, color="orange").encode(
+                x="start:Q", x2="end:Q", tooltip=["Deferral"])
+            chart = alt.layer(shading, chart)
+        st.altair_chart(chart)
+        if len(bands):
+            st.caption("Shaded: deferral bands, where both crops of an ambiguity rule are "
+                       "presented instead of one recommendation.")
+    else:
+        (x, y), (x_label, y_label) = result.axes, [feature_label(f) for f in swept]
+        xx, yy = np.meshgrid(x, y, indexing="ij")
+        top = np.char.title(classes[result.top].astype(str))
+        for i, rule in enumerate(rules):
+            top[result.rule == i] = " / ".join(rule["classes"]).title() + " (deferred)"
+        dx, dy = (x[1] - x[0]) / 2, (y[1] - y[0]) / 2
+        cells = pd.DataFrame({
+            "x": xx.ravel() - dx, "x2": xx.ravel() + dx,
+            "y": yy.ravel() - dy, "y2": yy.ravel() + dy,
+            x_label: xx.ravel(), y_label: yy.ravel(),
+            "Top crop": top.ravel(),
+            "Confidence": result.proba.max(axis=-1).ravel(),
+        })
+        chart = alt.Chart(cells).mark_rect().encode(
+            x=alt.X("x:Q", title=x_label, scale=alt.Scale(domain=[x[0] - dx, x[-1] + dx])),
+            x2="x2", y=alt.Y("y:Q", title=y_label, scale=alt.Scale(domain=[y[0] - dy, y[-1] + dy])),
+            y2="y2",
+            color="Top crop:N",
+            opacity=alt.Opacity("Confidence:Q", scale=alt.Scale(domain=[0, 1])),
+            tooltip=[alt.Tooltip(f"{x_label}:Q", format=".2f"),
+                     alt.Tooltip(f"{y_label}:Q", format=".2f"),
+                     "Top crop", alt.Tooltip("Confidence:Q", format=".3f")],
         )
-        st.caption(f"Answered in {elapsed_ms:.1f} ms.")
+        st.altair_chart(chart)
+        st.caption("Colour: top-1 crop, with deferral cells as their own category; "
+                   "opacity: calibrated confidence.")
+    st.caption(f"{result.top.size:,} grid points ({result.points_scored:,} distinct "
+               f"threshold cells scored) in {sweep_ms:.0f} ms.")
+
+
+@st.fragment
+def input_panel(n_alternatives: int) -> None:
+    features, stats = artifact["feature_names"], artifact["feature_stats"]
+    left, right = st.columns(2, gap="large")
+
+    with left:
+        st.subheader("Field measurements")
+        st.caption("Each range below is the range covered by the training data.")
+        # Measurements a loaded reduced variant can do without may be left out.
+        optional = [f for f in features
+                    if any(f not in registry.get(v)["feature_names"] for v in registry.loaded())]
+        values: dict[str, float] = {}
+        for name in features:
+            meta = FEATURE_META.get(name, {"label": name, "unit": "", "step": 0.1, "fmt": "%.2f"})
+            info = stats[name]
+            title = f"{meta['label']} ({meta['unit']})" if meta["unit"] else meta["label"]
+            if name in optional and st.checkbox(f"{meta['label']} not measured", key=f"skip_{name}"):
+                continue
+            values[name] = st.number_input(
+                title,
+                min_value=float(info["min"]),
+                max_value=float(info["max"]),
+                value=float(info["median"]),
+                step=float(meta["step"]),
+                format=meta["fmt"],
+                help=(f"Trained range {info['min']:g}–{info['max']:g}; "
+                      f"typical values {info['q1']:g}–{info['q3']:g}"),
+            )
+
+        # The richest loaded variant with every feature it needs answers (registry.py).
+        variant, model = registry.route(values)
+        skipped = [f for f in features if f not in values]
+        values = {f: values[f] for f in model["feature_names"]}
+
+        problems = validate(values, model["feature_stats"])
+        for problem in problems:
+            st.error(problem)
+
+    with right:
+        recommendation_panel(model, variant, values, skipped, problems, n_alternatives)
+
+    with st.expander("What-if sweep"):
+        what_if_panel(model, values, problems, n_alternatives)
+
+
+input_panel(n_alternatives)
 
 st.divider()
 st.caption(
@@ -367,3 +650,52 @@ st.caption(
     "economics, so the output is agronomic advice rather than a farm-management "
     "decision."
 )
+
+# --------------------------------------------------------------------------- #
+# Cold-start report                                                           #
+# --------------------------------------------------------------------------- #
+
+if clock["first_render_ms"] is None:
+    clock["first_render_ms"] = (time.perf_counter() - clock["started"]) * 1000
+    log.info("startup: first render %.0f ms after %s (explainer %s)",
+             clock["first_render_ms"], clock["origin"], EXPLAINER_STARTUP)
+if EXPLAINER_STARTUP == "background":
+    warm_explainer(artifact)
+
+with st.sidebar:
+    timings = artifact["_timings"]
+    parts = [f"load {timings['load_ms']:.0f} ms", f"compile {timings['compile_ms']:.0f} ms",
+             f"first render {clock['first_render_ms']:.0f} ms"]
+    if "explainer_ms" in timings:
+        parts.append(f"explainer {timings['explainer_ms']:.0f} ms")
+    if clock["first_prediction_ms"] is not None:
+        parts.append(f"first prediction {clock['first_prediction_ms']:.0f} ms")
+    st.caption(f"Cold start, from {clock['origin']}: " + " · ".join(parts))
+
+    with st.expander("Loaded models"):
+        for name, info in registry.stats()["variants"].items():
+            memory, swap = info["memory"], info["last_swap"]
+            st.caption(
+                f"**{name}** · {info['features']} features · {info['format']} · "
+                f"{memory['heap_mb']:.1f} MB heap + {memory['mapped_mb']:.1f} MB mapped"
+                + (f" (RSS +{memory['rss_growth_mb']:.0f} MB)" if memory["rss_growth_mb"] is not None else "")
+                + f" · loaded {info['loaded_utc'][11:19]} UTC in {swap['load_ms']:.0f} ms, "
+                f"probe {swap['probe_ms']:.0f} ms, swap {swap['swap_us']:.1f} µs · "
+                f"{info['swaps']} load(s)"
+            )
+        for error in registry.stats()["errors"]:
+            st.caption(f"Rejected {error['path']}: {error['error']}")
+
+    # Per-stage timings since the process started (telemetry.py).
+    snapshot = TELEMETRY.snapshot() if TELEMETRY.enabled else None
+    if snapshot and snapshot["stages"]:
+        with st.expander("Hot-path timings"):
+            table = pd.DataFrame(snapshot["stages"]).T[["count", "mean_ms", "p95_ms", "p99_ms"]]
+            st.dataframe(table, column_config={
+                "mean_ms": st.column_config.NumberColumn("mean ms", format="%.3f"),
+                "p95_ms": st.column_config.NumberColumn("p95 ≤ ms", format="%.3f"),
+                "p99_ms": st.column_config.NumberColumn("p99 ≤ ms", format="%.3f"),
+            })
+            if snapshot["counters"]:
+                st.caption(" · ".join(f"{name} {value:g}"
+                                      for name, value in sorted(snapshot["counters"].items())))
@@ -0,0 +1,410 @@
+"""
+array_artifact.py
+=================
+Pickle-free, memory-mappable export of the deployment artefact.
+
+crop_model_v2.pkl is a joblib pickle of sklearn objects: it only loads under
+the scikit-learn version that wrote it, and every process that loads it holds
+its own deserialised copy. This format stores what serving actually needs as
+plain arrays, one `.npy` file each, plus a JSON header:
+
+    crop_model_v2.arrays/
+        header.json          format version, metadata, array manifest
+        feature.npy ...      compiled forest (inference.CompiledForest)
+        calib_x.npy ...      isotonic knots, concatenated with offsets
+        split_masks.npy ...  the prebuilt routing index
+        cover.npy            node cover, for TreeSHAP
+
+Arrays are opened with `np.load(mmap_mode="r")`, so loading takes
+milliseconds, needs no particular sklearn version, and several server
+processes share a single page-cache copy of the model.
+
+The slim layout (`slim=` / --slim) keeps only what routing and calibration
+read and packs it:
+
+  * no tree structure (feature, threshold, children), node cover or
+    internal-node values, so no TreeSHAP; the app falls back to global
+    importances
+  * leaf distributions only, as float32 or quantised to uint16/uint8 with one
+    scale factor (`--slim float32|uint16|uint8`)
+  * the routing masks stored once per distinct (feature, tree) mask, with a
+    per-cell index (mask_rows) instead of a full (cells, trees, words) table:
+    each threshold row of the full table differs from the one before in a
+    single tree
+  * every index in the narrowest unsigned type that holds it
+
+Predictions change only through the leaf quantisation; `export_slim`
+measures by how much, on the training rows and on rows sampled inside
+feature_stats, and refuses an export outside the tolerance. When the slim
+export is the newest file of its variant, the registry serves it.
+
+The header carries everything else the app reads from the pickle
+(feature_names, feature_stats, class_names, metrics, ambiguity_rules, ...)
+and the calibrated confidence shares of the calibration data, which
+monitor.py compares live confidences against, so a loaded array artefact is
+a drop-in replacement for the unpickled dict wherever `artifact["_engine"]`
+is used.
+
+Usage
+-----
+    export_arrays(artifact, Path("models/crop_model_v2.arrays"))
+    artifact = load_arrays(Path("models/crop_model_v2.arrays"))
+
+    python array_artifact.py crop_model_v2.pkl     # convert an existing pickle
+    python array_artifact.py crop_model_v2.pkl --slim uint16 --out crop_model_v2.slim
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from inference import CompiledForest, compile_artifact, confidence_shares
+
+FORMAT_NAME = "crop-model-arrays"
+FORMAT_VERSION = 1
+HEADER = "header.json"
+
+# Leaf value encodings of the slim layout.
+SLIM_DTYPES = {"float32": np.float32, "uint16": np.uint16, "uint8": np.uint8}
+# What a slim export may change on the verification rows: calibrated
+# probability (absolute) and the fraction of rows whose top-1 crop changes.
+SLIM_TOLERANCE = 0.01
+SLIM_ARGMAX_TOLERANCE = 0.001
+# Rows drawn inside feature_stats that a slim export is also checked on: the
+# training rows mostly land in pure leaves, which quantise exactly.
+SLIM_SAMPLED_ROWS = 20_000
+
+# Artefact entries copied verbatim into the header.
+METADATA_KEYS = (
+    "schema_version", "variant", "created_utc", "library_versions", "feature_names",
+    "feature_stats", "feature_sketches", "class_names", "n_training_records", "model_params",
+    "ambiguity_rules", "metrics", "calibration_confidence",
+)
+
+
+def _offsets(parts: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum([len(p) for p in parts])]).astype(np.int64)
+
+
+def _split(flat: np.ndarray, offsets: np.ndarray) -> list[np.ndarray]:
+    return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _narrow(n: int) -> type:
+    """The smallest unsigned integer type that holds 0..n-1."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def _json_ready(value: Any) -> Any:
+    """Metadata as plain JSON types (numpy scalars and arrays included)."""
+    if isinstance(value, dict):
+        return {str(k): _json_ready(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_ready(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def engine_arrays(engine: CompiledForest) -> dict[str, np.ndarray]:
+    """The compiled forest as named flat arrays, narrowed where lossless."""
+    index = np.int32 if len(engine.feature) < 2 ** 31 else np.int64
+    return {
+        "feature": engine.feature.astype(np.int32),
+        "threshold": engine.threshold.astype(np.float64),
+        "left": engine.left.astype(index),
+        "right": engine.right.astype(index),
+        "value": engine.value.astype(np.float64),
+        "roots": engine.roots.astype(index),
+        "calib_x": np.concatenate(engine.calib_x),
+        "calib_y": np.concatenate(engine.calib_y),
+        "calib_offsets": _offsets(engine.calib_x),
+        "split_values": np.concatenate(engine.split_values),
+        "split_offsets": _offsets(engine.split_values),
+        "split_masks": np.concatenate(engine.split_masks),
+        "mask_offsets": _offsets(engine.split_masks),
+        "leaf_slots": engine.leaf_slots.astype(index),
+    }
+
+
+def slim_arrays(engine: CompiledForest,
+                leaf_dtype: str) -> tuple[dict[str, np.ndarray], float | None]:
+    """The serving-only arrays of the slim layout, and the leaf value scale."""
+    leaves = np.flatnonzero(engine.left < 0)
+    leaf_id = np.zeros(len(engine.left), dtype=np.int64)
+    leaf_id[leaves] = np.arange(len(leaves))
+    value, scale = engine.value[leaves], None
+    if leaf_dtype == "float32":
+        value = value.astype(np.float32)
+    else:
+        top = np.iinfo(SLIM_DTYPES[leaf_dtype]).max
+        value, scale = np.rint(value * top).astype(SLIM_DTYPES[leaf_dtype]), 1.0 / top
+
+    tables, rows = [], []
+    for masks in engine.split_masks:
+        n_cells, n_trees, n_words = masks.shape
+        distinct, inverse = np.unique(masks.reshape(-1, n_words), axis=0, return_inverse=True)
+        tables.append(distinct)
+        rows.append(inverse.reshape(n_cells, n_trees))
+    arrays = {
+        "value": value,
+        "roots": engine.roots.astype(_narrow(len(engine.feature))),
+        "calib_x": np.concatenate(engine.calib_x),
+        "calib_y": np.concatenate(engine.calib_y),
+        "calib_offsets": _offsets(engine.calib_x),
+        "split_values": np.concatenate(engine.split_values),
+        "split_offsets": _offsets(engine.split_values),
+        "split_masks": np.concatenate(tables),
+        "table_offsets": _offsets(tables),
+        "mask_rows": np.concatenate(rows).astype(_narrow(max(len(t) for t in tables))),
+        "mask_offsets": _offsets(rows),
+        "leaf_slots": leaf_id[engine.leaf_slots].astype(_narrow(len(leaves))),
+    }
+    return arrays, scale
+
+
+def engine_from_arrays(header: dict[str, Any], arrays: dict[str, np.ndarray]) -> CompiledForest:
+    if header.get("layout") == "slim":
+        none = np.zeros(0, dtype=np.int64)
+        return CompiledForest(
+            feature_names=list(header["feature_names"]),
+            class_names=list(header["class_names"]),
+            feature=none, threshold=np.zeros(0), left=none, right=none,
+            value=arrays["value"],
+            roots=arrays["roots"],
+            calib_x=_split(arrays["calib_x"], arrays["calib_offsets"]),
+            calib_y=_split(arrays["calib_y"], arrays["calib_offsets"]),
+            split_values=_split(arrays["split_values"], arrays["split_offsets"]),
+            split_masks=_split(arrays["split_masks"], arrays["table_offsets"]),
+            leaf_slots=arrays["leaf_slots"],
+            mask_rows=_split(arrays["mask_rows"], arrays["mask_offsets"]),
+            value_scale=header.get("value_scale"),
+        )
+    return CompiledForest(
+        feature_names=list(header["feature_names"]),
+        class_names=list(header["class_names"]),
+        feature=arrays["feature"],
+        threshold=arrays["threshold"],
+        left=arrays["left"],
+        right=arrays["right"],
+        value=arrays["value"],
+        roots=arrays["roots"],
+        calib_x=_split(arrays["calib_x"], arrays["calib_offsets"]),
+        calib_y=_split(arrays["calib_y"], arrays["calib_offsets"]),
+        split_values=_split(arrays["split_values"], arrays["split_offsets"]),
+        split_masks=_split(arrays["split_masks"], arrays["mask_offsets"]),
+        leaf_slots=arrays["leaf_slots"],
+    )
+
+
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def export_arrays(artifact: dict[str, Any], directory: Path, slim: str | None = None) -> Path:
+    """Write the array artefact into a staging directory, then swap it in.
+
+    The swap is two renames (the old directory aside, the new one into
+    place), so a reader sees the old export or the new one, never a partial
+    one, but for the instant between the renames `directory` is missing.
+    `slim` ("float32", "uint16" or "uint8") writes the slim layout instead.
+    """
+    engine = artifact.get("_engine") or compile_artifact(artifact)
+    forest = artifact["calibrated"].calibrated_classifiers_[0].estimator[-1]
+    layout: dict[str, Any] = {"layout": "full"}
+    if slim is None:
+        arrays = engine_arrays(engine)
+        arrays["cover"] = np.concatenate(
+            [e.tree_.weighted_n_node_samples for e in forest.estimators_]
+        ).astype(np.float64)
+    else:
+        if slim not in SLIM_DTYPES:
+            raise ValueError(f"slim leaf values must be one of {list(SLIM_DTYPES)}, got {slim!r}")
+        arrays, scale = slim_arrays(engine, slim)
+        layout = {"layout": "slim", "leaf_dtype": slim, "value_scale": scale}
+
+    header = {key: _json_ready(artifact[key]) for key in METADATA_KEYS if key in artifact}
+    if "calibration_data" in artifact:  # the drift monitor's confidence reference
+        header["calibration_confidence"] = confidence_shares(
+            engine, artifact["calibration_data"]["proba"])
+    header.update({
+        "format": FORMAT_NAME,
+        "format_version": FORMAT_VERSION,
+        **layout,
+        "feature_importances": _json_ready(forest.feature_importances_),
+        "arrays": {
+            name: {"file": f"{name}.npy", "dtype": array.dtype.str, "shape": list(array.shape)}
+            for name, array in arrays.items()
+        },
+    })
+
+    directory = Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent))
+    try:
+        # mkdtemp makes it 0700; other users' servers must be able to map it.
+        os.chmod(staging, 0o777 & ~_umask())
+        for name, array in arrays.items():
+            np.save(staging / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+        (staging / HEADER).write_text(json.dumps(header, indent=1))
+        previous = directory.with_name(f".{directory.name}.old")
+        if directory.exists():
+            shutil.rmtree(previous, ignore_errors=True)
+            os.replace(directory, previous)
+        os.replace(staging, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return directory
+
+
+def load_arrays(directory: Path, mmap: bool = True) -> dict[str, Any]:
+    """Open an array artefact as an artefact dict with `_engine` attached."""
+    directory = Path(directory)
+    header = json.loads((directory / HEADER).read_text())
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(f"{directory} is not a {FORMAT_NAME} directory")
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"{directory} has format version {header.get('format_version')}; "
+            f"this code reads version {FORMAT_VERSION}"
+        )
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        array = np.load(directory / spec["file"], mmap_mode="r" if mmap else None,
+                        allow_pickle=False)
+        if array.dtype.str != spec["dtype"] or list(array.shape) != spec["shape"]:
+            raise ValueError(f"{spec['file']} does not match the header")
+        # A plain ndarray view of the map: same pages, without np.memmap's
+        # per-operation overhead on the single-row path.
+        arrays[name] = np.asarray(array)
+
+    artifact = {key: header[key] for key in METADATA_KEYS if key in header}
+    artifact.update({
+        "format": FORMAT_NAME,
+        "feature_importances": header.get("feature_importances"),
+        "_engine": engine_from_arrays(header, arrays),
+        "_cover": arrays.get("cover"),
+        "_path": str(directory),
+    })
+    return artifact
+
+
+def compare_engines(reference: CompiledForest, candidate: CompiledForest, X: Any) -> dict:
+    """How far `candidate`'s calibrated probabilities stray from `reference`'s."""
+    expected, got = reference.predict_proba(X), candidate.predict_proba(X)
+    return {
+        "rows": int(len(expected)),
+        "max_abs_diff": float(np.abs(expected - got).max()),
+        "argmax_mismatches": int((expected.argmax(1) != got.argmax(1)).sum()),
+    }
+
+
+def directory_mb(directory: Path) -> float:
+    return round(sum(p.stat().st_size for p in Path(directory).iterdir()) / 1e6, 3)
+
+
+def range_rows(artifact: dict[str, Any], n_rows: int, seed: int = 0) -> np.ndarray:
+    """Rows drawn uniformly inside each feature's trained range (feature_stats)."""
+    stats = artifact["feature_stats"]
+    low = np.array([stats[f]["min"] for f in artifact["feature_names"]])
+    high = np.array([stats[f]["max"] for f in artifact["feature_names"]])
+    return low + np.random.default_rng(seed).random((n_rows, len(low))) * (high - low)
+
+
+def export_slim(artifact: dict[str, Any], directory: Path, leaf_dtype: str, X: Any = None,
+                tolerance: float = SLIM_TOLERANCE,
+                argmax_tolerance: float = SLIM_ARGMAX_TOLERANCE,
+                sampled_rows: int = SLIM_SAMPLED_ROWS) -> dict[str, Any]:
+    """Write the slim layout and check it against the full engine.
+
+    The check runs on `X` (the training rows, if given) and on `sampled_rows`
+    rows drawn inside feature_stats, separately. Raises ValueError, and
+    removes the export, if on either set the calibrated probabilities move by
+    more than `tolerance` or more than `argmax_tolerance` of the rows change
+    top-1 crop. The record's top-level figures are the worse of the two.
+    """
+    reference = artifact.get("_engine") or compile_artifact(artifact)
+    export_arrays(artifact, directory, slim=leaf_dtype)
+    candidate = load_arrays(directory)["_engine"]
+    checks = {"sampled": compare_engines(reference, candidate, range_rows(artifact, sampled_rows))}
+    if X is not None:
+        checks["training"] = compare_engines(reference, candidate, X)
+    record = {
+        "rows": sum(c["rows"] for c in checks.values()),
+        "max_abs_diff": max(c["max_abs_diff"] for c in checks.values()),
+        "argmax_mismatches": sum(c["argmax_mismatches"] for c in checks.values()),
+        **checks,
+        "leaf_dtype": leaf_dtype, "mb": directory_mb(directory),
+        "tolerance": tolerance, "argmax_tolerance": argmax_tolerance,
+    }
+    for name, check in checks.items():
+        if (check["max_abs_diff"] > tolerance
+                or check["argmax_mismatches"] > argmax_tolerance * check["rows"]):
+            shutil.rmtree(directory, ignore_errors=True)
+            raise ValueError(
+                f"slim {leaf_dtype} export is outside tolerance on the {name} rows: max |dp| "
+                f"{check['max_abs_diff']:.2e} (allowed {tolerance:g}), "
+                f"{check['argmax_mismatches']} of {check['rows']} top-1 changes "
+                f"(allowed {argmax_tolerance:.2%})")
+    return record
+
+
+def main() -> None:
+    import joblib
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("model", help="joblib artefact to convert")
+    ap.add_argument("--out", help="output directory (default: <model>.arrays next to it)")
+    ap.add_argument("--slim", choices=list(SLIM_DTYPES), help="write the slim serving layout")
+    ap.add_argument("--data", help="CSV to verify a slim export on besides the sampled rows "
+                                   "(e.g. the training data)")
+    ap.add_argument("--slim-tolerance", type=float, default=SLIM_TOLERANCE,
+                    help="largest calibrated probability change allowed")
+    args = ap.parse_args()
+
+    source = Path(args.model)
+    target = Path(args.out) if args.out else source.with_suffix(".slim" if args.slim else ".arrays")
+    artifact = joblib.load(source)
+    if args.slim:
+        X = None
+        if args.data:
+            import pandas as pd
+
+            X = pd.read_csv(args.data)[artifact["feature_names"]].to_numpy(dtype=float)
+        try:
+            record = export_slim(artifact, target, args.slim, X, tolerance=args.slim_tolerance)
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
+        for name in ("training", "sampled"):
+            if name in record:
+                check = record[name]
+                print(f"verified on {check['rows']:,} {name} rows: max |dp| "
+                      f"{check['max_abs_diff']:.2e}, {check['argmax_mismatches']} top-1 changes")
+    else:
+        export_arrays(artifact, target, slim=args.slim)
+    started = time.perf_counter()
+    load_arrays(target)
+    print(f"wrote {target} ({directory_mb(target):.2f} MB, loads in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+audit.py
+========
+Append-only record of every recommendation: what was asked, what the model
+said, which artefact said it and how long it took.
+
+One process-wide log, `AUDIT`, is shared by the app and the HTTP service.
+The request path only enqueues:
+
+    AUDIT.record(source="app", variant=variant, created_utc=artifact["created_utc"],
+                 inputs=values, proba=probabilities, crop=crop, rule="rice/jute",
+                 latency_ms=elapsed_ms)
+
+which stamps the time and puts a dict on a bounded queue (a few µs; see
+`python audit.py bench`). Values are kept as given, so numpy arrays are not
+converted on the request path. A daemon thread wakes every second, or as
+soon as a batch's worth is queued, drains the queue in batches and does the
+rest:
+
+  * serialises each batch and appends it to the current JSONL segment
+    (audit-<utc start>-<pid>.jsonl) in one write, then flushes and fsyncs,
+    so a crash loses at most the last second of records, and a torn last
+    line is the only damage a reader can see (`read_records` skips it)
+  * rotates to a new segment once the current one passes CROP_AUDIT_ROTATE_MB
+    or CROP_AUDIT_ROTATE_SECONDS
+  * with CROP_AUDIT_FORMAT=parquet, compacts each closed segment into
+    <segment>.parquet (written aside and renamed into place) and removes the
+    JSONL; segments left behind by a process that died are compacted on the
+    next start
+
+Backpressure: the queue holds at most CROP_AUDIT_QUEUE records. When it is
+full, policy "drop" (the default) drops the new record and counts it, so a
+slow disk never slows a request; policy "block" waits up to
+CROP_AUDIT_BLOCK_MS for room first. Callers on an event loop pass
+`wait=False`, which drops under either policy: serve.py does, since a
+blocking put there would stall every connection, not one request.
+
+Unless CROP_AUDIT_DIR is set the log is disabled and `record()` returns
+immediately. Queue depth and the written/dropped totals are exported as
+telemetry gauges (telemetry.py).
+
+Usage
+-----
+    python audit.py bench --records 20000 --rate 2000   # per-record overhead in µs
+    python audit.py compact audit/                  # JSONL segments -> Parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+
+from telemetry import TELEMETRY
+
+FORMATS = ("jsonl", "parquet")
+POLICIES = ("drop", "block")
+BATCH_RECORDS = 512
+FLUSH_SECONDS = 1.0
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"cannot serialise {type(value).__name__}")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_records(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Records of one JSONL segment; a torn final line from a crash is skipped."""
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if not line.endswith("\n"):
+                return  # the write that was under way when the process died
+            yield json.loads(line)
+
+
+def compact(segment: Path) -> Path:
+    """Rewrite a closed JSONL segment as Parquet next to it, then remove it."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    target = segment.with_suffix(".parquet")
+    records = list(read_records(segment))
+    if records:
+        fd, staging = tempfile.mkstemp(prefix=f".{target.name}.", dir=segment.parent)
+        os.close(fd)
+        try:
+            pq.write_table(pa.Table.from_pylist(records), staging)
+            os.replace(staging, target)
+        except BaseException:
+            Path(staging).unlink(missing_ok=True)
+            raise
+    segment.unlink()
+    return target
+
+
+class AuditLog:
+    """Bounded queue in front of a background writer of rotating segments."""
+
+    def __init__(self, directory: str | Path | None, fmt: str = "jsonl", policy: str = "drop",
+                 max_queue: int = 10_000, block_ms: float = 50.0, batch: int = BATCH_RECORDS,
+                 flush_seconds: float = FLUSH_SECONDS, rotate_mb: float = 64.0,
+                 rotate_seconds: float = 3600.0, fsync: bool = True):
+        if fmt not in FORMATS:
+            raise ValueError(f"audit format must be one of {FORMATS}, got {fmt!r}")
+        if policy not in POLICIES:
+            raise ValueError(f"audit policy must be one of {POLICIES}, got {policy!r}")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401  fail at start-up, not in the writer thread
+        self.directory = Path(directory) if directory else None
+        self.enabled = self.directory is not None
+        self.fmt, self.policy = fmt, policy
+        self.block_seconds = block_ms / 1000
+        self.batch, self.flush_seconds = batch, flush_seconds
+        self.rotate_bytes, self.rotate_seconds = rotate_mb * 2 ** 20, rotate_seconds
+        self.fsync = fsync
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._count_lock = threading.Lock()  # enqueued/dropped: request threads and the writer
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._segment: Path | None = None
+        self._handle = None
+        self._opened = 0.0
+        self.enqueued = self.written = self.dropped = self.batches = 0
+        self.last_flush_ms: float | None = None
+        self.errors: list[str] = []
+        if self.enabled:
+            TELEMETRY.add_collector(self._gauges)
+
+    @classmethod
+    def from_env(cls) -> "AuditLog":
+        env = os.environ.get
+        return cls(env("CROP_AUDIT_DIR") or None,
+                   fmt=env("CROP_AUDIT_FORMAT", "jsonl").lower(),
+                   policy=env("CROP_AUDIT_POLICY", "drop").lower(),
+                   max_queue=int(env("CROP_AUDIT_QUEUE", "10000")),
+                   block_ms=float(env("CROP_AUDIT_BLOCK_MS", "50")),
+                   rotate_mb=float(env("CROP_AUDIT_ROTATE_MB", "64")),
+                   rotate_seconds=float(env("CROP_AUDIT_ROTATE_SECONDS", "3600")))
+
+    # -- request path ------------------------------------------------------- #
+
+    def record(self, *, wait: bool = True, **fields: Any) -> bool:
+        """Enqueue one record; False if it was dropped (or the log is disabled).
+
+        `wait=False` never blocks, whatever the policy.
+        """
+        if not self.enabled:
+            return False
+        if self._thread is None:
+            self.start()
+        fields["ts"] = time.time()
+        try:
+            if wait and self.policy == "block":
+                self._queue.put(fields, timeout=self.block_seconds)
+            else:
+                self._queue.put_nowait(fields)
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+        with self._count_lock:
+            self.enqueued += 1
+            full_batch = self.enqueued % self.batch == 0
+        if full_batch:
+            self._wake.set()
+        return True
+
+    # -- writer ------------------------------------------------------------- #
+
+    def start(self) -> None:
+        """Start the writer thread (idempotent); recovers orphaned segments first."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if self.fmt == "parquet":
+                for segment in sorted(self.directory.glob("audit-*.jsonl")):
+                    pid = segment.stem.rsplit("-", 1)[-1]
+                    if pid.isdigit() and not _pid_alive(int(pid)):
+                        compact(segment)
+            self._thread = threading.Thread(target=self._run, daemon=True, name="audit-writer")
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        # The writer sleeps between flushes instead of waiting on the queue, so
+        # enqueueing never hands the GIL to it; a full batch wakes it early.
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self._drain()
+            self._maybe_rotate()
+        self._drain()
+        self._close_segment()
+
+    def _drain(self) -> None:
+        while True:
+            records = []
+            while len(records) < self.batch:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not records:
+                return
+            try:
+                self._write(records)
+            except Exception as exc:  # keep draining; the batch is lost and counted
+                with self._count_lock:
+                    self.dropped += len(records)
+                self.errors.append(repr(exc))
+                del self.errors[:-10]
+
+    def _write(self, records: list[dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        payload = "".join(json.dumps(r, default=_json_default, separators=(",", ":")) + "\n"
+                          for r in records).encode("utf-8")
+        if self._handle is None:
+            self._open_segment()
+        self._handle.write(payload)
+        self._handle.flush()
+        if self.fsync:
+            os.fsync(self._handle.fileno())
+        self.written += len(records)
+        self.batches += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self._maybe_rotate()
+
+    def _open_segment(self) -> None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self._segment = self.directory / f"audit-{stamp}-{os.getpid()}.jsonl"
+        self._handle = open(self._segment, "ab")
+        self._opened = time.monotonic()
+
+    def _maybe_rotate(self) -> None:
+        if self._handle is None:
+            return
+        if (self._handle.tell() >= self.rotate_bytes
+                or time.monotonic() - self._opened >= self.rotate_seconds):
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self._handle is None:
+            return
+        self._handle.close()
+        self._handle = None
+        if self.fmt == "parquet":
+            try:
+                compact(self._segment)
+            except Exception as exc:  # the JSONL stays; compacted on a later start
+                self.errors.append(repr(exc))
+        self._segment = None
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Write everything queued, close the segment and stop the writer."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    # -- reporting ---------------------------------------------------------- #
+
+    def stats(self) -> dict[str, Any]:
+        return {"enabled": self.enabled, "directory": str(self.directory) if self.directory else None,
+                "format": self.fmt, "policy": self.policy, "queued": self._queue.qsize(),
+                "enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+                "batches": self.batches, "last_flush_ms": self.last_flush_ms,
+                "segment": self._segment.name if self._segment else None,
+                "errors": list(self.errors)}
+
+    def _gauges(self) -> dict[str, float]:
+        return {"audit_queue_depth": self._queue.qsize(), "audit_written": self.written,
+                "audit_dropped": self.dropped}
+
+
+AUDIT = AuditLog.from_env()
+
+
+def bench(records: int, fmt: str, policy: str, max_queue: int, rate: float = 0.0) -> dict[str, Any]:
+    """Per-record cost of `record()` with the writer running, in µs.
+
+    `rate` paces the records (per second); 0 floods the queue to exercise the
+    backpressure policy.
+    """
+    proba = np.random.default_rng(0).dirichlet(np.ones(22))
+    inputs = {"N": 90.0, "P": 42.0, "K": 43.0, "temperature": 20.9,
+              "humidity": 82.0, "ph": 6.5, "rainfall": 202.9}
+    with tempfile.TemporaryDirectory() as directory:
+        log = AuditLog(directory, fmt=fmt, policy=policy, max_queue=max_queue)
+        log.start()
+        costs = np.empty(records)
+        began = time.perf_counter()
+        for i in range(records):
+            if rate:
+                pause = began + i / rate - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+            started = time.perf_counter()
+            log.record(source="bench", variant="full", created_utc="2024-01-01T00:00:00+00:00",
+                       inputs=inputs, proba=proba, crop="rice", rule=None, latency_ms=1.0)
+            costs[i] = time.perf_counter() - started
+        drained = time.perf_counter()
+        log.close(timeout=60)
+        drain_seconds = time.perf_counter() - drained
+        files = sorted(p.name for p in Path(directory).iterdir())
+        size = sum(p.stat().st_size for p in Path(directory).iterdir())
+    us = costs * 1e6
+    return {"records": records, "rate": rate or None, "format": fmt, "policy": policy,
+            "max_queue": max_queue,
+            "record_us": {"mean": round(float(us.mean()), 2),
+                          **{f"p{q}": round(float(np.percentile(us, q)), 2) for q in (50, 99, 99.9)}},
+            "written": log.written, "dropped": log.dropped, "batches": log.batches,
+            "drain_seconds_after_last_record": round(drain_seconds, 3),
+            "files": files, "bytes": size}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = ap.add_subparsers(dest="command", required=True)
+    b = commands.add_parser("bench", help="measure the request-path cost of record()")
+    b.add_argument("--records", type=int, default=100_000)
+    b.add_argument("--format", choices=FORMATS, default="jsonl")
+    b.add_argument("--policy", choices=POLICIES, default="drop")
+    b.add_argument("--queue", type=int, default=10_000, help="queue bound")
+    b.add_argument("--rate", type=float, default=0.0, help="records per second (0 = as fast as possible)")
+    c = commands.add_parser("compact", help="convert closed JSONL segments to Parquet")
+    c.add_argument("directory", type=Path)
+    args = ap.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(bench(args.records, args.format, args.policy, args.queue, args.rate), indent=2))
+    else:
+        for segment in sorted(args.directory.glob("audit-*.jsonl")):
+            pid = segment.stem.rsplit("-", 1)[-1]
+            if pid.isdigit() and _pid_alive(int(pid)):
+                print(f"skipped {segment.name}: still being written")
+                continue
+            print(f"{segment.name} -> {compact(segment).name}")
+
+
+if __name__ == "__main__":
+    main()
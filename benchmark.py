@@ -0,0 +1,372 @@
+"""
+benchmark.py
+============
+Reproducible serving benchmarks for the deployment artefacts, with a baseline
+file and a regression check.
+
+Each artefact found in the model directory (crop_model_v2.pkl,
+crop_model_v2_reduced.pkl and their `.arrays` exports) is measured in a fresh
+process, so load time and memory are not flattered by an earlier load:
+
+    load_ms / compile_ms     joblib.load (or load_arrays) / engine compilation
+    single_row_ms            p50 / p95 / p99 of one-row predict_proba, serving path
+    sklearn_single_row_ms    the same through the pickled sklearn model
+    batch_rows_per_second    throughput at each of BATCH_SIZES
+    shap_precompute_ms       building tree_shap.ShapEngine
+    shap_single_row_ms       p50 / p95 / p99 of one-row attributions
+    rss_mb                   resident memory before load, after load, and peak
+
+Inputs are drawn with a fixed seed inside each artefact's feature_stats
+ranges, so runs are comparable without the dataset. Each artefact is
+measured in `--runs` fresh processes; every metric is the median over them,
+and `spread` records how far the gated ones moved between runs ((max - min)
+/ median). The baseline is written next to training_report.json and
+committed with it; --compare re-runs the suite and flags a gated metric
+(GATED_METRICS) only when it got worse by more than the tolerance plus the
+larger of the two runs' spreads, so a noisy machine widens the band instead
+of failing the check. Tail percentiles, sklearn's own timing and the
+interpreter's resident memory before loading are recorded but not gated.
+
+Usage
+-----
+    python benchmark.py                                  # -> benchmark_baseline.json
+    python benchmark.py --model-dir models --out models/benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json --tolerance 0.25 --runs 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+BASELINE_FILENAME = "benchmark_baseline.json"
+ARTIFACT_NAMES = (
+    "crop_model_v2.pkl", "crop_model_v2.arrays",
+    "crop_model_v2_reduced.pkl", "crop_model_v2_reduced.arrays",
+)
+BATCH_SIZES = (1, 10, 100, 1_000, 10_000)
+SINGLE_ROW_REPEATS = 500
+SKLEARN_REPEATS = 100
+SHAP_REPEATS = 200
+MIN_BATCH_SECONDS = 0.2
+SEED = 0
+RUNS = 5
+
+# Metrics where a larger number is an improvement; everything else is a cost.
+HIGHER_IS_BETTER = ("batch_rows_per_second", "shap_rows_per_second")
+# What --compare gates on: medians and throughput of this repo's serving paths,
+# load cost and memory after loading. A trailing "/" matches a whole group.
+GATED_METRICS = (
+    "load_ms", "compile_ms", "single_row_ms/p50", "batch_rows_per_second/",
+    "shap_precompute_ms", "shap_single_row_ms/p50", "shap_rows_per_second",
+    "rss_mb/after_load", "rss_mb/peak",
+)
+
+
+# --------------------------------------------------------------------------- #
+# Measurement                                                                 #
+# --------------------------------------------------------------------------- #
+
+
+def rss_mb() -> float | None:
+    """Current resident set size, from /proc where available."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)
+
+
+def _percentiles(seconds: list[float]) -> dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 4),
+        "p95": round(float(np.percentile(ms, 95)), 4),
+        "p99": round(float(np.percentile(ms, 99)), 4),
+    }
+
+
+def _timed(fn, repeats: int) -> list[float]:
+    fn()  # warm-up
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def _rows_per_second(fn, n_rows: int) -> float:
+    """Median throughput over enough repeats to fill MIN_BATCH_SECONDS."""
+    fn()
+    times, spent = [], 0.0
+    while len(times) < 3 or spent < MIN_BATCH_SECONDS:
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+        spent += times[-1]
+    return round(n_rows / float(np.median(times)), 1)
+
+
+def sample_inputs(artifact: dict[str, Any], n_rows: int, seed: int = SEED) -> np.ndarray:
+    """Rows drawn uniformly inside each feature's training range."""
+    rng = np.random.default_rng(seed)
+    stats = artifact["feature_stats"]
+    low = np.array([stats[f]["min"] for f in artifact["feature_names"]])
+    high = np.array([stats[f]["max"] for f in artifact["feature_names"]])
+    return low + rng.random((n_rows, len(low))) * (high - low)
+
+
+def benchmark_artifact(path: str) -> dict[str, Any]:
+    """Every measurement for one artefact; meant to run in a fresh process."""
+    from inference import attach_engine, predict_proba
+    from tree_shap import ShapEngine
+
+    result: dict[str, Any] = {"artifact": Path(path).name}
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    if Path(path).is_dir():
+        from array_artifact import load_arrays
+
+        artifact = load_arrays(Path(path))
+        result["format"] = "arrays"
+        result["load_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    else:
+        import joblib
+
+        artifact = joblib.load(path)
+        result["format"] = "pickle"
+        result["load_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        started = time.perf_counter()
+        attach_engine(artifact)
+        result["compile_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    result["variant"] = artifact.get("variant")
+    result["created_utc"] = artifact.get("created_utc")
+    result["served_by"] = "engine" if artifact.get("_engine") is not None else "sklearn"
+    rss_loaded = rss_mb()
+
+    X = sample_inputs(artifact, max(BATCH_SIZES))
+    row = X[:1]
+    result["single_row_ms"] = _percentiles(
+        _timed(lambda: predict_proba(artifact, row), SINGLE_ROW_REPEATS))
+    if "calibrated" in artifact:
+        import pandas as pd
+
+        frame = pd.DataFrame(row, columns=artifact["feature_names"])
+        result["sklearn_single_row_ms"] = _percentiles(
+            _timed(lambda: artifact["calibrated"].predict_proba(frame), SKLEARN_REPEATS))
+    result["batch_rows_per_second"] = {
+        str(size): _rows_per_second(lambda: predict_proba(artifact, X[:size]), size)
+        for size in BATCH_SIZES
+    }
+
+    if artifact.get("_engine") is not None:
+        started = time.perf_counter()
+        explainer = ShapEngine.from_artifact(artifact, artifact["_engine"])
+        result["shap_precompute_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        best = artifact["_engine"].predict_proba(X[:1000]).argmax(axis=1)
+        result["shap_single_row_ms"] = _percentiles(
+            _timed(lambda: explainer.shap_values(row, best[0]), SHAP_REPEATS))
+        result["shap_rows_per_second"] = _rows_per_second(
+            lambda: explainer.shap_values(X[:1000], best), 1000)
+
+    result["rss_mb"] = {"before_load": rss_before, "after_load": rss_loaded,
+                        "peak": peak_rss_mb()}
+    return result
+
+
+def environment() -> dict[str, Any]:
+    """What a stored result depends on besides the code; compared across runs."""
+    import joblib
+    import sklearn
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scikit-learn": sklearn.__version__,
+        "joblib": joblib.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "system": platform.system(),
+    }
+
+
+def _higher_is_better(metric: str) -> bool:
+    return any(part in metric for part in HIGHER_IS_BETTER)
+
+
+def _median_of(runs: list[Any]) -> Any:
+    """Combine repeated results field by field, taking each metric's median."""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: _median_of([run[key] for run in runs if key in run]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return round(float(np.median(runs)), 4)
+    return first
+
+
+def _spread(runs: list[dict[str, Any]]) -> dict[str, float]:
+    """(max - min) / median of every gated metric across repeated results."""
+    flat = [_flatten(run) for run in runs]
+    out = {}
+    for metric in flat[0]:
+        values = [f[metric] for f in flat if metric in f]
+        middle = float(np.median(values))
+        if is_gated(metric) and middle:
+            out[metric] = round((max(values) - min(values)) / middle, 3)
+    return out
+
+
+def run_suite(paths: list[Path], runs: int = RUNS) -> dict[str, Any]:
+    """Benchmark each artefact `runs` times, each in its own spawned process."""
+    # Not multiprocessing.Pool: its daemonic workers make sklearn drop to n_jobs=1.
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for path in paths:
+        repeated = []
+        for _ in range(runs):
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                repeated.append(pool.submit(benchmark_artifact, str(path)).result())
+        results[path.name] = {**_median_of(repeated), "spread": _spread(repeated)}
+        print(f"benchmarked {path.name}", file=sys.stderr)
+    return {
+        "created_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {
+            "batch_sizes": list(BATCH_SIZES),
+            "single_row_repeats": SINGLE_ROW_REPEATS,
+            "sklearn_repeats": SKLEARN_REPEATS,
+            "shap_repeats": SHAP_REPEATS,
+            "seed": SEED,
+            "runs": runs,
+        },
+        "artifacts": results,
+    }
+
+
+# --------------------------------------------------------------------------- #
+# Comparison                                                                  #
+# --------------------------------------------------------------------------- #
+
+
+def _flatten(value: Any, prefix: str = "") -> dict[str, float]:
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            out.update(_flatten(item, f"{prefix}/{key}" if prefix else str(key)))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def is_gated(metric: str) -> bool:
+    """Whether an artefact-relative metric path is one --compare checks."""
+    return any(metric == gated or (gated.endswith("/") and metric.startswith(gated))
+               for gated in GATED_METRICS)
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any],
+            tolerance: float) -> tuple[list[dict[str, Any]], list[str]]:
+    """Gated metrics worse than the baseline beyond tolerance plus run-to-run spread, and notes."""
+    notes = []
+    for key, value in baseline.get("environment", {}).items():
+        if current["environment"].get(key) != value:
+            notes.append(f"environment {key}: {value} -> {current['environment'].get(key)}")
+    regressions = []
+    for name, entry in baseline["artifacts"].items():
+        fresh = current["artifacts"].get(name)
+        if fresh is None:
+            notes.append(f"{name}: not found in this run")
+            continue
+        if fresh.get("created_utc") != entry.get("created_utc"):
+            notes.append(f"{name}: retrained ({entry.get('created_utc')} -> {fresh.get('created_utc')})")
+        before, after = _flatten(entry), _flatten(fresh)
+        for metric, old in sorted(before.items()):
+            if metric not in after or old == 0 or not is_gated(metric):
+                continue
+            new = after[metric]
+            change = (old - new) / old if _higher_is_better(metric) else (new - old) / old
+            band = tolerance + max(entry.get("spread", {}).get(metric, 0.0),
+                                   fresh.get("spread", {}).get(metric, 0.0))
+            if change > band:
+                regressions.append({"metric": f"{name}/{metric}", "baseline": old, "current": new,
+                                    "worse_by": round(change, 3), "allowed": round(band, 3)})
+    return regressions, notes
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("artifacts", nargs="*", help="artefacts to measure (default: all found in --model-dir)")
+    ap.add_argument("--model-dir", default=".", help="where to look for the artefacts")
+    ap.add_argument("--out", help=f"baseline to write (default: <model-dir>/{BASELINE_FILENAME})")
+    ap.add_argument("--compare", metavar="BASELINE", help="compare against a baseline instead of writing one")
+    ap.add_argument("--tolerance", type=float, default=0.25,
+                    help="relative slowdown that counts as a regression (default 0.25)")
+    ap.add_argument("--runs", type=int, default=RUNS,
+                    help=f"fresh processes per artefact; metrics are medians over them (default {RUNS})")
+    ap.add_argument("--save", metavar="PATH", help="with --compare, also write this run here")
+    args = ap.parse_args()
+
+    model_dir = Path(args.model_dir)
+    if args.artifacts:
+        paths = [Path(p) for p in args.artifacts]
+    elif args.compare:
+        names = json.loads(Path(args.compare).read_text())["artifacts"]
+        paths = [model_dir / name for name in names if (model_dir / name).exists()]
+    else:
+        paths = [model_dir / name for name in ARTIFACT_NAMES if (model_dir / name).exists()]
+    if not paths:
+        raise SystemExit(f"no artefacts found in {model_dir}")
+
+    current = run_suite(paths, args.runs)
+    for name, entry in current["artifacts"].items():
+        print(f"{name:30} load {entry['load_ms']:8.1f} ms | row p50 {entry['single_row_ms']['p50']:.3f} "
+              f"p99 {entry['single_row_ms']['p99']:.3f} ms | "
+              f"{entry['batch_rows_per_second'][str(max(BATCH_SIZES))]:,.0f} rows/s | "
+              f"shap p50 {entry.get('shap_single_row_ms', {}).get('p50', float('nan')):.3f} ms | "
+              f"peak {entry['rss_mb']['peak']} MB")
+
+    if not args.compare:
+        out = Path(args.out) if args.out else model_dir / BASELINE_FILENAME
+        out.write_text(json.dumps(current, indent=2))
+        print(f"wrote {out}")
+        return
+
+    baseline = json.loads(Path(args.compare).read_text())
+    regressions, notes = compare(baseline, current, args.tolerance)
+    for note in notes:
+        print(f"note: {note}")
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: {r['baseline']:g} -> {r['current']:g} "
+              f"({r['worse_by'] * 100:.0f}% worse, {r['allowed'] * 100:.0f}% allowed)")
+    if args.save:
+        Path(args.save).write_text(json.dumps(current, indent=2))
+    print(f"{len(regressions)} regression(s) beyond {args.tolerance * 100:.0f}% plus run-to-run spread")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+build_large.py
+==============
+Train and evaluate from a column store (column_store.py) in bounded memory.
+
+build_model.py's protocol (30 CV fits, a 5-fold isotonic refit and 10-fold
+out-of-fold predictions over a float64 DataFrame) is what the paper reports
+and what a 2,200-row dataset can afford. For millions of rows this script
+keeps the deployed model identical in form -- MinMaxScaler + Random Forest
+with an isotonic calibrator, compiled and exported the same way -- and
+bounds everything that grows with the row count:
+
+  * the rows are split once, stratified on the label codes, into training
+    rows and two samples of at most --eval-rows: one the isotonic layer is
+    fitted on, one held out for the metrics
+  * the scaler is fitted from the training rows' min / max (one streaming
+    pass), and the scaled training matrix is written chunk by chunk to a
+    float32 scratch memmap, the dtype the forest splits on, so the forest
+    reads it without a copy
+  * each tree is grown on a bootstrap of at most --max-tree-rows rows
+    (RandomForestClassifier max_samples), so tree size and build memory stay
+    flat while the row count grows; what still grows is the per-row cost of
+    labels, bootstrap weights and the mapped training matrix (about 100 bytes
+    a row at 3M rows)
+  * probabilities for calibration and evaluation are computed a block of
+    rows at a time by the fitted estimators themselves; the compiled engine's
+    routing index grows with the number of distinct thresholds, which a large
+    training set multiplies, so it is only built to export
+  * the .arrays export is therefore off unless --arrays asks for it: it
+    needs that routing index, whose split_masks table grows about with
+    thresholds x trees, and at 220k rows it took peak RSS from about 300 MB
+    to 1.0-1.4 GB (a 365 MB split_masks.npy next to a 30 MB pickle). The
+    pickle compiles at load time as usual; training_report.json records
+    whether arrays were written, and `scaling --arrays` measures the export
+    stage too
+  * feature_stats and feature_sketches come from the store's ingestion pass
+
+Wall time and peak RSS are recorded per stage in training_report.json.
+`scaling` runs ingestion and training in fresh processes for several row
+counts of one CSV and tabulates both against the row count.
+
+Usage
+-----
+    python column_store.py national.csv --out national.cols
+    python build_large.py train national.cols --outdir models --max-tree-rows 250000
+    python build_large.py scaling national.csv --rows 100000 1000000 4000000 --out scaling.json
+
+Outputs (in --outdir)
+---------------------
+    crop_model_v2.pkl, crop_model_v2_reduced.pkl   as build_model.py
+    *.arrays/              with --arrays only
+    training_report.json   holdout metrics plus row counts, seconds and peak
+                           RSS per stage, per variant
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import (
+    accuracy_score,
+    classification_report,
+    f1_score,
+    log_loss,
+    precision_score,
+    recall_score,
+)
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler
+
+from array_artifact import export_arrays
+from build_model import (
+    FULL_FEATURES,
+    RANDOM_STATE,
+    REDUCED_FEATURES,
+    RF_PARAMS,
+    expected_calibration_error,
+    package_artifact,
+)
+from column_store import CHUNK_ROWS, ColumnStore, peak_rss_mb
+from fold_engine import calibrated_from_folds
+
+MAX_TREE_ROWS = 250_000
+EVAL_ROWS = 100_000
+EVAL_FRACTION = 0.2          # per sample, when the store is too small for EVAL_ROWS
+
+PREDICT_ROWS = 8192          # rows per predict_proba call in calibration and evaluation
+
+TRAIN, CALIBRATION, TEST = 0, 1, 2
+
+
+class Stages:
+    """Seconds and peak RSS at the end of each named stage."""
+
+    def __init__(self) -> None:
+        self.records: dict[str, dict[str, float]] = {}
+        self._last = time.perf_counter()
+
+    def done(self, name: str) -> None:
+        now = time.perf_counter()
+        self.records[name] = {"seconds": round(now - self._last, 3), "peak_rss_mb": peak_rss_mb()}
+        self._last = now
+
+
+# --------------------------------------------------------------------------- #
+# Training                                                                    #
+# --------------------------------------------------------------------------- #
+
+
+def split_rows(store: ColumnStore, eval_rows: int, seed: int = RANDOM_STATE) -> np.ndarray:
+    """A uint8 role per row: TRAIN, or one of two class-stratified samples.
+
+    Each sample holds about `eval_rows` rows (fewer for a small store), drawn
+    per class in proportion to the class counts; every class keeps at least
+    one training row.
+    """
+    rng = np.random.default_rng(seed)
+    n = store.n_rows
+    size = min(eval_rows, int(n * EVAL_FRACTION))
+    role = np.zeros(n, dtype=np.uint8)
+    labels = store.labels
+    for code in range(len(store.classes)):
+        rows = np.flatnonzero(labels == code)
+        k = min(int(round(size * len(rows) / n)), (len(rows) - 1) // 2)
+        if k <= 0:
+            continue
+        chosen = rng.choice(rows, 2 * k, replace=False)
+        role[chosen[:k]] = CALIBRATION
+        role[chosen[k:]] = TEST
+    return role
+
+
+def fit_scaler(store: ColumnStore, features: list[str], role: np.ndarray,
+               chunk_rows: int) -> MinMaxScaler:
+    """The MinMaxScaler a pipeline fit on the training rows would learn, streamed."""
+    low = np.full(len(features), np.inf)
+    high = np.full(len(features), -np.inf)
+    n = 0
+    for rows in store.chunks(chunk_rows):
+        X = store.matrix(features, rows)[role[rows] == TRAIN]
+        if len(X):
+            low = np.minimum(low, X.min(axis=0))
+            high = np.maximum(high, X.max(axis=0))
+            n += len(X)
+    scaler = MinMaxScaler().fit(pd.DataFrame([low, high], columns=features))
+    scaler.n_samples_seen_ = n
+    return scaler
+
+
+def write_training_matrix(store: ColumnStore, features: list[str], role: np.ndarray,
+                          scaler: MinMaxScaler, path: Path,
+                          chunk_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Scaled float32 training rows in a memmap at `path`, and their label codes."""
+    n_train = int((role == TRAIN).sum())
+    y = np.empty(n_train, dtype=np.int16)
+    labels = store.labels
+    at = 0
+    with open(path, "wb") as handle:
+        for rows in store.chunks(chunk_rows):
+            keep = role[rows] == TRAIN
+            raw = store.matrix(features, rows)[keep].astype(np.float64)
+            (raw * scaler.scale_ + scaler.min_).astype(np.float32).tofile(handle)
+            y[at:at + len(raw)] = labels[rows][keep]
+            at += len(raw)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(n_train, len(features))), y
+
+
+def blocked_proba(model: Any, X: np.ndarray, features: list[str]) -> np.ndarray:
+    """model.predict_proba on X as a feature frame, PREDICT_ROWS rows at a time."""
+    return np.concatenate([model.predict_proba(pd.DataFrame(X[i:i + PREDICT_ROWS], columns=features))
+                           for i in range(0, len(X), PREDICT_ROWS)])
+
+
+def holdout_metrics(y: np.ndarray, proba: np.ndarray, cal_proba: np.ndarray,
+                    classes: np.ndarray) -> dict[str, Any]:
+    """build_model.evaluate's holdout block, for one held-out sample."""
+    y_hat = classes[proba.argmax(axis=1)]
+    ece_raw = expected_calibration_error(y, proba, classes)
+    ece_cal = expected_calibration_error(y, cal_proba, classes)
+    return {
+        "holdout_accuracy": round(accuracy_score(y, y_hat) * 100, 3),
+        "holdout_errors": int((y_hat != y).sum()),
+        "holdout_precision_macro": round(precision_score(y, y_hat, average="macro", zero_division=0) * 100, 3),
+        "holdout_recall_macro": round(recall_score(y, y_hat, average="macro", zero_division=0) * 100, 3),
+        "holdout_f1_macro": round(f1_score(y, y_hat, average="macro", zero_division=0) * 100, 3),
+        "holdout_log_loss_uncalibrated": round(float(log_loss(y, proba, labels=list(classes))), 4),
+        "holdout_log_loss_calibrated": round(float(log_loss(y, cal_proba, labels=list(classes))), 4),
+        "holdout_ece_uncalibrated": round(ece_raw, 4),
+        "holdout_ece_calibrated": round(ece_cal, 4),
+        "holdout_classification_report": classification_report(y, y_hat, output_dict=True,
+                                                               zero_division=0),
+    }
+
+
+def train(store: ColumnStore, features: list[str], variant: str, scratch: Path,
+          params: dict | None = None, max_tree_rows: int = MAX_TREE_ROWS,
+          eval_rows: int = EVAL_ROWS, chunk_rows: int = CHUNK_ROWS) -> tuple[dict, dict]:
+    """Fit, calibrate and evaluate one variant from `store`; returns (artifact, report)."""
+    stages = Stages()
+    role = split_rows(store, eval_rows)
+    calibration_rows = np.flatnonzero(role == CALIBRATION)
+    test_rows = np.flatnonzero(role == TEST)
+    stages.done("split")
+
+    scaler = fit_scaler(store, features, role, chunk_rows)
+    X, y = write_training_matrix(store, features, role, scaler, scratch / f"{variant}.f32", chunk_rows)
+    stages.done("scale")
+
+    per_tree = max_tree_rows if max_tree_rows < len(y) else None
+    forest = RandomForestClassifier(**{**(params or RF_PARAMS), "max_samples": per_tree}).fit(X, y)
+    # Fitted on class codes; the artefact carries crop names, as build_model's does.
+    forest.classes_ = store.classes[forest.classes_]
+    for tree in forest.estimators_:
+        tree.classes_ = forest.classes_
+    pipeline = Pipeline([("scaler", scaler), ("rf", forest)])
+    del X
+    stages.done("fit")
+
+    X_cal = store.matrix(features, calibration_rows).astype(np.float64)
+    y_cal = store.classes[store.labels[calibration_rows]]
+    cal_proba = blocked_proba(pipeline, X_cal, features)
+    calibrated = calibrated_from_folds(pipeline, cal_proba, y_cal, method="isotonic",
+                                       cv="prefit", classes=pipeline.classes_)
+    if calibrated is None:
+        calibrated = CalibratedClassifierCV(pipeline, method="isotonic", cv="prefit").fit(
+            pd.DataFrame(X_cal, columns=features), y_cal)
+    stages.done("calibrate")
+
+    X_test = store.matrix(features, test_rows).astype(np.float64)
+    y_test = store.classes[store.labels[test_rows]]
+    metrics = holdout_metrics(y_test, blocked_proba(pipeline, X_test, features),
+                              blocked_proba(calibrated, X_test, features), np.asarray(pipeline.classes_))
+    stages.done("evaluate")
+
+    artifact = package_artifact(
+        features, variant, pipeline, calibrated, metrics,
+        stats={f: store.feature_stats[f] for f in features},
+        sketches=store.sketches(features),
+        n_records=store.n_rows,
+        calibration=(cal_proba, np.searchsorted(pipeline.classes_, y_cal)),
+    )
+    report = {
+        "rows": store.n_rows,
+        "train_rows": len(y),
+        "calibration_rows": len(calibration_rows),
+        "test_rows": len(test_rows),
+        "max_tree_rows": per_tree,
+        "nodes": int(sum(tree.tree_.node_count for tree in forest.estimators_)),
+        "stages": stages.records,
+    }
+    return artifact, report
+
+
+def train_store(directory: Path, outdir: Path, skip_reduced: bool = False,
+                arrays: bool = False, max_tree_rows: int = MAX_TREE_ROWS,
+                eval_rows: int = EVAL_ROWS, chunk_rows: int = CHUNK_ROWS) -> dict[str, Any]:
+    """Train every variant from the store at `directory` into `outdir`.
+
+    `arrays` also writes the .arrays exports, whose routing index dominates
+    peak memory on large stores.
+    """
+    started = time.perf_counter()
+    store = ColumnStore(directory)
+    outdir.mkdir(parents=True, exist_ok=True)
+    variants = [("full", FULL_FEATURES, "crop_model_v2")]
+    if not skip_reduced:
+        variants.append(("reduced", REDUCED_FEATURES, "crop_model_v2_reduced"))
+
+    report: dict[str, Any] = {"store": str(directory), "rows": store.n_rows,
+                              "ingest": store.manifest["ingest"], "dropped": store.manifest["dropped"],
+                              "arrays": arrays}
+    scratch = Path(tempfile.mkdtemp(prefix=".scratch-", dir=outdir))
+    try:
+        for variant, features, name in variants:
+            artifact, resources = train(store, features, variant, scratch,
+                                        max_tree_rows=max_tree_rows, eval_rows=eval_rows,
+                                        chunk_rows=chunk_rows)
+            stages = Stages()
+            path = outdir / f"{name}.pkl"
+            joblib.dump(artifact, path, compress=0)
+            if arrays:
+                export_arrays(artifact, outdir / f"{name}.arrays")
+            stages.done("export")
+            resources["stages"].update(stages.records)
+            report[variant] = {**artifact["metrics"], "resources": resources}
+            m = artifact["metrics"]
+            print(f"{variant}: {resources['train_rows']:,} training rows, trees on "
+                  f"{resources['max_tree_rows'] or 'all'} rows each; holdout accuracy "
+                  f"{m['holdout_accuracy']:.2f}% on {resources['test_rows']:,}, ECE "
+                  f"{m['holdout_ece_uncalibrated']:.4f} / {m['holdout_ece_calibrated']:.4f}; "
+                  + ", ".join(f"{k} {v['seconds']:.1f} s" for k, v in resources["stages"].items())
+                  + f"; peak RSS {peak_rss_mb():.0f} MB")
+            print(f"wrote {path} ({path.stat().st_size / 1e6:.2f} MB)")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["peak_rss_mb"] = peak_rss_mb()
+    (outdir / "training_report.json").write_text(json.dumps(report, indent=2))
+    print(f"wrote {outdir / 'training_report.json'}")
+    return report
+
+
+# --------------------------------------------------------------------------- #
+# Scaling                                                                     #
+# --------------------------------------------------------------------------- #
+
+
+def scaling(csv: Path, row_counts: list[int], scratch: Path, max_tree_rows: int,
+            eval_rows: int, chunk_rows: int, arrays: bool = False) -> list[dict[str, Any]]:
+    """Ingest and train on the first N rows of `csv` for each N, each in a fresh process.
+
+    Fresh processes make every peak RSS that run's own (ru_maxrss only grows).
+    `arrays` includes the .arrays export; its stage's peak is reported apart
+    from training's.
+    """
+    here = Path(__file__).resolve().parent
+    rows_out = []
+    for n in row_counts:
+        run = scratch / str(n)
+        subprocess.run([sys.executable, str(here / "column_store.py"), str(csv), "--out",
+                        str(run / "store"), "--limit", str(n), "--chunk-rows", str(chunk_rows)],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([sys.executable, str(here / "build_large.py"), "train", str(run / "store"),
+                        "--outdir", str(run / "models"), "--skip-reduced",
+                        "--max-tree-rows", str(max_tree_rows), "--eval-rows", str(eval_rows),
+                        "--chunk-rows", str(chunk_rows), *(["--arrays"] if arrays else [])],
+                       check=True, stdout=subprocess.DEVNULL)
+        report = json.loads((run / "models" / "training_report.json").read_text())
+        full = report["full"]
+        rows_out.append({
+            "rows": report["rows"],
+            "ingest_seconds": report["ingest"]["seconds"],
+            "ingest_peak_rss_mb": report["ingest"]["peak_rss_mb"],
+            "train_seconds": report["seconds"],
+            "train_peak_rss_mb": report["peak_rss_mb"],
+            "fit_peak_rss_mb": full["resources"]["stages"]["evaluate"]["peak_rss_mb"],
+            "arrays": arrays,
+            "stages": full["resources"]["stages"],
+            "holdout_accuracy": full["holdout_accuracy"],
+            "store_mb": round(sum(p.stat().st_size for p in (run / "store").iterdir()) / 1e6, 1),
+        })
+        shutil.rmtree(run, ignore_errors=True)
+        r = rows_out[-1]
+        print(f"{r['rows']:>11,} rows | ingest {r['ingest_seconds']:7.1f} s {r['ingest_peak_rss_mb']:6.0f} MB"
+              f" | train {r['train_seconds']:7.1f} s {r['train_peak_rss_mb']:6.0f} MB"
+              f" ({r['fit_peak_rss_mb']:.0f} MB before export{', arrays' if arrays else ''})"
+              f" | holdout {r['holdout_accuracy']:.2f}%", flush=True)
+    return rows_out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    def bounds(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--max-tree-rows", type=int, default=MAX_TREE_ROWS,
+                       help="bootstrap rows per tree (the forest's max_samples)")
+        p.add_argument("--eval-rows", type=int, default=EVAL_ROWS,
+                       help="rows in each of the calibration and holdout samples")
+        p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per streaming chunk")
+
+    t = sub.add_parser("train", help="train and export from a column store")
+    t.add_argument("store", type=Path, help="column store directory (column_store.py)")
+    t.add_argument("--outdir", type=Path, default=Path("models"), help="directory for the artefacts")
+    t.add_argument("--skip-reduced", action="store_true", help="do not export the 5-feature model")
+    t.add_argument("--arrays", action="store_true",
+                   help="also write the pickle-free array exports (peak RSS grows with the routing index)")
+    bounds(t)
+
+    s = sub.add_parser("scaling", help="time and peak memory against the row count")
+    s.add_argument("csv", type=Path, help="dataset CSV with at least max(--rows) rows")
+    s.add_argument("--rows", type=int, nargs="+", required=True, help="row counts to run")
+    s.add_argument("--scratch", type=Path, default=None, help="working directory (default: a temp dir)")
+    s.add_argument("--out", type=Path, default=Path("scaling.json"), help="where to write the table")
+    s.add_argument("--arrays", action="store_true", help="include the .arrays export in each run")
+    bounds(s)
+    args = ap.parse_args()
+
+    if args.command == "train":
+        train_store(args.store, args.outdir, args.skip_reduced, args.arrays,
+                    args.max_tree_rows, args.eval_rows, args.chunk_rows)
+    else:
+        scratch = args.scratch or Path(tempfile.mkdtemp(prefix="crop-scaling-"))
+        table = scaling(args.csv, sorted(args.rows), scratch, args.max_tree_rows,
+                        args.eval_rows, args.chunk_rows, args.arrays)
+        args.out.write_text(json.dumps({"csv": str(args.csv), "max_tree_rows": args.max_tree_rows,
+                                        "eval_rows": args.eval_rows, "arrays": args.arrays,
+                                        "runs": table}, indent=2))
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
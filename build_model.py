@@ -8,19 +8,42 @@ following the protocol described in the manuscript:
   * Sec. 2.3  repeated stratified 10-fold CV (3 repeats), 80/20 held-out partition
   * Table 3   selected Random Forest configuration
   * Sec. 4.5  out-of-fold predictions over all 2,200 records
-  * Sec. 4.6  ablation-derived 5-feature reduced model (humidity, N, rainfall, K, P)
+  * Sec. 4.6  ablation-derived 5-feature reduced model (humidity, N, rainfall, K, P),
+              or re-derived from the data with --ablation
   * Sec. 4.7  isotonic recalibration -> the variant served in production
   * Sec. 5    single serialised artefact consumed by the Streamlit / Flutter tiers
 
+Every fit above is declared up front and trained once by fold_engine.py:
+identical (features, training rows) fits are shared, distinct ones run in a
+process pool, and all metrics are derived from the shared per-fold results.
+
 Usage
 -----
     python train_export_model.py --data Crop_recommendation.csv --outdir models
+    python train_export_model.py --search      # re-tune Table 3 on new data first
+    python train_export_model.py --ablation    # derive the reduced feature set from this data
+    python train_export_model.py --compress    # + the smallest forest within tolerance
+    python train_export_model.py --slim uint16 # + packed serving-only arrays, verified
+    python build_large.py train national.cols   # millions of rows, from column_store.py
+    python update_model.py --new season.csv --history Crop_recommendation.csv   # seasonal top-up
+    python benchmark.py --model-dir models --compare benchmark_baseline.json   # then check speed
 
 Outputs
 -------
     models/crop_model_v2.pkl           full 7-feature calibrated model
+    models/crop_model_v2.arrays/       the same model as mmap-able arrays (array_artifact.py)
     models/crop_model_v2_reduced.pkl   5-feature fallback model (optional)
+    models/crop_model_v2_reduced.arrays/
+    models/crop_model_v2_compressed.pkl  pruned, shallower forest (with --compress)
+    models/crop_model_v2_compressed.arrays/
+    models/crop_model_v2.slim/         serving-only packed arrays (with --slim uint16 etc.),
+    models/crop_model_v2_reduced.slim/ verified against the full engine on the training data
+                                       and on rows sampled inside feature_stats; served by
+                                       the registry in place of .arrays/ (registry.locate)
     models/training_report.json           the numbers to quote in the paper
+                                          (+ the search record with --search, the
+                                          ablation with --ablation and the
+                                          compression trade-off with --compress)
 """
 
 from __future__ import annotations
@@ -28,6 +51,7 @@ from __future__ import annotations
 import argparse
 import json
 import platform
+from functools import partial
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -35,6 +59,7 @@ import joblib
 import numpy as np
 import pandas as pd
 import sklearn
+from sklearn.base import clone
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import (
@@ -45,16 +70,17 @@ from sklearn.metrics import (
     precision_score,
     recall_score,
 )
-from sklearn.model_selection import (
-    RepeatedStratifiedKFold,
-    StratifiedKFold,
-    cross_val_predict,
-    cross_val_score,
-    train_test_split,
-)
+from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold, train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import MinMaxScaler
 
+from ablation import TOLERANCE_PP as ABLATION_TOLERANCE_PP, ablate
+from array_artifact import SLIM_DTYPES, SLIM_TOLERANCE, directory_mb, export_arrays, export_slim
+from compression import TOLERANCE_ECE, TOLERANCE_PP, compress_forest
+from fold_engine import FoldEngine, calibrated_from_folds, out_of_fold
+from param_search import successive_halving
+from sketches import FeatureSummary
+
 # --------------------------------------------------------------------------- #
 # Configuration                                                               #
 # --------------------------------------------------------------------------- #
@@ -64,6 +90,7 @@ RANDOM_STATE = 42
 
 FULL_FEATURES = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
 # Sec. 4.6 / Table 10: top five by permutation importance, 99.09% CV accuracy.
+# --ablation re-derives it from the data being trained on (ablation.py).
 REDUCED_FEATURES = ["N", "P", "K", "humidity", "rainfall"]
 TARGET = "label"
 
@@ -108,17 +135,18 @@ def expected_calibration_error(y_true, proba, classes, n_bins: int = 10) -> floa
     return float(ece)
 
 
-def make_pipeline() -> Pipeline:
+def make_pipeline(params: dict | None = None) -> Pipeline:
     """Min-max scaler + Random Forest, exactly as evaluated in the paper.
 
     The scaler lives *inside* the pipeline so that it is re-fitted on the
     training folds only (Sec. 2.3, leakage control) and is carried into the
     serialised artefact, so inference reproduces training-time preprocessing.
+    `params` replaces RF_PARAMS when a --search run picked another configuration.
     """
     return Pipeline(
         [
             ("scaler", MinMaxScaler()),
-            ("rf", RandomForestClassifier(**RF_PARAMS)),
+            ("rf", RandomForestClassifier(**(params or RF_PARAMS))),
         ]
     )
 
@@ -140,40 +168,105 @@ def feature_stats(df: pd.DataFrame, features: list[str]) -> dict:
     return stats
 
 
-def evaluate(X: pd.DataFrame, y: pd.Series, label: str) -> dict:
+def plan_fits(engine: FoldEngine, df: pd.DataFrame, features: list[str],
+              keep_folds: bool = False) -> dict:
+    """Declare every fit that evaluate() and build_artifact() use for one feature set.
+
+    The splits are drawn exactly as the sklearn helpers draw them (they only
+    depend on y and the row count), so deriving the metrics from the engine's
+    shared fits reproduces the separate cross_val_score / CalibratedClassifierCV
+    / cross_val_predict calls bit for bit. `keep_folds` also keeps the
+    out-of-fold and calibration fold models, which compression.py needs.
+    """
+    y = df[TARGET]
+    rows = np.arange(len(df))
+
+    rskf = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=RANDOM_STATE)
+    cv = [(engine.fit(features, tr, predict=te), te) for tr, te in rskf.split(rows, y)]
+
+    train, test = train_test_split(rows, test_size=0.20, stratify=y, random_state=RANDOM_STATE)
+    holdout = engine.fit(features, train, predict=test, keep=True)
+    # CalibratedClassifierCV(cv=5) splits its own training rows with StratifiedKFold(5).
+    holdout_cal = [(engine.fit(features, train[tr], predict=train[te], keep=keep_folds), train[te])
+                   for tr, te in StratifiedKFold(n_splits=5).split(train, y.iloc[train])]
+
+    skf = StratifiedKFold(n_splits=10, shuffle=True, random_state=RANDOM_STATE)
+    oof = [(engine.fit(features, tr, predict=te, keep=keep_folds), te)
+           for tr, te in skf.split(rows, y)]
+
+    deploy = engine.fit(features, rows, keep=True)
+    deploy_cal = [(engine.fit(features, tr, predict=te, keep=keep_folds), te)
+                  for tr, te in StratifiedKFold(n_splits=5).split(rows, y)]
+
+    return {
+        "X": df[features], "y": y, "rows": rows, "cv": cv,
+        "train": train, "test": test, "holdout": holdout, "holdout_cal": holdout_cal,
+        "oof": oof, "deploy": deploy, "deploy_cal": deploy_cal,
+    }
+
+
+def calibrate(model, folds: list, rows: np.ndarray, X: pd.DataFrame, y: pd.Series) -> CalibratedClassifierCV:
+    """CalibratedClassifierCV(isotonic, cv=5, ensemble=False) over `rows`, from shared fits.
+
+    Falls back to fitting it directly if this scikit-learn cannot be assembled
+    from the folds; the base estimator is then shared with `model` when the two
+    give identical predictions.
+    """
+    calibrated = calibrated_from_folds(
+        model, out_of_fold(folds, rows, model.classes_), y.iloc[rows], method="isotonic", cv=5
+    )
+    if calibrated is not None:
+        return calibrated
+
+    calibrated = CalibratedClassifierCV(
+        estimator=clone(model), method="isotonic", cv=5, ensemble=False
+    ).fit(X.iloc[rows], y.iloc[rows])
+
+    # The forest refitted inside CalibratedClassifierCV is trained on the same rows
+    # with the same seed as `model`, so the two are identical. Rebinding the reference
+    # makes joblib serialise the forest once instead of twice; the assertion below
+    # refuses the optimisation if the two ever diverge.
+    try:
+        probe = X.iloc[rows[:50]]
+        before = calibrated.predict_proba(probe)
+        original = calibrated.calibrated_classifiers_[0].estimator
+        calibrated.calibrated_classifiers_[0].estimator = model
+        if not np.allclose(before, calibrated.predict_proba(probe), atol=1e-12):
+            calibrated.calibrated_classifiers_[0].estimator = original
+            print("note: base estimator not shared (predictions differed); artefact will be larger")
+    except (AttributeError, IndexError):
+        print("note: could not share base estimator on this scikit-learn version")
+    return calibrated
+
+
+def evaluate(plan: dict, label: str) -> dict:
     """Repeated stratified CV + held-out + out-of-fold, as reported in Sec. 4."""
+    X, y = plan["X"], plan["y"]
     print(f"\n--- Evaluating {label} model ({X.shape[1]} features) ---")
 
-    rskf = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=RANDOM_STATE)
-    scores = cross_val_score(make_pipeline(), X, y, cv=rskf, scoring="accuracy", n_jobs=-1)
+    scores = np.array([accuracy_score(y.iloc[te], fold.predict(te)) for fold, te in plan["cv"]])
     mean, sd = scores.mean() * 100, scores.std(ddof=1) * 100
     half = 1.96 * sd / np.sqrt(len(scores))
     print(f"repeated 10x3 CV accuracy : {mean:.2f}% (SD {sd:.2f} pp, 95% CI "
           f"[{mean - half:.2f}, {mean + half:.2f}])")
 
-    X_tr, X_te, y_tr, y_te = train_test_split(
-        X, y, test_size=0.20, stratify=y, random_state=RANDOM_STATE
-    )
-    holdout_pipe = make_pipeline().fit(X_tr, y_tr)
-    y_hat = holdout_pipe.predict(X_te)
-    proba = holdout_pipe.predict_proba(X_te)
+    holdout, train, test = plan["holdout"], plan["train"], plan["test"]
+    y_te = y.iloc[test]
+    y_hat = holdout.predict(test)
+    proba = holdout.proba(test)
     n_err = int((y_hat != y_te).sum())
     print(f"held-out accuracy         : {accuracy_score(y_te, y_hat) * 100:.2f}% "
           f"({n_err} errors of {len(y_te)})")
 
-    cal_holdout = CalibratedClassifierCV(
-        estimator=make_pipeline(), method="isotonic", cv=5, ensemble=False
-    ).fit(X_tr, y_tr)
-    cal_proba = cal_holdout.predict_proba(X_te)
-    ece_raw = expected_calibration_error(y_te, proba, holdout_pipe.classes_)
+    cal_holdout = calibrate(holdout.model, plan["holdout_cal"], train, X, y)
+    cal_proba = cal_holdout.predict_proba(X.iloc[test])
+    ece_raw = expected_calibration_error(y_te, proba, holdout.classes)
     ece_cal = expected_calibration_error(y_te, cal_proba, cal_holdout.classes_)
     print(f"ECE uncalibrated / isotonic: {ece_raw:.4f} / {ece_cal:.4f}")
 
-    oof = cross_val_predict(
-        make_pipeline(), X, y,
-        cv=StratifiedKFold(n_splits=10, shuffle=True, random_state=RANDOM_STATE),
-        n_jobs=-1,
-    )
+    oof = np.empty(len(y), dtype=holdout.classes.dtype)
+    for fold, te in plan["oof"]:
+        oof[te] = fold.predict(te)
     oof_acc = accuracy_score(y, oof) * 100
     print(f"out-of-fold accuracy      : {oof_acc:.2f}% ({int((oof != y).sum())} errors of {len(y)})")
 
@@ -186,7 +279,7 @@ def evaluate(X: pd.DataFrame, y: pd.Series, label: str) -> dict:
         "holdout_precision_macro": round(precision_score(y_te, y_hat, average="macro") * 100, 3),
         "holdout_recall_macro": round(recall_score(y_te, y_hat, average="macro") * 100, 3),
         "holdout_f1_macro": round(f1_score(y_te, y_hat, average="macro") * 100, 3),
-        "holdout_log_loss_uncalibrated": round(float(log_loss(y_te, proba, labels=list(holdout_pipe.classes_))), 4),
+        "holdout_log_loss_uncalibrated": round(float(log_loss(y_te, proba, labels=list(holdout.classes))), 4),
         "holdout_log_loss_calibrated": round(float(log_loss(y_te, cal_proba, labels=list(cal_holdout.classes_))), 4),
         "holdout_ece_uncalibrated": round(ece_raw, 4),
         "holdout_ece_calibrated": round(ece_cal, 4),
@@ -196,36 +289,45 @@ def evaluate(X: pd.DataFrame, y: pd.Series, label: str) -> dict:
     }
 
 
-def build_artifact(df: pd.DataFrame, features: list[str], metrics: dict, variant: str) -> dict:
-    """Fit the deployment models and package everything the app needs."""
-    X, y = df[features], df[TARGET]
+def build_artifact(df: pd.DataFrame, features: list[str], metrics: dict, variant: str,
+                   plan: dict, models: tuple | None = None) -> dict:
+    """Package the deployment models (fitted by the fold engine) and what the app needs.
 
-    # (a) uncalibrated pipeline -> used by TreeSHAP, which needs the raw forest
-    pipeline = make_pipeline().fit(X, y)
+    `models` is a prebuilt (pipeline, calibrated, out-of-fold probabilities)
+    triple, as compression.py returns.
+    """
+    if models is not None:
+        pipeline, calibrated, predictions = models
+    else:
+        # (a) uncalibrated pipeline -> used by TreeSHAP, which needs the raw forest
+        pipeline = plan["deploy"].model
+
+        # (b) isotonic-calibrated pipeline -> the variant served in production (Sec. 4.7).
+        #     ensemble=False refits a single base estimator on all the data instead of
+        #     keeping one forest per fold, which keeps the artefact at the footprint
+        #     reported in Sec. 5 rather than multiplying it by cv. That refit is (a):
+        #     same rows, same seed, so joblib serialises the forest once.
+        calibrated = calibrate(pipeline, plan["deploy_cal"], plan["rows"], plan["X"], plan["y"])
+        predictions = out_of_fold(plan["deploy_cal"], plan["rows"], pipeline.classes_)
+
+    return package_artifact(
+        features, variant, pipeline, calibrated, metrics,
+        stats=feature_stats(df, features),
+        sketches={f: FeatureSummary.from_values(df[f]).to_dict() for f in features},
+        n_records=len(df),
+        calibration=(predictions, np.searchsorted(pipeline.classes_, plan["y"].to_numpy())),
+    )
 
-    # (b) isotonic-calibrated pipeline -> the variant served in production (Sec. 4.7).
-    #     ensemble=False refits a single base estimator on all the data instead of
-    #     keeping one forest per fold, which keeps the artefact at the footprint
-    #     reported in Sec. 5 rather than multiplying it by cv.
-    calibrated = CalibratedClassifierCV(
-        estimator=make_pipeline(), method="isotonic", cv=5, ensemble=False
-    ).fit(X, y)
 
-    # The forest refitted inside CalibratedClassifierCV is trained on the same rows
-    # with the same seed as (a), so the two are identical. Rebinding the reference
-    # makes joblib serialise the forest once instead of twice; the assertion below
-    # refuses the optimisation if the two ever diverge.
-    try:
-        probe = X.iloc[:50]
-        before = calibrated.predict_proba(probe)
-        original = calibrated.calibrated_classifiers_[0].estimator
-        calibrated.calibrated_classifiers_[0].estimator = pipeline
-        if not np.allclose(before, calibrated.predict_proba(probe), atol=1e-12):
-            calibrated.calibrated_classifiers_[0].estimator = original
-            print("note: base estimator not shared (predictions differed); artefact will be larger")
-    except (AttributeError, IndexError):
-        print("note: could not share base estimator on this scikit-learn version")
+def package_artifact(features: list[str], variant: str, pipeline: Pipeline,
+                     calibrated: CalibratedClassifierCV, metrics: dict, stats: dict,
+                     sketches: dict, n_records: int, calibration: tuple) -> dict:
+    """The artefact dict for fitted models, wherever the statistics came from.
 
+    `calibration` is the (probabilities, class indices) pair the isotonic layer
+    was fitted on; build_large.py passes streaming statistics from its column store.
+    """
+    proba, label = calibration
     return {
         "schema_version": SCHEMA_VERSION,
         "variant": variant,
@@ -238,13 +340,18 @@ def build_artifact(df: pd.DataFrame, features: list[str], metrics: dict, variant
             "python": platform.python_version(),
         },
         "feature_names": features,
-        "feature_stats": feature_stats(df, features),
+        "feature_stats": stats,
+        # Streaming form of the same statistics, for update_model.py.
+        "feature_sketches": sketches,
         "class_names": list(pipeline.classes_),          # crop names, not integers
-        "n_training_records": int(len(df)),
-        "model_params": RF_PARAMS,
+        "n_training_records": int(n_records),
+        "model_params": {k: pipeline[-1].get_params()[k] for k in RF_PARAMS},
         "pipeline": pipeline,                             # uncalibrated: label + SHAP
         "calibrated": calibrated,                         # served: probabilities
-        "ambiguity_rules": AMBIGUITY_RULES if variant == "full" else [],
+        "ambiguity_rules": AMBIGUITY_RULES if variant != "reduced" else [],
+        # What the isotonic layer was fitted on, so update_model.py can refit it
+        # on history + new rows: out-of-fold probabilities and class indices.
+        "calibration_data": {"proba": proba, "label": np.asarray(label).astype(np.int16)},
         "metrics": metrics,
     }
 
@@ -254,6 +361,30 @@ def main() -> None:
     ap.add_argument("--data", default="Crop_recommendation.csv", help="path to the dataset CSV")
     ap.add_argument("--outdir", default="models", help="directory for the artefacts")
     ap.add_argument("--skip-reduced", action="store_true", help="do not export the 5-feature model")
+    ap.add_argument("--skip-arrays", action="store_true", help="do not write the pickle-free array exports")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="training processes for the fold engine (default: all cores)")
+    ap.add_argument("--search", action="store_true",
+                    help="tune RF_PARAMS by successive halving (param_search.py) before training")
+    ap.add_argument("--search-folds", type=int, default=10,
+                    help="CV folds on the last search rung (of the 10x3 protocol's 30)")
+    ap.add_argument("--search-tolerance", type=float, default=0.25,
+                    help="accuracy (pp) given up for the fastest configuration")
+    ap.add_argument("--ablation", action="store_true",
+                    help="derive the reduced feature set by ablation (ablation.py) "
+                         "instead of using REDUCED_FEATURES")
+    ap.add_argument("--ablation-tolerance", type=float, default=ABLATION_TOLERANCE_PP,
+                    help="CV accuracy (pp) the reduced set may give up against the full model")
+    ap.add_argument("--compress", action="store_true",
+                    help="also export a pruned forest (compression.py) as crop_model_v2_compressed")
+    ap.add_argument("--compress-tolerance", type=float, default=TOLERANCE_PP,
+                    help="OOF, holdout and out-of-bag accuracy (pp) the compressed forest may give up")
+    ap.add_argument("--compress-ece-tolerance", type=float, default=TOLERANCE_ECE,
+                    help="calibrated holdout ECE the compressed forest may add")
+    ap.add_argument("--slim", choices=list(SLIM_DTYPES),
+                    help="also export slim serving arrays with leaf values in this type")
+    ap.add_argument("--slim-tolerance", type=float, default=SLIM_TOLERANCE,
+                    help="calibrated probability change the slim export may introduce")
     args = ap.parse_args()
 
     outdir = Path(args.outdir)
@@ -274,22 +405,95 @@ def main() -> None:
           f"duplicate rows: {int(df.duplicated().sum())} | "
           f"duplicate feature vectors: {int(df.duplicated(subset=FULL_FEATURES).sum())}")
 
-    report = {}
+    variants = [("full", FULL_FEATURES, "crop_model_v2")]
+    if not args.skip_reduced:
+        variants.append(("reduced", REDUCED_FEATURES, "crop_model_v2_reduced"))
 
-    metrics_full = evaluate(df[FULL_FEATURES], df[TARGET], "full")
-    report["full"] = metrics_full
-    art_full = build_artifact(df, FULL_FEATURES, metrics_full, "full")
+    report = {}
+    params = RF_PARAMS
+    if args.search:
+        search = successive_halving(df[FULL_FEATURES], df[TARGET], make_pipeline, RF_PARAMS,
+                                    n_folds=args.search_folds, tolerance_pp=args.search_tolerance,
+                                    random_state=RANDOM_STATE)
+        report["search"] = search
+        params = {**RF_PARAMS, **search["chosen"]}
+        print(f"\nsearch: {search['chosen']} -> {search['chosen_cv_accuracy']:.2f}% CV "
+              f"(best {search['best_cv_accuracy']:.2f}%), {search['chosen_batch_us_per_row']:.1f} us/row; "
+              f"{search['trees_grown']:,} trees grown vs {search['trees_grown_full_grid']:,} "
+              f"for the full grid, {search['seconds']:.0f} s")
+
+    # Every fit of every variant is declared first and trained once, in parallel.
+    engine = FoldEngine(df[FULL_FEATURES + [TARGET]], TARGET, partial(make_pipeline, params),
+                        workers=args.workers)
+    plans = {"full": plan_fits(engine, df, FULL_FEATURES, keep_folds=args.compress)}
+    if args.ablation and not args.skip_reduced:
+        # Replaces the paper's REDUCED_FEATURES; its fits share the engine and its folds.
+        ablation = ablate(engine, FULL_FEATURES, tolerance_pp=args.ablation_tolerance)
+        report["ablation"] = ablation
+        variants[1] = ("reduced", ablation["selected"], variants[1][2])
+        importance = ", ".join(f"{f} {v['mean_pp']:.1f}" for f, v in ablation["permutation_importance"].items())
+        print(f"\nablation: permutation importance (pp) {importance}")
+        print(f"ablation: reduced set {ablation['selected']} -> {ablation['selected_cv_accuracy']:.2f}% CV "
+              f"vs {ablation['full_cv_accuracy']:.2f}% full"
+              + ("" if ablation["selected_within_tolerance"] else
+                 f" (no smaller set within {args.ablation_tolerance} pp)")
+              + f"; {ablation['fits_distinct']} distinct fits for {ablation['fits_declared']} declared, "
+              f"{ablation['seconds']:.0f} s")
+    for variant, features, _ in variants[1:]:
+        plans[variant] = plan_fits(engine, df, features)
+    engine.run()
+    stats = engine.stats()
+    print(f"\nfold engine: {stats['fits_run']} distinct fits for {stats['fits_declared']} "
+          f"declared, {stats['workers']} worker(s), {stats['seconds']:.1f} s")
+
+    for variant, features, name in variants:
+        metrics = evaluate(plans[variant], variant)
+        report[variant] = metrics
+        artifact = build_artifact(df, features, metrics, variant, plans[variant])
+        path = outdir / f"{name}.pkl"
+        joblib.dump(artifact, path, compress=0)
+        print(f"\nwrote {path} ({path.stat().st_size / 1e6:.2f} MB)")
+        if not args.skip_arrays:
+            print(f"wrote {export_arrays(artifact, outdir / f'{name}.arrays')}")
+        if args.slim:
+            try:
+                slim = export_slim(artifact, outdir / f"{name}.slim", args.slim,
+                                   df[features].to_numpy(dtype=float), tolerance=args.slim_tolerance)
+            except ValueError as exc:
+                raise SystemExit(str(exc)) from exc
+            slim["pkl_mb"] = round(path.stat().st_size / 1e6, 3)
+            if not args.skip_arrays:
+                slim["arrays_mb"] = directory_mb(outdir / f"{name}.arrays")
+            report.setdefault("slim", {})[variant] = slim
+            print(f"wrote {outdir / f'{name}.slim'} ({slim['mb']:.2f} MB; max |dp| "
+                  f"{slim['max_abs_diff']:.2e}, {slim['argmax_mismatches']} top-1 changes "
+                  f"on {slim['training']['rows']:,} training and {slim['sampled']['rows']:,} "
+                  f"sampled rows)")
+
+        if args.compress and variant == "full":
+            pipeline, calibrated, record = compress_forest(
+                plans[variant], expected_calibration_error,
+                tolerance_pp=args.compress_tolerance, tolerance_ece=args.compress_ece_tolerance)
+            models = (pipeline, calibrated, record.pop("calibration_proba"))
+            compressed = build_artifact(df, features, record.pop("metrics"), "compressed",
+                                        plans[variant], models=models)
+            record["reference"]["pkl_mb"] = round(path.stat().st_size / 1e6, 3)
+            path = outdir / "crop_model_v2_compressed.pkl"
+            joblib.dump(compressed, path, compress=0)
+            record["chosen"]["pkl_mb"] = round(path.stat().st_size / 1e6, 3)
+            report["compressed"] = record
+            chosen, reference = record["chosen"], record["reference"]
+            print(f"\ncompressed: {chosen['n_estimators']} trees at depth {chosen['max_depth']} "
+                  f"(of {reference['n_estimators']} at {reference['max_depth']}); "
+                  f"holdout {chosen['holdout_accuracy']:.2f}% vs {reference['holdout_accuracy']:.2f}%, "
+                  f"deployed out-of-bag {chosen['deployed_oob_accuracy']:.2f}% vs "
+                  f"{reference['deployed_oob_accuracy']:.2f}%, ECE "
+                  f"{chosen['holdout_ece_calibrated']:.4f} vs {reference['holdout_ece_calibrated']:.4f}; "
+                  f"{chosen['batch_us_per_row']:.1f} vs {reference['batch_us_per_row']:.1f} us/row")
+            print(f"wrote {path} ({path.stat().st_size / 1e6:.2f} MB)")
+            if not args.skip_arrays:
+                print(f"wrote {export_arrays(compressed, outdir / 'crop_model_v2_compressed.arrays')}")
     path_full = outdir / "crop_model_v2.pkl"
-    joblib.dump(art_full, path_full, compress=0)
-    print(f"\nwrote {path_full} ({path_full.stat().st_size / 1e6:.2f} MB)")
-
-    if not args.skip_reduced:
-        metrics_red = evaluate(df[REDUCED_FEATURES], df[TARGET], "reduced")
-        report["reduced"] = metrics_red
-        art_red = build_artifact(df, REDUCED_FEATURES, metrics_red, "reduced")
-        path_red = outdir / "crop_model_v2_reduced.pkl"
-        joblib.dump(art_red, path_red, compress=0)
-        print(f"wrote {path_red} ({path_red.stat().st_size / 1e6:.2f} MB)")
 
     (outdir / "training_report.json").write_text(json.dumps(report, indent=2))
     print(f"wrote {outdir / 'training_report.json'}")
@@ -0,0 +1,125 @@
+"""
+cell_cache.py
+=============
+Exact prediction cache keyed on the forest's split-threshold cell.
+
+Every split in the forest compares one feature against one threshold, so the
+sorted unique thresholds of each feature cut the input space into a grid of
+cells, and every row inside a cell reaches the same leaf in every tree. The
+calibrated probabilities — and the path-dependent TreeSHAP attributions, which
+depend on the row only through those same split decisions — are therefore
+constant inside a cell.
+
+The key is the cell index: for each feature, a binary search of the value
+against that feature's sorted thresholds (`CompiledForest.cells`). The app's
+number_input defaults are the feature_stats medians and users nudge them by
+one step, so repeated queries land in the same cell and a hit skips both the
+forest and SHAP. Hits are exact, not approximate.
+
+Usage
+-----
+    cache = CellCache(artifact["_engine"], maxsize=4096)
+    proba = cache.probabilities(row)                       # (n_classes,)
+    contrib = cache.contributions(row, class_index, compute)
+    cache.stats()   # {"hits": ..., "misses": ..., "evictions": ..., ...}
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+
+from inference import CompiledForest
+
+
+class CellCache:
+    """Bounded LRU of per-cell results, safe to share between sessions."""
+
+    def __init__(self, engine: CompiledForest, maxsize: int = 4096):
+        self.engine = engine
+        self.maxsize = maxsize
+        self._entries: OrderedDict[bytes, dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, row: Any) -> bytes:
+        """The cell index of one raw row, as a hashable key."""
+        return self.engine.cells(np.asarray(row, dtype=np.float64).reshape(1, -1))[0].tobytes()
+
+    def _entry(self, key: bytes) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: bytes, name: str, value: Any) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {}
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._entries.move_to_end(key)
+            entry[name] = value
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def probabilities(self, row: Any) -> np.ndarray:
+        """Calibrated probabilities for one raw row."""
+        key = self.key(row)
+        entry = self._entry(key)
+        if entry is not None and "proba" in entry:
+            self._count(True)
+            return entry["proba"]
+        self._count(False)
+        proba = self.engine.predict_proba(np.asarray(row, dtype=np.float64).reshape(1, -1))[0]
+        proba.setflags(write=False)
+        self._store(key, "proba", proba)
+        return proba
+
+    def contributions(self, row: Any, class_index: int,
+                      compute: Callable[[], np.ndarray | None]) -> np.ndarray | None:
+        """TreeSHAP attributions for one row and class; `compute` runs on a miss.
+
+        A None from `compute` (explainer unavailable or failed) is not cached.
+        """
+        key = self.key(row)
+        name = f"shap:{class_index}"
+        entry = self._entry(key)
+        if entry is not None and name in entry:
+            self._count(True)
+            return entry[name]
+        self._count(False)
+        contrib = compute()
+        if contrib is not None:
+            self._store(key, name, contrib)
+        return contrib
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,223 @@
+"""
+column_store.py
+===============
+Out-of-core ingestion: a CSV of any size as memory-mapped float32 columns.
+
+`build_model.py` reads the whole dataset into a float64 DataFrame, which is
+right for the 2,200-record paper dataset and wrong for the national
+soil-health survey. Ingestion reads the CSV in chunks and appends each
+feature to its own raw float32 file, so memory is set by --chunk-rows, not
+by the file:
+
+    national.cols/
+        store.json       format, row count, features, class table, statistics
+        N.f32 ...        one little-endian float32 column per feature
+        label.i16        class codes (int16) indexing store.json "classes"
+
+The class table is sorted, as scikit-learn orders classes_, so a code is the
+class index a fitted forest uses. Labels are normalised exactly as
+build_model.py does (stripped, lower-case). Rows with a missing label or a
+missing/non-numeric feature are dropped and counted.
+
+feature_stats come from the same pass: every chunk updates a
+`sketches.FeatureSummary` per feature (exact min, max, mean and sd; quantiles
+within about 1/256 of their rank), and the summaries are stored too, in the
+form the artefact keeps as feature_sketches.
+
+Usage
+-----
+    python column_store.py national.csv --out national.cols --chunk-rows 500000
+    store = ColumnStore("national.cols")
+    store.column("rainfall")              # (n_rows,) float32 memmap
+    store.matrix(["N", "P"], rows)        # (len(rows), 2) float32, gathered
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import pandas as pd
+
+from sketches import FeatureSummary
+
+FORMAT_NAME = "crop-column-store"
+FORMAT_VERSION = 1
+MANIFEST = "store.json"
+LABEL_FILE = "label.i16"
+CHUNK_ROWS = 200_000
+
+
+def peak_rss_mb() -> float:
+    """This process's peak resident set so far (ru_maxrss is in kB on Linux)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class ColumnStore:
+    """Read side of an ingested dataset; columns are opened as memmaps on demand."""
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.manifest = json.loads((self.directory / MANIFEST).read_text())
+        if self.manifest.get("format") != FORMAT_NAME:
+            raise ValueError(f"{self.directory} is not a {FORMAT_NAME} directory")
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"{self.directory} has format version "
+                             f"{self.manifest.get('format_version')}; this code reads {FORMAT_VERSION}")
+        self.n_rows: int = self.manifest["n_rows"]
+        self.features: list[str] = self.manifest["features"]
+        self.target: str = self.manifest["target"]
+        self.classes = np.asarray(self.manifest["classes"])
+        self.feature_stats: dict[str, dict] = self.manifest["feature_stats"]
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.features:
+            raise KeyError(f"{name!r} is not a column of {self.directory}")
+        return np.memmap(self.directory / f"{name}.f32", dtype="<f4", mode="r", shape=(self.n_rows,))
+
+    @property
+    def labels(self) -> np.ndarray:
+        return np.memmap(self.directory / LABEL_FILE, dtype="<i2", mode="r", shape=(self.n_rows,))
+
+    def sketches(self, features: list[str]) -> dict[str, dict]:
+        return {f: self.manifest["feature_sketches"][f] for f in features}
+
+    def matrix(self, features: list[str], rows: np.ndarray | slice) -> np.ndarray:
+        """The given rows of `features` as one (rows, features) float32 array."""
+        columns = [self.column(f) for f in features]
+        first = columns[0][rows]
+        out = np.empty((len(first), len(features)), dtype=np.float32)
+        out[:, 0] = first
+        for j, column in enumerate(columns[1:], start=1):
+            out[:, j] = column[rows]
+        return out
+
+    def chunks(self, chunk_rows: int = CHUNK_ROWS, limit: int | None = None) -> Iterator[slice]:
+        """Consecutive row slices covering the store (or its first `limit` rows)."""
+        end = self.n_rows if limit is None else min(limit, self.n_rows)
+        for start in range(0, end, chunk_rows):
+            yield slice(start, min(start + chunk_rows, end))
+
+
+def ingest(csv: str | Path, directory: str | Path, features: list[str], target: str,
+           chunk_rows: int = CHUNK_ROWS, limit: int | None = None) -> dict[str, Any]:
+    """Convert `csv` into a column store at `directory` (replaced atomically).
+
+    `limit` ingests only the first rows of the file. Returns the manifest.
+    """
+    started = time.perf_counter()
+    directory = Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent))
+    summaries = {f: FeatureSummary() for f in features}
+    codes: dict[str, int] = {}          # first-seen order; sorted at the end
+    counts: list[int] = []
+    n_rows = read = missing_label = bad_values = 0
+    try:
+        handles = {f: open(staging / f"{f}.f32", "wb") for f in features}
+        labels = open(staging / LABEL_FILE, "wb")
+        try:
+            reader = pd.read_csv(csv, usecols=features + [target], chunksize=chunk_rows,
+                                 nrows=limit, dtype={target: str})
+            for chunk in reader:
+                read += len(chunk)
+                label = chunk[target].astype(str).str.strip().str.lower()
+                has_label = chunk[target].notna().to_numpy() & (label != "").to_numpy()
+                values = chunk[features].apply(pd.to_numeric, errors="coerce").to_numpy(np.float64)
+                finite = np.isfinite(values).all(axis=1)
+                keep = has_label & finite
+                missing_label += int((~has_label).sum())
+                bad_values += int((has_label & ~finite).sum())
+
+                X = values[keep].astype("<f4")
+                for j, f in enumerate(features):
+                    X[:, j].tofile(handles[f])
+                    summaries[f].update(X[:, j])
+                local, names = pd.factorize(label.to_numpy()[keep])
+                for name in names:
+                    if name not in codes:
+                        codes[name] = len(codes)
+                        counts.append(0)
+                table = np.array([codes[name] for name in names], dtype="<i2")
+                for c, k in zip(table, np.bincount(local, minlength=len(names))):
+                    counts[c] += int(k)
+                table[local].tofile(labels)
+                n_rows += len(X)
+        finally:
+            for handle in handles.values():
+                handle.close()
+            labels.close()
+        if not n_rows:
+            raise ValueError(f"{csv} has no usable rows")
+        if len(codes) > np.iinfo(np.int16).max:
+            raise ValueError(f"{len(codes)} classes do not fit the int16 code table")
+
+        # Re-code to sorted class order, chunk by chunk in place.
+        classes = sorted(codes)
+        remap = np.empty(len(codes), dtype="<i2")
+        for name, code in codes.items():
+            remap[code] = classes.index(name)
+        stored = np.memmap(staging / LABEL_FILE, dtype="<i2", mode="r+", shape=(n_rows,))
+        for start in range(0, n_rows, chunk_rows):
+            stored[start:start + chunk_rows] = remap[stored[start:start + chunk_rows]]
+        stored.flush()
+        del stored
+
+        manifest = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "source": str(csv),
+            "n_rows": n_rows,
+            "features": list(features),
+            "target": target,
+            "classes": classes,
+            "class_counts": {name: counts[codes[name]] for name in classes},
+            "feature_stats": {f: summaries[f].stats() for f in features},
+            "feature_sketches": {f: summaries[f].to_dict() for f in features},
+            "dropped": {"rows_read": read, "missing_label": missing_label,
+                        "missing_or_non_numeric": bad_values},
+            "ingest": {"seconds": round(time.perf_counter() - started, 3),
+                       "peak_rss_mb": peak_rss_mb(), "chunk_rows": chunk_rows},
+        }
+        (staging / MANIFEST).write_text(json.dumps(manifest, indent=1))
+        previous = directory.with_name(f".{directory.name}.old")
+        if directory.exists():
+            shutil.rmtree(previous, ignore_errors=True)
+            os.replace(directory, previous)
+        os.replace(staging, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def main() -> None:
+    from build_model import FULL_FEATURES, TARGET
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("csv", help="dataset CSV (the paper's columns, any number of rows)")
+    ap.add_argument("--out", required=True, help="column store directory to write")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="CSV rows read at a time")
+    ap.add_argument("--limit", type=int, default=None, help="ingest only the first N rows")
+    args = ap.parse_args()
+
+    manifest = ingest(args.csv, args.out, FULL_FEATURES, TARGET, args.chunk_rows, args.limit)
+    dropped = manifest["dropped"]
+    print(f"ingested {manifest['n_rows']:,} of {dropped['rows_read']:,} rows "
+          f"({dropped['missing_label']:,} without a label, {dropped['missing_or_non_numeric']:,} "
+          f"with a missing or non-numeric value), {len(manifest['classes'])} classes, "
+          f"{manifest['ingest']['seconds']:.1f} s, peak RSS {manifest['ingest']['peak_rss_mb']:.0f} MB")
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
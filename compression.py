@@ -0,0 +1,312 @@
+"""
+compression.py
+==============
+Accuracy-constrained forest compression for `build_model.py --compress`.
+
+The deployed forest has 100 trees of depth 10; most of them are redundant
+for serving. This stage looks for the smallest subset of trees, at the
+shallowest depth, whose out-of-fold accuracy and calibrated holdout ECE stay
+within a tolerance of the full model. Nothing is refitted:
+
+  * trees are made shallower by truncation: every node at the target depth
+    becomes a leaf carrying its own (stored) class distribution
+  * a subset is a set of tree indices. Tree t of a fold model and tree t of
+    the deployed forest share a seed but not a bootstrap, so the indices are
+    only a search heuristic: every candidate is also scored on the deployed
+    forest itself, out of bag (each row voted on only by the chosen trees
+    whose bootstrap left it out), and must stay within the accuracy
+    tolerance of the whole deployed forest's out-of-bag accuracy
+  * per depth, trees are added greedily to maximise the accuracy of the
+    out-of-fold ensemble (the fold engine's 10-fold models, kept by
+    build_model), ties broken on the mean probability of the true class;
+    the first prefix meeting the accuracy tolerance is then checked on the
+    80/20 holdout fit, which took no part in the selection: its accuracy must
+    stay within the same tolerance, and its ECE, after recalibrating on the
+    holdout fit's inner folds as Sec. 4.7 does, within the ECE tolerance;
+    the deployed forest's out-of-bag check comes last
+  * the out-of-fold accuracy a subset was selected on is optimistic for that
+    subset, so it is recorded as `selection_accuracy` and kept out of the
+    artefact's metrics, which carry the holdout and out-of-bag figures
+
+The chosen subset is cut out of the deployed forest as ordinary sklearn
+trees and recalibrated on the deployment calibration folds, so the result
+is a normal artefact: it pickles, compiles, exports to arrays and explains
+like the full model.
+
+Usage
+-----
+    pipeline, calibrated, record = compress_forest(plan, expected_calibration_error)
+"""
+
+from __future__ import annotations
+
+import copy
+import time
+from typing import Any, Callable
+
+import numpy as np
+from sklearn.ensemble._forest import _generate_unsampled_indices, _get_n_samples_bootstrap
+from sklearn.isotonic import IsotonicRegression
+from sklearn.tree._tree import Tree
+
+from fold_engine import calibrated_from_folds
+from param_search import serving_latency
+
+TOLERANCE_PP = 0.5       # OOF and holdout accuracy, percentage points
+TOLERANCE_ECE = 0.01     # calibrated holdout ECE, absolute
+MIN_DEPTH = 4
+
+
+def _depths_and_parents(tree: Any) -> tuple[np.ndarray, np.ndarray]:
+    left, right = tree.children_left, tree.children_right
+    depth = np.zeros(tree.node_count, dtype=np.int64)
+    parent = np.full(tree.node_count, -1, dtype=np.int64)
+    frontier, level = np.array([0]), 0
+    while len(frontier):
+        depth[frontier] = level
+        internal = frontier[left[frontier] >= 0]
+        parent[left[internal]] = internal
+        parent[right[internal]] = internal
+        frontier = np.concatenate([left[internal], right[internal]])
+        level += 1
+    return depth, parent
+
+
+def _ancestor_at(depth: np.ndarray, parent: np.ndarray, max_depth: int) -> np.ndarray:
+    """For every node, itself or its ancestor at `max_depth`, whichever is shallower."""
+    ancestor = np.arange(len(depth))
+    for level in range(max_depth + 1, int(depth.max()) + 1):
+        nodes = np.flatnonzero(depth == level)
+        ancestor[nodes] = ancestor[parent[nodes]]
+    return ancestor
+
+
+def truncate_tree(estimator: Any, max_depth: int) -> Any:
+    """A copy of a fitted DecisionTreeClassifier cut at `max_depth`."""
+    tree = estimator.tree_
+    depth, _ = _depths_and_parents(tree)
+    if depth.max() <= max_depth:
+        return estimator
+    state = tree.__getstate__()
+    nodes = state["nodes"].copy()
+    cut = (depth == max_depth) & (nodes["left_child"] >= 0)
+    nodes["left_child"][cut] = nodes["right_child"][cut] = -1
+    nodes["feature"][cut] = -2
+    nodes["threshold"][cut] = -2.0
+    keep = depth <= max_depth
+    renumber = np.cumsum(keep) - 1
+    nodes = nodes[keep]
+    internal = nodes["left_child"] >= 0
+    nodes["left_child"][internal] = renumber[nodes["left_child"][internal]]
+    nodes["right_child"][internal] = renumber[nodes["right_child"][internal]]
+
+    truncated = Tree(*tree.__reduce__()[1])
+    truncated.__setstate__({"max_depth": max_depth, "node_count": int(keep.sum()),
+                            "nodes": nodes, "values": state["values"][keep]})
+    out = copy.copy(estimator)
+    out.tree_ = truncated
+    out.max_depth = max_depth
+    return out
+
+
+def compress_pipeline(pipeline: Any, trees: list[int], max_depth: int) -> Any:
+    """The pipeline with only `trees` of its forest, each truncated at `max_depth`."""
+    forest = copy.copy(pipeline[-1])
+    forest.estimators_ = [truncate_tree(pipeline[-1].estimators_[t], max_depth) for t in trees]
+    forest.n_estimators = len(trees)
+    forest.max_depth = max_depth
+    out = copy.copy(pipeline)
+    out.steps = [*pipeline.steps[:-1], (pipeline.steps[-1][0], forest)]
+    return out
+
+
+class _TreeOutputs:
+    """Per-tree leaf indices of fitted fold models on their scored rows.
+
+    `proba(max_depth)` turns them into (n_trees, n_rows, n_classes) per-tree
+    probabilities for trees truncated at that depth, in output row order.
+    """
+
+    def __init__(self, folds: list[tuple[Any, np.ndarray]], rows: np.ndarray, X: Any,
+                 classes: np.ndarray):
+        position = np.empty(rows.max() + 1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+        self.n_rows, self.classes = len(rows), classes
+        self.parts = []
+        for fold, test in folds:
+            model = fold.model
+            if model is None:
+                raise ValueError("fold models were not kept; plan_fits(keep_folds=True)")
+            if list(model.classes_) != list(classes):
+                raise ValueError("a fold model is missing classes; cannot compress")
+            Xs = np.ascontiguousarray(model[:-1].transform(X.iloc[test]), dtype=np.float32)
+            trees = []
+            for estimator in model[-1].estimators_:
+                tree = estimator.tree_
+                depth, parent = _depths_and_parents(tree)
+                value = tree.value[:, 0, :]
+                value = value / np.where(value.sum(1, keepdims=True) == 0, 1, value.sum(1, keepdims=True))
+                trees.append((tree.apply(Xs), depth, parent, value))
+            self.parts.append((position[test], trees))
+        self.n_trees = len(self.parts[0][1])
+
+    def proba(self, max_depth: int) -> np.ndarray:
+        out = np.zeros((self.n_trees, self.n_rows, len(self.classes)))
+        for positions, trees in self.parts:
+            for t, (leaves, depth, parent, value) in enumerate(trees):
+                out[t, positions] = value[_ancestor_at(depth, parent, max_depth)[leaves]]
+        return out
+
+
+def _out_of_bag(forest: Any, n_rows: int) -> np.ndarray:
+    """(n_trees, n_rows) mask of the rows each tree's bootstrap left out."""
+    if not forest.bootstrap:
+        raise ValueError("the deployed forest has no bootstrap; cannot score it out of bag")
+    n_bootstrap = _get_n_samples_bootstrap(n_rows, forest.max_samples)
+    mask = np.zeros((len(forest.estimators_), n_rows), dtype=bool)
+    for t, estimator in enumerate(forest.estimators_):
+        mask[t, _generate_unsampled_indices(estimator.random_state, n_rows, n_bootstrap)] = True
+    return mask
+
+
+def _greedy_order(P: np.ndarray, truth: np.ndarray) -> tuple[list[int], np.ndarray]:
+    """Trees in greedy order and the OOF accuracy after each addition."""
+    n_trees, n_rows, _ = P.shape
+    total = np.zeros(P.shape[1:])
+    remaining = list(range(n_trees))
+    order, accuracy = [], []
+    rows = np.arange(n_rows)
+    for _ in range(n_trees):
+        candidates = total[None] + P[remaining]
+        correct = (candidates.argmax(axis=2) == truth).sum(axis=1)
+        margin = candidates[:, rows, truth].mean(axis=1) / (len(order) + 1)
+        best = int(np.argmax(correct + margin))   # margin < 1 only breaks ties
+        order.append(remaining.pop(best))
+        total += P[order[-1]]
+        accuracy.append(correct[best] / n_rows)
+    return order, np.asarray(accuracy)
+
+
+def _calibrate(train_raw: np.ndarray, train_truth: np.ndarray, raw: np.ndarray) -> np.ndarray:
+    """Isotonic per class on out-of-fold scores, applied as CalibratedClassifierCV does."""
+    proba = np.empty_like(raw)
+    for k in range(raw.shape[1]):
+        calibrator = IsotonicRegression(out_of_bounds="clip")
+        calibrator.fit(train_raw[:, k], (train_truth == k).astype(float))
+        proba[:, k] = calibrator.predict(raw[:, k])
+    total = proba.sum(axis=1, keepdims=True)
+    proba = np.divide(proba, total, out=np.full_like(proba, 1 / raw.shape[1]), where=total != 0)
+    proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+    return proba
+
+
+def compress_forest(plan: dict, calibration_error: Callable, tolerance_pp: float = TOLERANCE_PP,
+                    tolerance_ece: float = TOLERANCE_ECE, min_depth: int = MIN_DEPTH
+                    ) -> tuple[Any, Any, dict[str, Any]]:
+    """Search (depth, tree subset) and return the compressed pipeline, its calibrated model
+    and the trade-off record for training_report.json (whose "metrics" and
+    "calibration_proba" entries are for the artefact, not the report).
+
+    `plan` comes from build_model.plan_fits(..., keep_folds=True) after the fold
+    engine has run; `calibration_error(y, proba, classes)` is the report's ECE.
+    """
+    started = time.perf_counter()
+    X, y = plan["X"], plan["y"]
+    deploy = plan["deploy"].model
+    classes = deploy.classes_
+    truth = np.searchsorted(classes, np.asarray(y))
+    train, test = plan["train"], plan["test"]
+
+    oof = _TreeOutputs(plan["oof"], plan["rows"], X, classes)
+    inner = _TreeOutputs(plan["holdout_cal"], train, X, classes)
+    holdout = _TreeOutputs([(plan["holdout"], test)], test, X, classes)
+    # The deployed forest is fitted on every row in order, so bootstrap
+    # positions are row positions.
+    deployed = _TreeOutputs([(plan["deploy"], plan["rows"])], plan["rows"], X, classes)
+    oob = _out_of_bag(deploy[-1], len(plan["rows"]))
+    full_depth = int(max(e.tree_.max_depth for e in deploy[-1].estimators_))
+
+    def holdout_metrics(trees: list[int], depth: int) -> dict[str, float]:
+        raw = holdout.proba(depth)[trees].mean(axis=0)
+        calibrated = _calibrate(inner.proba(depth)[trees].mean(axis=0), truth[train], raw)
+        y_te = np.asarray(y)[test]
+        return {
+            "holdout_accuracy": round(float((classes[raw.argmax(1)] == y_te).mean()) * 100, 3),
+            "holdout_ece_uncalibrated": round(calibration_error(y_te, raw, classes), 4),
+            "holdout_ece_calibrated": round(calibration_error(y_te, calibrated, classes), 4),
+        }
+
+    def deployed_metrics(trees: list[int], depth: int) -> dict[str, float]:
+        votes = (deployed.proba(depth)[trees] * oob[trees, :, None]).sum(axis=0)
+        scored = oob[trees].any(axis=0)
+        correct = votes[scored].argmax(1) == truth[scored]
+        return {"deployed_oob_accuracy": round(float(correct.mean()) * 100, 3),
+                "deployed_oob_rows": int(scored.sum())}
+
+    everything = list(range(oof.n_trees))
+    P = oof.proba(full_depth)
+    reference = {
+        "n_estimators": oof.n_trees,
+        "max_depth": full_depth,
+        "oof_accuracy": round(float((P.sum(0).argmax(1) == truth).mean()) * 100, 3),
+        **holdout_metrics(everything, full_depth),
+        **deployed_metrics(everything, full_depth),
+    }
+    target_acc = reference["oof_accuracy"] - tolerance_pp
+    target_holdout = reference["holdout_accuracy"] - tolerance_pp
+    target_ece = reference["holdout_ece_calibrated"] + tolerance_ece
+    target_oob = reference["deployed_oob_accuracy"] - tolerance_pp
+
+    by_depth = []
+    for depth in range(full_depth, min_depth - 1, -1):
+        P = oof.proba(depth) if depth != full_depth else P
+        order, accuracy = _greedy_order(P, truth)
+        entry: dict[str, Any] = {"max_depth": depth,
+                                 "oof_accuracy_all_trees": round(float(accuracy[-1]) * 100, 3)}
+        for k in np.flatnonzero(accuracy * 100 >= target_acc) + 1:
+            metrics = holdout_metrics(order[:k], depth)
+            if (metrics["holdout_accuracy"] < target_holdout
+                    or metrics["holdout_ece_calibrated"] > target_ece):
+                continue
+            metrics.update(deployed_metrics(order[:k], depth))
+            if metrics["deployed_oob_accuracy"] >= target_oob:
+                nodes = sum(truncate_tree(deploy[-1].estimators_[t], depth).tree_.node_count
+                            for t in order[:k])
+                entry.update({"n_estimators": int(k), "trees": sorted(order[:k]),
+                              "selection_accuracy": round(float(accuracy[k - 1]) * 100, 3),
+                              **metrics, "nodes": int(nodes)})
+                break
+        by_depth.append(entry)
+        if "n_estimators" not in entry:
+            break  # shallower trees only get worse
+
+    feasible = [e for e in by_depth if "n_estimators" in e]
+    if not feasible:
+        raise RuntimeError("no tree subset meets the tolerance, not even the full forest")
+    chosen = dict(min(feasible, key=lambda e: (e["nodes"], -e["selection_accuracy"])))
+    pipeline = compress_pipeline(deploy, chosen["trees"], chosen["max_depth"])
+
+    # Recalibrate exactly as build_artifact does, from the deployment folds.
+    dcal = _TreeOutputs(plan["deploy_cal"], plan["rows"], X, classes)
+    predictions = dcal.proba(chosen["max_depth"])[chosen["trees"]].mean(axis=0)
+    calibrated = calibrated_from_folds(pipeline, predictions, y, method="isotonic", cv=5)
+    if calibrated is None:
+        raise RuntimeError("this scikit-learn cannot assemble the calibrated model")
+
+    reference.update(serving_latency(deploy, X))
+    chosen.update(serving_latency(pipeline, X))
+    record = {
+        "tolerance": {"accuracy_pp": tolerance_pp, "holdout_ece": tolerance_ece},
+        "reference": reference,
+        "chosen": chosen,
+        "by_depth": [{k: v for k, v in e.items() if k != "trees"} for e in by_depth],
+        "seconds": round(time.perf_counter() - started, 2),
+        "calibration_proba": predictions,
+        "metrics": {
+            "holdout_accuracy": chosen["holdout_accuracy"],
+            "holdout_ece_uncalibrated": chosen["holdout_ece_uncalibrated"],
+            "holdout_ece_calibrated": chosen["holdout_ece_calibrated"],
+            "deployed_oob_accuracy": chosen["deployed_oob_accuracy"],
+        },
+    }
+    return pipeline, calibrated, record
@@ -0,0 +1,593 @@
+"""
+flat_model.py
+=============
+Single-file binary export of the deployment artefact for on-device inference.
+
+The Flutter tier otherwise calls serve.py for every recommendation. This
+format carries everything a client needs to answer offline, in one
+little-endian file it can read with fixed-width loads and no Python: the
+MinMaxScaler, every tree of the forest, the per-class isotonic tables, and
+the metadata the app shows (class_names, feature_stats, ambiguity_rules).
+
+    crop_model_v2.flat            the model
+    crop_model_v2.vectors.json    conformance vectors: inputs and the outputs
+                                  sklearn gives for them
+
+`read_flat` is the reference decoder. It is plain NumPy and implements the
+evaluation below literally, so a port can be checked against it line by line
+as well as against the vectors.
+
+Layout (version 1)
+------------------
+All integers and floats are little-endian. The header is 96 bytes:
+
+    offset  type      field
+    0       u8[8]     magic "CROPFLAT"
+    8       u16       format version (1)
+    10      u16       number of sections S (13)
+    12      u16       n_features F
+    14      u16       n_classes C
+    16      u32       n_trees T
+    20      u32       n_nodes N (all trees)
+    24      u32       n_entries E (non-zero leaf probabilities)
+    28      u32       n_knots K (all classes)
+    32      u32       metadata length in bytes
+    36      u32       file length in bytes, CRC included
+    40      u32[S]    section offsets from the start of the file
+    92      u8[4]     zero
+
+Sections follow in this order, each starting on an 8-byte boundary (the
+gaps are zero):
+
+    metadata      u8[len]   UTF-8 JSON: feature_names, class_names,
+                            feature_stats, ambiguity_rules, variant, ...
+    scale         f64[F]    MinMaxScaler.scale_
+    min           f64[F]    MinMaxScaler.min_
+    roots         u32[T+1]  tree t is nodes roots[t] .. roots[t+1]-1,
+                            rooted at roots[t]
+    feature       i16[N]    split feature, -1 at a leaf
+    threshold     f32[N]    split threshold in scaled units, 0 at a leaf
+    left          u32[N]    split: node taken when the test passes;
+                            leaf: first of its entries
+    right         u32[N]    split: node taken otherwise;
+                            leaf: one past its last entry
+    entry_class   u16[E]    leaf entries: class index ...
+    entry_proba   f64[E]    ... and that class's share of the leaf
+    knot_offsets  u32[C+1]  class c's knots are knot_offsets[c] .. [c+1]-1
+    knot_x        f64[K]    isotonic knots, strictly increasing per class
+    knot_y        f64[K]
+    crc32         u32       zlib CRC-32 of every byte before it
+
+Node indices are global across trees.
+
+Evaluation
+----------
+For one input row `x`: finite raw values in feature_names order.
+
+    1. s[j] = float32(x[j] * scale[j] + min[j])
+           the multiply and add are separate float64 operations; do not fuse
+           them. Round the result to the nearest float32.
+    2. for each tree t, in order:
+           n = roots[t]
+           while feature[n] >= 0:
+               n = left[n] if s[feature[n]] <= threshold[n] else right[n]
+           for e in left[n] .. right[n]-1:
+               raw[entry_class[e]] += entry_proba[e]
+    3. raw[c] /= T
+    4. with knots xs, ys of class c (k of them):
+           v = min(max(raw[c], xs[0]), xs[k-1])
+           p[c] = ys[k-1] if v == xs[k-1] else, for the i with xs[i] <= v < xs[i+1],
+                  (ys[i+1] - ys[i]) / (xs[i+1] - xs[i]) * (v - xs[i]) + ys[i]
+    5. total = sum(p); p[c] = p[c] / total, or 1 / C if total is 0;
+       a p[c] in (1, 1 + 1e-5] becomes exactly 1
+
+The comparison in step 2 is float32 against float32. sklearn compares the
+float32 input against a float64 threshold; the stored threshold is the
+largest float32 not above it, which makes the two tests identical. Routing
+is therefore exact, and in float64 the probabilities agree with
+`calibrated.predict_proba` to rounding.
+
+Inputs outside feature_stats min/max should be refused before step 1, as
+inference.validate does. The ambiguity rules apply to the result as in
+inference.triggered_rule.
+
+Usage
+-----
+    python flat_model.py export crop_model_v2.pkl --data Crop_recommendation.csv
+    python flat_model.py check crop_model_v2.flat crop_model_v2.vectors.json
+
+    model = read_flat(Path("crop_model_v2.flat"))
+    proba = model.predict_proba(X)           # X: (n_rows, n_features), raw units
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import struct
+import tempfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+MAGIC = b"CROPFLAT"
+FORMAT_NAME = "crop-model-flat"
+FORMAT_VERSION = 1
+VECTORS_NAME = "crop-model-flat-vectors"
+HEADER_BYTES = 96
+ALIGN = 8
+
+# Fixed header fields, then the section offsets.
+_HEADER = struct.Struct("<8sHHHHIIIIII")
+SECTIONS = (
+    ("metadata", "u1"), ("scale", "<f8"), ("min", "<f8"), ("roots", "<u4"),
+    ("feature", "<i2"), ("threshold", "<f4"), ("left", "<u4"), ("right", "<u4"),
+    ("entry_class", "<u2"), ("entry_proba", "<f8"),
+    ("knot_offsets", "<u4"), ("knot_x", "<f8"), ("knot_y", "<f8"),
+)
+_OFFSETS = struct.Struct(f"<{len(SECTIONS)}I")
+
+# Artefact entries written to the metadata section.
+METADATA_KEYS = (
+    "schema_version", "variant", "created_utc", "feature_names", "class_names",
+    "feature_stats", "ambiguity_rules",
+)
+
+# Largest |dp| a conforming decoder may show against the vectors. Routing
+# must match exactly; float64 arithmetic lands within ~1e-15.
+VECTOR_TOLERANCE = 1e-9
+# Conformance cases: training rows per class, and boundary pairs per feature.
+VECTOR_ROWS_PER_CLASS = 2
+VECTOR_BOUNDARIES_PER_FEATURE = 2
+
+
+# --------------------------------------------------------------------------- #
+# Export                                                                      #
+# --------------------------------------------------------------------------- #
+
+
+def _json_ready(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _json_ready(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_ready(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def float32_floor(threshold: np.ndarray) -> np.ndarray:
+    """The largest float32 at or below each float64 threshold.
+
+    For a float32 `s`, `s <= t` holds exactly when `s <= float32_floor(t)`.
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    out = threshold.astype(np.float32)
+    above = out.astype(np.float64) > threshold
+    out[above] = np.nextafter(out[above], np.float32(-np.inf))
+    return out
+
+
+def flat_sections(artifact: dict[str, Any]) -> dict[str, np.ndarray]:
+    """The model as the format's sections, in their on-disk dtypes."""
+    from inference import compile_artifact
+
+    engine = compile_artifact(artifact)  # raises ValueError for unsupported models
+    pipeline = artifact["calibrated"].calibrated_classifiers_[0].estimator
+    scaler, forest = pipeline[0], pipeline[-1]
+
+    is_leaf = engine.feature < 0
+    value = engine.value[is_leaf]
+    nonzero = value > 0
+    counts = nonzero.sum(axis=1)
+    ends = np.cumsum(counts)
+    left, right = engine.left.copy(), engine.right.copy()
+    left[is_leaf], right[is_leaf] = ends - counts, ends
+    threshold = np.concatenate([e.tree_.threshold for e in forest.estimators_])
+    threshold = np.where(is_leaf, 0.0, threshold)
+
+    for xs in engine.calib_x:
+        if (np.diff(xs) <= 0).any():
+            raise ValueError("isotonic knots must be strictly increasing")
+    limits = {"feature": np.iinfo(np.int16).max, "class": np.iinfo(np.uint16).max,
+              "index": np.iinfo(np.uint32).max}
+    if (len(engine.feature_names) > limits["feature"] or engine.n_classes > limits["class"]
+            or max(len(engine.feature), int(ends[-1])) > limits["index"]):
+        raise ValueError("model is too large for format version 1")
+
+    metadata = {key: _json_ready(artifact[key]) for key in METADATA_KEYS if key in artifact}
+    metadata.update({"format": FORMAT_NAME, "format_version": FORMAT_VERSION,
+                     "class_names": engine.class_names, "feature_names": engine.feature_names})
+    arrays = {
+        "metadata": np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8),
+        "scale": scaler.scale_,
+        "min": scaler.min_,
+        "roots": np.append(engine.roots, len(engine.feature)),
+        "feature": engine.feature,
+        "threshold": float32_floor(threshold),
+        "left": left,
+        "right": right,
+        "entry_class": np.nonzero(nonzero)[1],
+        "entry_proba": value[nonzero],
+        "knot_offsets": np.concatenate([[0], np.cumsum([len(xs) for xs in engine.calib_x])]),
+        "knot_x": np.concatenate(engine.calib_x),
+        "knot_y": np.concatenate(engine.calib_y),
+    }
+    return {name: np.ascontiguousarray(arrays[name], dtype=dtype) for name, dtype in SECTIONS}
+
+
+def encode_flat(sections: dict[str, np.ndarray]) -> bytes:
+    """Lay the sections out behind the header and append the CRC."""
+    body, offsets, position = bytearray(), [], HEADER_BYTES
+    for name, _ in SECTIONS:
+        pad = -position % ALIGN
+        body += bytes(pad)
+        position += pad
+        offsets.append(position)
+        data = sections[name].tobytes()
+        body += data
+        position += len(data)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(SECTIONS),
+        len(sections["scale"]), len(sections["knot_offsets"]) - 1,
+        len(sections["roots"]) - 1, len(sections["feature"]),
+        len(sections["entry_class"]), len(sections["knot_x"]),
+        len(sections["metadata"]), position + 4,
+    ) + _OFFSETS.pack(*offsets)
+    data = header.ljust(HEADER_BYTES, b"\0") + bytes(body)
+    return data + struct.pack("<I", zlib.crc32(data))
+
+
+def _write(path: Path, data: bytes) -> None:
+    """Write to a temporary file, then rename over `path`.
+
+    The file gets the umask's mode, as open() would give it, not mkstemp's
+    0600: it is meant to be copied and read by others.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, staging = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(staging, 0o666 & ~umask)
+        os.replace(staging, path)
+    except BaseException:
+        Path(staging).unlink(missing_ok=True)
+        raise
+
+
+def export_flat(artifact: dict[str, Any], path: Path) -> bytes:
+    """Write the flat model to `path`; returns the bytes written."""
+    data = encode_flat(flat_sections(artifact))
+    _write(Path(path), data)
+    return data
+
+
+# --------------------------------------------------------------------------- #
+# Reference decoder                                                           #
+# --------------------------------------------------------------------------- #
+
+
+@dataclass
+class FlatModel:
+    """A decoded flat model; `predict_proba` follows the Evaluation steps."""
+
+    metadata: dict[str, Any]
+    scale: np.ndarray
+    min: np.ndarray
+    roots: np.ndarray
+    feature: np.ndarray
+    threshold: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    entry_class: np.ndarray
+    entry_proba: np.ndarray
+    knot_offsets: np.ndarray
+    knot_x: np.ndarray
+    knot_y: np.ndarray
+    crc32: int
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots) - 1
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.knot_offsets) - 1
+
+    @property
+    def class_names(self) -> list[str]:
+        return self.metadata["class_names"]
+
+    def scaled(self, X: Any) -> np.ndarray:
+        """Step 1."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        return (X * self.scale + self.min).astype(np.float32)
+
+    def leaves(self, X: Any) -> np.ndarray:
+        """Step 2's exit node of every tree, (n_rows, n_trees)."""
+        s = self.scaled(X)
+        rows = np.arange(len(s))[:, None]
+        node = np.broadcast_to(self.roots[:-1].astype(np.int64), (len(s), self.n_trees)).copy()
+        while True:
+            f = self.feature[node]
+            split = f >= 0
+            if not split.any():
+                return node
+            passes = s[rows, np.maximum(f, 0)] <= self.threshold[node]
+            node = np.where(split, np.where(passes, self.left[node], self.right[node]), node)
+
+    def forest_proba(self, X: Any) -> np.ndarray:
+        """Steps 2 and 3: the uncalibrated forest probabilities."""
+        node = self.leaves(X)
+        dense = np.zeros((len(self.feature), self.n_classes))
+        leaf = np.flatnonzero(self.feature < 0)
+        counts = (self.right[leaf] - self.left[leaf]).astype(np.int64)
+        dense[np.repeat(leaf, counts), self.entry_class] = self.entry_proba
+        raw = np.zeros((len(node), self.n_classes))
+        for t in range(self.n_trees):
+            raw += dense[node[:, t]]
+        return raw / self.n_trees
+
+    def calibrate(self, raw: np.ndarray) -> np.ndarray:
+        """Steps 4 and 5."""
+        proba = np.empty_like(raw)
+        for c in range(self.n_classes):
+            xs = self.knot_x[self.knot_offsets[c]:self.knot_offsets[c + 1]]
+            ys = self.knot_y[self.knot_offsets[c]:self.knot_offsets[c + 1]]
+            proba[:, c] = np.interp(np.clip(raw[:, c], xs[0], xs[-1]), xs, ys)
+        total = proba.sum(axis=1, keepdims=True)
+        uniform = np.full_like(proba, 1.0 / self.n_classes)
+        proba = np.divide(proba, total, out=uniform, where=total != 0)
+        proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+        return proba
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        return self.calibrate(self.forest_proba(X))
+
+
+def decode_flat(data: bytes) -> FlatModel:
+    """Parse and validate a flat model; raises ValueError on any inconsistency."""
+    if len(data) < HEADER_BYTES + 4 or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"not a {FORMAT_NAME} file")
+    (_, version, n_sections, n_features, n_classes, n_trees, n_nodes, n_entries,
+     n_knots, metadata_bytes, file_bytes) = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"format version {version}; this code reads version {FORMAT_VERSION}")
+    if n_sections != len(SECTIONS) or file_bytes != len(data):
+        raise ValueError("header does not match the file")
+    (crc,) = struct.unpack_from("<I", data, file_bytes - 4)
+    if zlib.crc32(data[:file_bytes - 4]) != crc:
+        raise ValueError("CRC mismatch: the file is corrupt or truncated")
+
+    lengths = {
+        "metadata": metadata_bytes, "scale": n_features, "min": n_features,
+        "roots": n_trees + 1, "feature": n_nodes, "threshold": n_nodes, "left": n_nodes,
+        "right": n_nodes, "entry_class": n_entries, "entry_proba": n_entries,
+        "knot_offsets": n_classes + 1, "knot_x": n_knots, "knot_y": n_knots,
+    }
+    arrays, end = {}, HEADER_BYTES
+    for (name, dtype), offset in zip(SECTIONS, _OFFSETS.unpack_from(data, _HEADER.size)):
+        dtype = np.dtype(dtype)
+        if offset < end or offset % ALIGN or offset + lengths[name] * dtype.itemsize > file_bytes - 4:
+            raise ValueError(f"section {name} is out of place")
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=lengths[name], offset=offset)
+        end = offset + lengths[name] * dtype.itemsize
+
+    metadata = json.loads(arrays.pop("metadata").tobytes().decode("utf-8"))
+    if (len(metadata["class_names"]) != n_classes
+            or len(metadata["feature_names"]) != n_features):
+        raise ValueError("metadata does not match the header")
+    model = FlatModel(metadata=metadata, crc32=crc, **arrays)
+    split = model.feature >= 0
+    if (model.feature >= n_features).any() or (model.roots[-1] != n_nodes) \
+            or (model.left[split] >= n_nodes).any() or (model.right[split] >= n_nodes).any() \
+            or (model.right[~split] > n_entries).any() or (model.knot_offsets[-1] != n_knots):
+        raise ValueError("an index points outside its section")
+    return model
+
+
+def read_flat(path: Path) -> FlatModel:
+    return decode_flat(Path(path).read_bytes())
+
+
+# --------------------------------------------------------------------------- #
+# Conformance                                                                 #
+# --------------------------------------------------------------------------- #
+
+
+def _sklearn_reference(artifact: dict[str, Any], X: np.ndarray) -> dict[str, np.ndarray]:
+    """Leaves, forest and calibrated probabilities straight from the fitted objects."""
+    import pandas as pd
+
+    pipeline = artifact["calibrated"].calibrated_classifiers_[0].estimator
+    forest = pipeline[-1]
+    roots = np.cumsum([0] + [e.tree_.node_count for e in forest.estimators_[:-1]])
+    frame = pd.DataFrame(X, columns=artifact["feature_names"])
+    scaled = pipeline[:-1].transform(frame)
+    return {
+        "leaves": forest.apply(scaled) + roots,
+        "forest_proba": forest.predict_proba(scaled),
+        "proba": artifact["calibrated"].predict_proba(frame),
+    }
+
+
+def compare_flat(artifact: dict[str, Any], model: FlatModel, X: Any) -> dict[str, Any]:
+    """The decoder against sklearn on `X`: routing and probability agreement."""
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+    expected = _sklearn_reference(artifact, X)
+    proba = model.predict_proba(X)
+    return {
+        "rows": int(len(X)),
+        "leaf_mismatches": int((model.leaves(X) != expected["leaves"]).any(axis=1).sum()),
+        "max_abs_diff": float(np.abs(proba - expected["proba"]).max()),
+        "argmax_mismatches": int((proba.argmax(1) != expected["proba"].argmax(1)).sum()),
+    }
+
+
+def _boundary_cases(artifact: dict[str, Any], model: FlatModel, base: np.ndarray,
+                    per_feature: int, rng: np.random.Generator) -> list[tuple[str, np.ndarray]]:
+    """Rows sitting exactly on a split and one float above it.
+
+    Only pairs that route differently in some tree are kept, so each one
+    exercises the float32 rounding of step 1 at a real boundary.
+    """
+    from inference import fold_thresholds
+
+    stats = artifact["feature_stats"]
+    cases = []
+    for j, name in enumerate(model.metadata["feature_names"]):
+        nodes = np.flatnonzero(model.feature == j)
+        raw = np.unique(fold_thresholds(
+            model.threshold[nodes].astype(np.float64), model.scale[j], model.min[j]))
+        raw = raw[(raw >= stats[name]["min"]) & (np.nextafter(raw, np.inf) <= stats[name]["max"])]
+        kept = 0
+        for value in rng.permutation(raw):
+            pair = np.repeat(base[None, :], 2, axis=0)
+            pair[:, j] = value, np.nextafter(value, np.inf)
+            if (model.leaves(pair)[0] != model.leaves(pair)[1]).any():
+                cases += [(f"{name} on a split", pair[0]), (f"{name} just above it", pair[1])]
+                kept += 1
+                if kept == per_feature:
+                    break
+    return cases
+
+
+def conformance_vectors(artifact: dict[str, Any], data: bytes, model_name: str,
+                        X: np.ndarray | None = None, y: Any = None, seed: int = 0) -> dict[str, Any]:
+    """Inputs and sklearn's outputs for them, for checking a decoder port.
+
+    Cases: `VECTOR_ROWS_PER_CLASS` rows of each class from `X`/`y` (the
+    training data) when given, the feature_stats min, median and max rows,
+    and `VECTOR_BOUNDARIES_PER_FEATURE` on/above-a-split pairs per feature.
+    """
+    model = decode_flat(data)
+    names, stats = model.metadata["feature_names"], artifact["feature_stats"]
+    rng = np.random.default_rng(seed)
+    cases: list[tuple[str, np.ndarray]] = []
+    if X is not None and y is not None:
+        X, y = np.asarray(X, dtype=np.float64), np.asarray(y).astype(str)
+        for crop in model.class_names:
+            rows = np.flatnonzero(y == crop)
+            for i in rng.choice(rows, min(VECTOR_ROWS_PER_CLASS, len(rows)), replace=False):
+                cases.append((f"training row {i} ({crop})", X[i]))
+    for point in ("min", "median", "max"):
+        cases.append((f"feature_stats {point}", np.array([stats[n][point] for n in names], dtype=float)))
+    median = np.array([stats[n]["median"] for n in names], dtype=float)
+    cases += _boundary_cases(artifact, model, median, VECTOR_BOUNDARIES_PER_FEATURE, rng)
+
+    inputs = np.array([x for _, x in cases])
+    expected = _sklearn_reference(artifact, inputs)
+    scaled = model.scaled(inputs)
+    return {
+        "format": VECTORS_NAME,
+        "format_version": FORMAT_VERSION,
+        "model": {"file": model_name, "bytes": len(data), "crc32": model.crc32},
+        "tolerance": VECTOR_TOLERANCE,
+        "feature_names": names,
+        "class_names": model.class_names,
+        "cases": [
+            {
+                "name": name,
+                "input": inputs[i].tolist(),
+                "scaled": scaled[i].astype(np.float64).tolist(),
+                "leaves": expected["leaves"][i].tolist(),
+                "forest_proba": expected["forest_proba"][i].tolist(),
+                "proba": expected["proba"][i].tolist(),
+                "crop": model.class_names[int(expected["proba"][i].argmax())],
+            }
+            for i, (name, _) in enumerate(cases)
+        ],
+    }
+
+
+def check_vectors(model: FlatModel, vectors: dict[str, Any]) -> dict[str, Any]:
+    """Run `model` on the vectors; every field must match (probabilities within tolerance)."""
+    if vectors.get("format") != VECTORS_NAME:
+        raise ValueError(f"not a {VECTORS_NAME} file")
+    if vectors["model"]["crc32"] != model.crc32:
+        raise ValueError("the vectors were generated for a different model file")
+    cases = vectors["cases"]
+    X = np.array([case["input"] for case in cases], dtype=np.float64)
+    scaled, leaves = model.scaled(X), model.leaves(X)
+    raw = model.forest_proba(X)
+    proba = model.calibrate(raw)
+    failures = []
+    for i, case in enumerate(cases):
+        if (not np.array_equal(scaled[i], np.array(case["scaled"], dtype=np.float32))
+                or not np.array_equal(leaves[i], case["leaves"])
+                or np.abs(raw[i] - case["forest_proba"]).max() > vectors["tolerance"]
+                or np.abs(proba[i] - case["proba"]).max() > vectors["tolerance"]
+                or model.class_names[int(proba[i].argmax())] != case["crop"]):
+            failures.append(case["name"])
+    expected = np.array([case["proba"] for case in cases])
+    return {"cases": len(cases), "failures": failures,
+            "max_abs_diff": float(np.abs(proba - expected).max())}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    e = sub.add_parser("export", help="write the flat model and its conformance vectors")
+    e.add_argument("model", help="joblib artefact to convert")
+    e.add_argument("--out", help="output file (default: <model>.flat next to it)")
+    e.add_argument("--vectors", help="vectors file (default: <model>.vectors.json next to it)")
+    e.add_argument("--data", help="training CSV: verify on it and draw vector rows from it")
+    c = sub.add_parser("check", help="run the reference decoder on a vectors file")
+    c.add_argument("flat", type=Path, help="flat model file")
+    c.add_argument("vectors", type=Path, help="conformance vectors file")
+    args = ap.parse_args()
+
+    if args.command == "check":
+        try:
+            result = check_vectors(read_flat(args.flat), json.loads(args.vectors.read_text()))
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
+        print(f"{result['cases'] - len(result['failures'])} of {result['cases']} cases pass, "
+              f"max |dp| {result['max_abs_diff']:.2e}")
+        if result["failures"]:
+            raise SystemExit("failed: " + ", ".join(result["failures"]))
+        return
+
+    import joblib
+
+    source = Path(args.model)
+    target = Path(args.out) if args.out else source.with_suffix(".flat")
+    vectors_path = Path(args.vectors) if args.vectors else source.with_suffix(".vectors.json")
+    artifact = joblib.load(source)
+    X = y = None
+    if args.data:
+        import pandas as pd
+
+        frame = pd.read_csv(args.data)
+        X, y = frame[artifact["feature_names"]].to_numpy(dtype=float), frame.get("label")
+    try:
+        data = export_flat(artifact, target)
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+    model = decode_flat(data)
+    print(f"wrote {target} ({len(data) / 1e3:.1f} kB: {model.n_trees} trees, "
+          f"{len(model.feature):,} nodes, {len(model.entry_class):,} leaf entries)")
+    if X is not None:
+        record = compare_flat(artifact, model, X)
+        print(f"verified on {record['rows']:,} rows: {record['leaf_mismatches']} routing "
+              f"differences, max |dp| {record['max_abs_diff']:.2e}, "
+              f"{record['argmax_mismatches']} top-1 changes")
+        if record["leaf_mismatches"] or record["max_abs_diff"] > VECTOR_TOLERANCE:
+            target.unlink(missing_ok=True)
+            raise SystemExit("the decoder does not reproduce sklearn; export removed")
+    vectors = conformance_vectors(artifact, data, target.name, X, y)
+    _write(vectors_path, json.dumps(vectors, indent=1).encode("utf-8"))
+    print(f"wrote {vectors_path} ({len(vectors['cases'])} cases)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+fold_engine.py
+==============
+Shared model fits for the training protocol in build_model.py.
+
+The Sec. 2.3 / 4.5 / 4.7 protocol fits the same pipeline many times per
+feature set: 30 repeated-CV folds, the 80/20 holdout fit, 5 internal
+calibration folds plus a refit, 10 out-of-fold folds, and the deployment fits
+(another 5 calibration folds plus a refit). Several of those are the same fit:
+
+  * the first repeat of RepeatedStratifiedKFold(10, 3, random_state=42) draws
+    exactly the splits of StratifiedKFold(10, shuffle=True, random_state=42)
+  * CalibratedClassifierCV(ensemble=False) refits its estimator on the very
+    rows, in the very order, of the plain fit next to it
+
+A fit is identified by its feature set and its training row positions *in
+order* (row order changes the bootstrap, so only identical sequences are
+shared). Callers declare every fit they need with `FoldEngine.fit()`, each
+with the rows it should be scored on; `run()` then trains each distinct fit
+once, across a process pool, and keeps the probabilities (and the model, when
+asked). Every metric is derived afterwards from those shared results, and is
+bit-identical to fitting each step separately.
+
+Usage
+-----
+    engine = FoldEngine(df, "label", make_pipeline, workers=4)
+    fold = engine.fit(features, train_rows, predict=test_rows)
+    engine.run()
+    fold.proba(test_rows)                  # (len(test_rows), n_classes)
+    calibrated_from_folds(fold.model, ...)  # CalibratedClassifierCV, ensemble=False
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.preprocessing import LabelEncoder
+
+# Set in each worker by _init_worker; the frame is shipped once per process.
+_FRAME: pd.DataFrame | None = None
+_TARGET: str | None = None
+_FACTORY: Callable[[], Any] | None = None
+
+
+class FoldFit:
+    """One distinct fit: its key, the rows it scores, and (after run) results."""
+
+    def __init__(self, features: tuple[str, ...], train: np.ndarray):
+        self.features = features
+        self.train = train
+        self.predict_rows = np.zeros(0, dtype=np.int64)
+        self.keep = False
+        self.requests = 0
+        self.classes: np.ndarray | None = None
+        self.model: Any = None
+        self._proba: np.ndarray | None = None
+
+    def proba(self, rows: Sequence[int]) -> np.ndarray:
+        """Probabilities for `rows` (which must have been requested), in that order."""
+        if self._proba is None:
+            raise RuntimeError("FoldEngine.run() has not been called")
+        rows = np.asarray(rows, dtype=np.int64)
+        position = np.searchsorted(self.predict_rows, rows)
+        if (position >= len(self.predict_rows)).any() or (self.predict_rows[position] != rows).any():
+            raise KeyError("rows were not requested when the fit was declared")
+        return self._proba[position]
+
+    def predict(self, rows: Sequence[int]) -> np.ndarray:
+        """Labels as the estimator's `predict` would give them (argmax of proba)."""
+        return self.classes[self.proba(rows).argmax(axis=1)]
+
+
+def _init_worker(frame: pd.DataFrame, target: str, factory: Callable[[], Any]) -> None:
+    global _FRAME, _TARGET, _FACTORY
+    _FRAME, _TARGET, _FACTORY = frame, target, factory
+
+
+def _single_threaded(estimator: Any) -> dict[str, Any]:
+    """Pin every `n_jobs` of an estimator to 1; returns the original values."""
+    original = {k: v for k, v in estimator.get_params().items() if k.endswith("n_jobs")}
+    estimator.set_params(**{k: 1 for k in original})
+    return original
+
+
+def _fit_one(features: tuple[str, ...], train: np.ndarray, predict_rows: np.ndarray,
+             keep: bool, pooled: bool = True) -> tuple[np.ndarray, np.ndarray, Any]:
+    X = _FRAME[list(features)]
+    y = _FRAME[_TARGET]
+    estimator = _FACTORY()
+    original = _single_threaded(estimator) if pooled else {}
+    estimator.fit(X.iloc[train], y.iloc[train])
+    proba = (estimator.predict_proba(X.iloc[predict_rows]) if len(predict_rows)
+             else np.zeros((0, len(estimator.classes_))))
+    if original:
+        estimator.set_params(**original)  # as the factory built it, for the artefact
+    return estimator.classes_, proba, estimator if keep else None
+
+
+class FoldEngine:
+    """Collects fit declarations, deduplicates them, and trains each once."""
+
+    def __init__(self, frame: pd.DataFrame, target: str, factory: Callable[[], Any],
+                 workers: int | None = None):
+        self.frame = frame.reset_index(drop=True)
+        self.target = target
+        self.factory = factory
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._fits: dict[tuple[tuple[str, ...], bytes], FoldFit] = {}
+        self.seconds = 0.0
+
+    def fit(self, features: Sequence[str], train: Sequence[int],
+            predict: Sequence[int] = (), keep: bool = False) -> FoldFit:
+        """Declare a fit on `train` (row positions) scored on `predict`.
+
+        Declaring the same features and training sequence again returns the same
+        FoldFit with the prediction rows merged; `keep` retains the fitted model.
+        A fit that has already run is returned as it is if it covers the request
+        (ablation.py declares in rounds, between runs).
+        """
+        features = tuple(features)
+        train = np.asarray(train, dtype=np.int64)
+        predict = np.asarray(predict, dtype=np.int64)
+        key = (features, train.tobytes())
+        fold = self._fits.get(key)
+        if fold is None:
+            fold = self._fits[key] = FoldFit(features, train)
+        if fold._proba is not None:
+            if not np.isin(predict, fold.predict_rows).all() or (keep and fold.model is None):
+                raise RuntimeError("a fit cannot be extended after it has run")
+            fold.requests += 1
+            return fold
+        fold.predict_rows = np.union1d(fold.predict_rows, predict)
+        fold.keep = fold.keep or keep
+        fold.requests += 1
+        return fold
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "fits_declared": sum(f.requests for f in self._fits.values()),
+            "fits_run": len(self._fits),
+            "workers": self.workers,
+            "seconds": round(self.seconds, 2),
+        }
+
+    def run(self) -> None:
+        """Train every declared fit that has not run yet."""
+        pending = [f for f in self._fits.values() if f._proba is None]
+        # Biggest first so the pool is not left waiting on a long tail.
+        pending.sort(key=lambda f: len(f.train), reverse=True)
+        started = time.perf_counter()
+        if self.workers <= 1 or len(pending) <= 1:
+            _init_worker(self.frame, self.target, self.factory)
+            results = [_fit_one(f.features, f.train, f.predict_rows, f.keep, pooled=False)
+                       for f in pending]
+        else:
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                     initargs=(self.frame, self.target, self.factory)) as pool:
+                futures = [pool.submit(_fit_one, f.features, f.train, f.predict_rows, f.keep)
+                           for f in pending]
+                results = [future.result() for future in futures]
+        for fold, (classes, proba, model) in zip(pending, results):
+            fold.classes, fold._proba, fold.model = classes, proba, model
+        self.seconds += time.perf_counter() - started
+
+
+def out_of_fold(folds: Sequence[tuple[FoldFit, np.ndarray]], rows: np.ndarray,
+                classes: np.ndarray) -> np.ndarray:
+    """Assemble `cross_val_predict(method="predict_proba")` from fitted folds.
+
+    `folds` pairs each fit with the rows it was tested on; `rows` are the rows
+    cross-validated, in output order. A fold whose training rows missed a
+    class gets zeros in that column, as sklearn does.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    position = np.empty(rows.max() + 1, dtype=np.int64)
+    position[rows] = np.arange(len(rows))
+    out = np.zeros((len(rows), len(classes)))
+    for fold, test in folds:
+        columns = np.searchsorted(classes, fold.classes)
+        out[np.ix_(position[test], columns)] = fold.proba(test)
+    return out
+
+
+def calibrated_from_folds(model: Any, predictions: np.ndarray, y: Any,
+                          method: str = "isotonic", cv: int = 5,
+                          classes: np.ndarray | None = None) -> CalibratedClassifierCV | None:
+    """The fitted CalibratedClassifierCV(ensemble=False) for a refit and its folds.
+
+    `model` is the estimator fitted on all of `y`'s rows and `predictions` the
+    out-of-fold probabilities from the same estimator on `cv` stratified folds,
+    which is what `CalibratedClassifierCV.fit` computes itself before fitting
+    one calibrator per class. `classes` defaults to those present in `y`; pass
+    the model's own when `y` may lack some. Returns None when this scikit-learn
+    version does not expose the calibrator helper; callers then fit it the
+    ordinary way.
+    """
+    try:
+        from sklearn.calibration import _fit_calibrator
+    except ImportError:
+        return None
+    calibrated = CalibratedClassifierCV(estimator=clone(model), method=method, cv=cv, ensemble=False)
+    calibrated.classes_ = LabelEncoder().fit(y).classes_ if classes is None else np.asarray(classes)
+    calibrated.calibrated_classifiers_ = [
+        _fit_calibrator(model, predictions, y, calibrated.classes_, method)
+    ]
+    for attribute in ("n_features_in_", "feature_names_in_"):
+        if hasattr(model, attribute):
+            setattr(calibrated, attribute, getattr(model, attribute))
+    return calibrated
@@ -0,0 +1,556 @@
+"""
+inference.py
+============
+Array-backed inference engine for crop_model_v2.pkl.
+
+`artifact["calibrated"].predict_proba` walks CalibratedClassifierCV -> Pipeline
+-> MinMaxScaler -> 100 sklearn trees, with input validation and joblib dispatch
+at every level. For one row nearly all of that is overhead. This module
+compiles the same fitted objects into flat NumPy arrays once, at load time:
+
+  * every tree is flattened into shared node arrays (feature, threshold,
+    left, right, value)
+  * the MinMaxScaler is folded into the split thresholds, so raw inputs are
+    compared directly; the folding reproduces the float32 cast sklearn applies
+    before comparing, so every row takes the same branch as in sklearn
+  * each per-class isotonic calibrator becomes a knot table evaluated with
+    `np.interp`, followed by the normalisation CalibratedClassifierCV applies
+
+Rows are routed through all trees at once with a bit-vector index built from
+the node arrays: for each feature, the sorted split thresholds carry the
+cumulative mask of leaves that a value above them rules out. One
+`searchsorted` per feature and an AND across features leaves each tree's exit
+leaf as the lowest surviving bit, with no per-level loop.
+
+Usage
+-----
+    from inference import compile_artifact
+    engine = compile_artifact(artifact)
+    proba = engine.predict_proba(X)          # X: (n_rows, n_features), raw units
+
+    python inference.py --data Crop_recommendation.csv   # agreement + latency
+
+The input range checks and the deferral rules used by every serving path live
+here too, so the app and the batch tools apply the same ones.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from scipy import sparse
+
+from telemetry import TELEMETRY
+
+# Rows routed per block; keeps the (rows, trees, words) masks cache-resident.
+BLOCK_ROWS = 512
+# Below this many rows, summing gathered leaf values beats a sparse product.
+DENSE_SUM_ROWS = 32
+# Narrow (slim) leaf values: from this many rows, accumulate tree by tree in
+# blocks of LEAF_BLOCK_ROWS instead of summing one (rows, trees, classes) gather.
+TREE_LOOP_ROWS = 128
+LEAF_BLOCK_ROWS = 4096
+
+_ALL_BITS = np.uint64(0xFFFFFFFFFFFFFFFF)
+# The ten top-1 confidence bins of expected_calibration_error.
+CONFIDENCE_EDGES = np.linspace(0.0, 1.0, 11)
+
+
+# --------------------------------------------------------------------------- #
+# Compilation                                                                 #
+# --------------------------------------------------------------------------- #
+
+
+def _scaled_le(x: np.ndarray, scale: np.ndarray, offset: np.ndarray,
+               threshold: np.ndarray) -> np.ndarray:
+    """The split test exactly as sklearn evaluates it on a raw value.
+
+    MinMaxScaler computes `x * scale + min` in float64, and the tree casts the
+    result to float32 before comparing it with the float64 threshold.
+    """
+    scaled = (x * scale + offset).astype(np.float32).astype(np.float64)
+    return scaled <= threshold
+
+
+def fold_thresholds(threshold: np.ndarray, scale: np.ndarray,
+                    offset: np.ndarray) -> np.ndarray:
+    """Raw-unit thresholds `r` with `x <= r` iff the scaled split test passes.
+
+    The scaled test is monotone in `x`, so the largest raw value that still
+    goes left is found by bisection from the algebraic inverse. The result is
+    exact, not an approximation of the boundary.
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    guess = (threshold - offset) / scale
+    width = (np.abs(threshold) + 1.0) * 2.0 ** -20 / scale + 1e-12
+    lo, hi = guess - width, guess + width
+    for _ in range(8):
+        bad = ~_scaled_le(lo, scale, offset, threshold) | _scaled_le(hi, scale, offset, threshold)
+        if not bad.any():
+            break
+        width = np.where(bad, width * 16.0, width)
+        lo, hi = guess - width, guess + width
+    else:
+        raise ValueError("could not bracket a split threshold in raw units")
+    for _ in range(128):
+        mid = lo + (hi - lo) / 2.0
+        done = (mid <= lo) | (mid >= hi)
+        if done.all():
+            break
+        left = _scaled_le(mid, scale, offset, threshold)
+        lo = np.where(~done & left, mid, lo)
+        hi = np.where(~done & ~left, mid, hi)
+    return lo
+
+
+def _leaf_masks(lo: np.ndarray, hi: np.ndarray, n_words: int) -> np.ndarray:
+    """Per node, a bit mask with leaf slots `[lo, hi)` cleared, (n, n_words)."""
+    slots = np.arange(n_words * 64)
+    keep = (slots < lo[:, None]) | (slots >= hi[:, None])
+    return np.packbits(keep, axis=1, bitorder="little").view(np.uint64)
+
+
+@dataclass
+class CompiledForest:
+    """A calibrated min-max + Random Forest pipeline as flat arrays.
+
+    Node arrays are indexed globally; `roots` gives where each tree starts and
+    leaves have `left == right == -1`. The routing index is derived from them
+    in `__post_init__` unless it is passed in (array_artifact.py stores it).
+    """
+
+    feature_names: list[str]
+    class_names: list[str]
+    feature: np.ndarray        # (n_nodes,) split feature, -1 at leaves
+    threshold: np.ndarray      # (n_nodes,) raw-unit threshold, NaN at leaves
+    left: np.ndarray           # (n_nodes,) global index of the left child
+    right: np.ndarray          # (n_nodes,) global index of the right child
+    value: np.ndarray          # (n_nodes, n_classes) normalised class distribution
+    roots: np.ndarray          # (n_trees,) global index of each root
+    calib_x: list[np.ndarray]  # per class: isotonic knots (x)
+    calib_y: list[np.ndarray]  # per class: isotonic knots (y)
+
+    # Routing index; derived from the node arrays unless supplied prebuilt.
+    split_values: list[np.ndarray] | None = field(default=None, repr=False)
+    split_masks: list[np.ndarray] | None = field(default=None, repr=False)
+    leaf_slots: np.ndarray | None = field(default=None, repr=False)
+    # Slim layout (array_artifact.py): with `mask_rows`, split_masks[f] holds
+    # each distinct (n_words,) mask once and mask_rows[f][cell, tree] indexes
+    # it; leaf_slots index a leaf-only `value`, stored as value_scale * ints
+    # when value_scale is set.
+    mask_rows: list[np.ndarray] | None = field(default=None, repr=False)
+    value_scale: float | None = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.split_values is None or self.split_masks is None or self.leaf_slots is None:
+            self._build_index()
+
+    @property
+    def n_trees(self) -> int:
+        return int(len(self.roots))
+
+    @property
+    def n_classes(self) -> int:
+        return int(self.value.shape[1])
+
+    def _build_index(self) -> None:
+        """Per-feature sorted thresholds with cumulative leaf masks per tree."""
+        n_nodes = len(self.feature)
+        tree_of = np.repeat(np.arange(self.n_trees), np.diff(np.append(self.roots, n_nodes)))
+        internal = np.flatnonzero(self.left >= 0)
+        if (self.left[internal] <= internal).any() or (self.right[internal] <= internal).any():
+            raise ValueError("tree nodes must be numbered parents before children")
+
+        # Leaf slots in left-to-right order: count leaves bottom-up, then hand
+        # out starting slots top-down.
+        n_below = np.ones(n_nodes, dtype=np.int64)
+        for node in internal[::-1]:
+            n_below[node] = n_below[self.left[node]] + n_below[self.right[node]]
+        start = np.zeros(n_nodes, dtype=np.int64)
+        for node in internal:
+            start[self.left[node]] = start[node]
+            start[self.right[node]] = start[node] + n_below[self.left[node]]
+
+        n_words = int(-(-n_below[self.roots].max() // 64))
+        leaf_slots = np.zeros((self.n_trees, n_words * 64), dtype=np.int64)
+        leaves = np.flatnonzero(self.left < 0)
+        leaf_slots[tree_of[leaves], start[leaves]] = leaves
+
+        # A value above a node's threshold rules out its left subtree's leaves.
+        masks = _leaf_masks(start[internal], start[internal] + n_below[self.left[internal]], n_words)
+        self.split_values, self.split_masks = [], []
+        for f in range(len(self.feature_names)):
+            mine = self.feature[internal] == f
+            values, rank = np.unique(self.threshold[internal][mine], return_inverse=True)
+            table = np.full((len(values) + 1, self.n_trees, n_words), _ALL_BITS)
+            np.bitwise_and.at(table, (rank + 1, tree_of[internal][mine]), masks[mine])
+            self.split_values.append(values)
+            self.split_masks.append(np.bitwise_and.accumulate(table, axis=0))
+        self.leaf_slots = leaf_slots
+
+    def _as_matrix(self, X: Any) -> np.ndarray:
+        if hasattr(X, "columns"):
+            X = X[self.feature_names].to_numpy()
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"expected {len(self.feature_names)} features, got {X.shape[1]}"
+            )
+        return X
+
+    def cells(self, X: Any) -> np.ndarray:
+        """Per row and feature, how many of that feature's thresholds lie below it.
+
+        Rows with equal cells reach the same leaf in every tree.
+        """
+        X = self._as_matrix(X)
+        return np.column_stack([
+            np.searchsorted(values, X[:, f], side="left")
+            for f, values in enumerate(self.split_values)
+        ])
+
+    def _masks(self, f: int, column: np.ndarray) -> np.ndarray:
+        # take() rather than [] indexing: a fraction of the overhead on memmaps.
+        if self.mask_rows is None:
+            return self.split_masks[f].take(column, axis=0)
+        return self.split_masks[f].take(self.mask_rows[f].take(column, axis=0), axis=0)
+
+    def _leaves_from_cells(self, cells: np.ndarray) -> np.ndarray:
+        alive = self._masks(0, cells[:, 0])
+        for f in range(1, cells.shape[1]):
+            alive &= self._masks(f, cells[:, f])
+        word = (alive != 0).argmax(axis=2)
+        bits = np.take_along_axis(alive, word[..., None], axis=2)[..., 0]
+        lowest = bits & (~bits + np.uint64(1))
+        slot = word * 64 + np.frexp(lowest.astype(np.float64))[1] - 1
+        return self.leaf_slots[np.arange(self.n_trees), slot]
+
+    def leaves(self, X: Any) -> np.ndarray:
+        """Global leaf index reached by every row in every tree, (n_rows, n_trees)."""
+        return self._route(self.cells(X))
+
+    def _route(self, cells: np.ndarray) -> np.ndarray:
+        out = np.empty((len(cells), self.n_trees), dtype=np.int64)
+        for start in range(0, len(cells), BLOCK_ROWS):
+            out[start:start + BLOCK_ROWS] = self._leaves_from_cells(cells[start:start + BLOCK_ROWS])
+        return out
+
+    def leaf_proba(self, leaves: np.ndarray) -> np.ndarray:
+        """Average the trees' leaf distributions, tree by tree as sklearn does."""
+        n_rows = len(leaves)
+        if self.value.dtype != np.float64:  # slim layout: exact integer (or float64) sums
+            total = np.float64 if self.value.dtype.kind == "f" else np.uint32
+            out = np.empty((n_rows, self.n_classes))
+            if n_rows < TREE_LOOP_ROWS:
+                out[:] = self.value[leaves].sum(axis=1, dtype=total)
+            for start in range(0, n_rows if n_rows >= TREE_LOOP_ROWS else 0, LEAF_BLOCK_ROWS):
+                block = leaves[start:start + LEAF_BLOCK_ROWS]
+                acc = np.zeros((len(block), self.n_classes), dtype=total)
+                for t in range(self.n_trees):
+                    acc += self.value[block[:, t]]
+                out[start:start + LEAF_BLOCK_ROWS] = acc
+            return out * ((self.value_scale or 1.0) / self.n_trees)
+        if n_rows < DENSE_SUM_ROWS:
+            return self.value[leaves].sum(axis=1) / self.n_trees
+        hits = sparse.csr_matrix(
+            (np.ones(leaves.size), leaves.ravel(), np.arange(0, leaves.size + 1, self.n_trees)),
+            shape=(n_rows, len(self.value)),
+        )
+        return np.asarray(hits @ self.value) / self.n_trees
+
+    def forest_proba(self, X: Any) -> np.ndarray:
+        """Uncalibrated forest probabilities, as `artifact["pipeline"].predict_proba`."""
+        return self.leaf_proba(self.leaves(X))
+
+    def calibrate(self, raw: np.ndarray) -> np.ndarray:
+        """Apply the isotonic tables and CalibratedClassifierCV's normalisation."""
+        proba = np.empty_like(raw)
+        for k, (xs, ys) in enumerate(zip(self.calib_x, self.calib_y)):
+            proba[:, k] = np.interp(np.clip(raw[:, k], xs[0], xs[-1]), xs, ys)
+        total = proba.sum(axis=1, keepdims=True)
+        uniform = np.full_like(proba, 1.0 / self.n_classes)
+        proba = np.divide(proba, total, out=uniform, where=total != 0)
+        proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+        return proba
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        """Calibrated probabilities, as `artifact["calibrated"].predict_proba`."""
+        with TELEMETRY.stage("scaling"):  # folded into the threshold search
+            cells = self.cells(X)
+        with TELEMETRY.stage("forest"):
+            raw = self.leaf_proba(self._route(cells))
+        with TELEMETRY.stage("isotonic"):
+            return self.calibrate(raw)
+
+
+def compile_artifact(artifact: dict[str, Any]) -> CompiledForest:
+    """Build a CompiledForest from the fitted objects in the artefact.
+
+    The forest is taken from the calibrated model's base estimator, which
+    `build_model.build_artifact` binds to `artifact["pipeline"]`, so the engine
+    reproduces the served probabilities even if that sharing was refused.
+    Raises ValueError for any model shape this engine does not cover.
+    """
+    calibrated = artifact["calibrated"]
+    if len(calibrated.calibrated_classifiers_) != 1:
+        raise ValueError("only ensemble=False calibration can be compiled")
+    member = calibrated.calibrated_classifiers_[0]
+    if list(member.estimator[-1].classes_) != list(calibrated.classes_):
+        raise ValueError("forest and calibrator disagree on class order")
+    return compile_forest(member.estimator, artifact["feature_names"], member.calibrators)
+
+
+def compile_forest(pipeline: Any, feature_names: list[str],
+                   calibrators: list[Any] | None = None) -> CompiledForest:
+    """Compile a fitted MinMaxScaler + RandomForestClassifier pipeline.
+
+    `calibrators` are the per-class isotonic regressions; without them the
+    engine's calibration step is the identity, so `predict_proba` returns the
+    forest's own probabilities (how build_model times search candidates).
+    """
+    steps = [type(step).__name__ for step in pipeline]
+    if steps != ["MinMaxScaler", "RandomForestClassifier"]:
+        raise ValueError(f"unsupported pipeline {steps}")
+    scaler, forest = pipeline[0], pipeline[-1]
+    if getattr(scaler, "clip", False):
+        raise ValueError("clipping MinMaxScaler is not supported")
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left < 0
+        feature = np.where(is_leaf, -1, tree.feature)
+        threshold = np.full(tree.node_count, np.nan)
+        if (~is_leaf).any():
+            f = feature[~is_leaf]
+            threshold[~is_leaf] = fold_thresholds(
+                tree.threshold[~is_leaf], scaler.scale_[f], scaler.min_[f]
+            )
+        value = tree.value[:, 0, :].astype(np.float64)
+        value = value / value.sum(axis=1, keepdims=True)
+
+        features.append(feature)
+        thresholds.append(threshold)
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset))
+        values.append(value)
+        roots.append(offset)
+        offset += tree.node_count
+
+    calib_x, calib_y = [], []
+    for calibrator in calibrators or []:
+        if getattr(calibrator, "out_of_bounds", "clip") != "clip":
+            raise ValueError("only out_of_bounds='clip' isotonic calibrators are supported")
+        calib_x.append(np.asarray(calibrator.X_thresholds_, dtype=np.float64))
+        calib_y.append(np.asarray(calibrator.y_thresholds_, dtype=np.float64))
+    if not calibrators:
+        calib_x = [np.array([0.0, 1.0]) for _ in forest.classes_]
+        calib_y = [np.array([0.0, 1.0]) for _ in forest.classes_]
+
+    return CompiledForest(
+        feature_names=list(feature_names),
+        class_names=[str(c) for c in forest.classes_],
+        feature=np.concatenate(features).astype(np.int64),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts).astype(np.int64),
+        right=np.concatenate(rights).astype(np.int64),
+        value=np.ascontiguousarray(np.concatenate(values)),
+        roots=np.asarray(roots, dtype=np.int64),
+        calib_x=calib_x,
+        calib_y=calib_y,
+    )
+
+
+# --------------------------------------------------------------------------- #
+# Serving helpers shared by the app and the batch tools                       #
+# --------------------------------------------------------------------------- #
+
+# Display metadata only; the artefact is the authority on features and ranges.
+FEATURE_META = {
+    "N": {"label": "Nitrogen (N)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
+    "P": {"label": "Phosphorus (P)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
+    "K": {"label": "Potassium (K)", "unit": "kg ha⁻¹", "step": 1.0, "fmt": "%.0f"},
+    "temperature": {"label": "Temperature", "unit": "°C", "step": 0.1, "fmt": "%.2f"},
+    "humidity": {"label": "Relative humidity", "unit": "%", "step": 0.1, "fmt": "%.2f"},
+    "ph": {"label": "Soil pH", "unit": "", "step": 0.01, "fmt": "%.2f"},
+    "rainfall": {"label": "Rainfall", "unit": "mm", "step": 1.0, "fmt": "%.2f"},
+}
+
+CROP_NOTES = {
+    "apple": "Temperate; needs winter chill and well-drained loam.",
+    "banana": "Warm and humid throughout; heavy potassium feeder.",
+    "blackgram": "Short-duration pulse; warm conditions and fertile loamy soil.",
+    "chickpea": "Cool, dry finish; sensitive to waterlogging.",
+    "coconut": "Coastal humid tropics; sandy soils with steady moisture.",
+    "coffee": "Shaded highlands; well-distributed rainfall, acidic soil.",
+    "cotton": "Long warm season; deep soils, high nitrogen demand.",
+    "grapes": "Dry ripening period; very high P and K requirement.",
+    "jute": "Warm and humid with moderate rainfall; alluvial soils.",
+    "kidneybeans": "Moderate temperature; avoid waterlogged fields.",
+    "lentil": "Cool season pulse; low input, drought tolerant.",
+    "maize": "Wide adaptability; responsive to nitrogen.",
+    "mango": "Dry flowering period followed by warm humid growth.",
+    "mothbeans": "Arid and semi-arid; highly drought tolerant.",
+    "mungbean": "Short duration; warm season, low water need.",
+    "muskmelon": "Hot dry weather; sandy loam with irrigation.",
+    "orange": "Subtropical; well-drained soil, moderate rainfall.",
+    "papaya": "Continuous warmth; frost and waterlogging intolerant.",
+    "pigeonpeas": "Deep-rooted, drought hardy; long duration.",
+    "pomegranate": "Semi-arid; tolerates poor soils, dislikes humidity at ripening.",
+    "rice": "High rainfall or assured irrigation; puddled fields.",
+    "watermelon": "Hot dry season; sandy loam and steady irrigation.",
+}
+
+
+def load_model(path: str | Path) -> dict[str, Any]:
+    """Load either artefact format with `_engine` attached.
+
+    A directory is the pickle-free array export (array_artifact.py); anything
+    else is the joblib pickle written by build_model.py.
+    """
+    path = Path(path)
+    if path.is_dir():
+        from array_artifact import load_arrays
+
+        return load_arrays(path)
+    import joblib
+
+    return attach_engine(joblib.load(path))
+
+
+def attach_engine(artifact: dict[str, Any]) -> dict[str, Any]:
+    """Compile the artefact into `artifact["_engine"]`, or None if it cannot be."""
+    try:
+        artifact["_engine"] = compile_artifact(artifact)
+    except (ValueError, AttributeError, KeyError):  # serve through sklearn instead
+        artifact["_engine"] = None
+    return artifact
+
+
+def predict_proba(artifact: dict[str, Any], X: np.ndarray) -> np.ndarray:
+    """Calibrated probabilities for raw rows ordered as `artifact["feature_names"]`."""
+    engine = artifact.get("_engine")
+    if engine is not None:
+        return engine.predict_proba(X)
+    import pandas as pd
+
+    with TELEMETRY.stage("sklearn_predict"):
+        frame = pd.DataFrame(np.asarray(X, dtype=float), columns=artifact["feature_names"])
+        return artifact["calibrated"].predict_proba(frame)
+
+
+def validate(values: dict[str, float], stats: dict[str, dict]) -> list[str]:
+    """Reject inputs outside the trained ranges (Table 4; Sec. 5, Tier 2)."""
+    with TELEMETRY.stage("validate"):
+        problems = []
+        for name, value in values.items():
+            info = stats[name]
+            label = FEATURE_META.get(name, {}).get("label", name)
+            unit = FEATURE_META.get(name, {}).get("unit", "")
+            if value is None or not np.isfinite(value):
+                problems.append(f"{label}: enter a number.")
+            elif value < info["min"] or value > info["max"]:
+                problems.append(
+                    f"{label} = {value:g} is outside the trained range "
+                    f"{info['min']:g}–{info['max']:g} {unit}."
+                )
+        return problems
+
+
+def triggered_rule(artifact: dict[str, Any], values: dict[str, float],
+                   classes: np.ndarray, crop: str):
+    """The deferral rule this input triggers, if any (Sec. 4.5)."""
+    with TELEMETRY.stage("triggered_rule"):
+        for rule in artifact.get("ambiguity_rules", []):
+            feature = rule["feature"]
+            if crop in rule["classes"] and feature in values:
+                if rule["low"] <= values[feature] <= rule["high"]:
+                    if all(name in classes for name in rule["classes"]):
+                        TELEMETRY.count("deferrals", rule="/".join(rule["classes"]))
+                        return rule
+        return None
+
+
+def confidence_bins(confidence: np.ndarray) -> np.ndarray:
+    """ECE bin of each confidence: (lo, hi], as expected_calibration_error bins them."""
+    return np.clip(np.searchsorted(CONFIDENCE_EDGES, confidence, side="left") - 1, 0, 9)
+
+
+def confidence_shares(engine: CompiledForest, proba: np.ndarray) -> list[float]:
+    """Share of calibrated top-1 confidences per ECE bin, for raw forest `proba`.
+
+    The drift monitor's confidence reference; array exports store it precomputed.
+    """
+    confidence = engine.calibrate(np.asarray(proba, dtype=np.float64)).max(axis=1)
+    counts = np.bincount(confidence_bins(confidence), minlength=10)
+    return (counts / counts.sum()).tolist()
+
+
+# --------------------------------------------------------------------------- #
+# Verification                                                                #
+# --------------------------------------------------------------------------- #
+
+
+def check_agreement(artifact: dict[str, Any], engine: CompiledForest, frame) -> dict:
+    """Largest absolute difference from sklearn, and argmax disagreements."""
+    reference = artifact["calibrated"].predict_proba(frame[engine.feature_names])
+    compiled = engine.predict_proba(frame)
+    return {
+        "rows": int(len(frame)),
+        "max_abs_diff": float(np.abs(reference - compiled).max()),
+        "argmax_mismatches": int((reference.argmax(1) != compiled.argmax(1)).sum()),
+    }
+
+
+def _median_ms(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return float(np.median(times))
+
+
+def main() -> None:
+    import joblib
+    import pandas as pd
+
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--model", default="crop_model_v2.pkl", help="path to the artefact")
+    ap.add_argument("--data", default="Crop_recommendation.csv", help="dataset CSV to compare on")
+    ap.add_argument("--repeats", type=int, default=50, help="timing repetitions")
+    args = ap.parse_args()
+
+    artifact = joblib.load(args.model)
+    started = time.perf_counter()
+    engine = compile_artifact(artifact)
+    print(f"compiled {engine.n_trees} trees, {len(engine.feature)} nodes in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    frame = pd.read_csv(args.data)[engine.feature_names]
+    print("agreement:", check_agreement(artifact, engine, frame))
+
+    row = frame.iloc[:1]
+    row_array = row.to_numpy()
+    sk_row = _median_ms(lambda: artifact["calibrated"].predict_proba(row), args.repeats)
+    cf_row = _median_ms(lambda: engine.predict_proba(row_array), args.repeats)
+    print(f"single row : sklearn {sk_row:.3f} ms | compiled {cf_row:.3f} ms "
+          f"({sk_row / cf_row:.0f}x)")
+
+    batch_array = frame.to_numpy()
+    sk_batch = _median_ms(lambda: artifact["calibrated"].predict_proba(frame), 5)
+    cf_batch = _median_ms(lambda: engine.predict_proba(batch_array), 5)
+    print(f"{len(frame)} rows : sklearn {len(frame) / sk_batch * 1000:,.0f} rows/s | "
+          f"compiled {len(frame) / cf_batch * 1000:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
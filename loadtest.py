@@ -0,0 +1,420 @@
+"""
+loadtest.py
+===========
+Concurrent load generator for the recommendation path, with a report file per run.
+
+benchmark.py times one call at a time; it cannot say how many people one
+instance serves before latency degrades. This replays a stream of inputs
+through what one app interaction does once its inputs are read -- range
+validation, the cell-cached calibrated probabilities, the deferral rule,
+telemetry, drift monitoring, the audit record and, on the SHAP path, the
+cell-cached TreeSHAP attributions -- from many client threads in one
+process. That is how Streamlit serves sessions (one script thread each,
+sharing one interpreter), and serve.py's scorer shares the same GIL.
+
+  * inputs     sampled from each feature's training distribution
+               (feature_sketches, else feature_stats; features independent),
+               or rows of a CSV replayed in order (rows outside the trained
+               ranges are rejected exactly as the app rejects them)
+  * arrivals   open loop: each of --clients threads sends on its own Poisson
+               schedule, --rate requests/s in total; latency is measured from
+               the scheduled send time, so time spent queued behind a busy
+               interpreter counts. --rate 0 is closed loop: every client sends
+               its next request as soon as the previous one is answered
+  * scenarios  SHAP off and SHAP on (--shap), each in a fresh spawned process
+               so neither inherits the other's caches or memory
+
+Requests scheduled before --duration ends are all sent. Any not started by
+--drain seconds later are counted as dropped. The report holds throughput,
+latency percentiles, error and rejection rates, cache hit rate, and a
+timeline of throughput, latency, CPU and RSS every --sample-interval seconds.
+Reports carry benchmark.py's environment block and the settings, so
+`compare` can put two of them side by side.
+
+Usage
+-----
+    python loadtest.py run --clients 16 --rate 200 --duration 30
+    python loadtest.py run --inputs field_survey.csv --rate 0 --clients 64 --shap on
+    python loadtest.py compare loadtest_reports/loadtest-A.json loadtest_reports/loadtest-B.json
+
+Outputs
+-------
+    loadtest_reports/loadtest-<UTC time>.json   (or --out)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from audit import AUDIT
+from benchmark import environment, peak_rss_mb, rss_mb
+from cell_cache import CellCache
+from inference import load_model, predict_proba, triggered_rule, validate
+from monitor import MONITOR
+from sketches import FeatureSummary
+from telemetry import TELEMETRY
+from tree_shap import ShapEngine
+
+REPORT_DIR = "loadtest_reports"
+CLIENTS = 16
+RATE = 100.0            # requests per second, all clients together; 0: closed loop
+DURATION = 20.0         # seconds of scheduled arrivals
+DRAIN = 10.0            # seconds after DURATION to send what was scheduled
+SAMPLE_INTERVAL = 1.0
+INPUT_ROWS = 10_000     # rows sampled from the training distribution
+CACHE_CELLS = 4096      # as app.py
+SEED = 0
+
+
+# --------------------------------------------------------------------------- #
+# Inputs                                                                      #
+# --------------------------------------------------------------------------- #
+
+
+def sampled_inputs(artifact: dict[str, Any], n_rows: int = INPUT_ROWS, seed: int = SEED) -> np.ndarray:
+    """Rows drawn from each feature's training distribution, independently per feature."""
+    rng = np.random.default_rng(seed)
+    features = artifact["feature_names"]
+    sketches = artifact.get("feature_sketches") or {}
+    X = np.empty((n_rows, len(features)))
+    for j, f in enumerate(features):
+        if f in sketches:
+            summary = FeatureSummary.from_dict(sketches[f])
+        else:
+            summary = FeatureSummary.from_stats(artifact["feature_stats"][f],
+                                                int(artifact.get("n_training_records") or 2200))
+        X[:, j] = summary.sketch.quantile(rng.random(n_rows), summary.running.min, summary.running.max)
+    return X
+
+
+def csv_inputs(path: str | Path, features: list[str]) -> np.ndarray:
+    """The CSV's feature columns in artefact order; unparseable values become NaN."""
+    import pandas as pd
+
+    frame = pd.read_csv(path, usecols=features)
+    return frame[features].apply(pd.to_numeric, errors="coerce").to_numpy(np.float64)
+
+
+# --------------------------------------------------------------------------- #
+# The path under load                                                         #
+# --------------------------------------------------------------------------- #
+
+
+class RecommendationPath:
+    """One app interaction after the inputs are read (app.recommend, top_contributions)."""
+
+    def __init__(self, artifact: dict[str, Any], shap: bool):
+        self.artifact = artifact
+        self.features = artifact["feature_names"]
+        self.classes = np.asarray(artifact["class_names"])
+        engine = artifact["_engine"]
+        self.cache = CellCache(engine, CACHE_CELLS) if engine is not None else None
+        self.explainer = None
+        if shap:
+            if engine is None:
+                raise ValueError("the SHAP path needs an artefact inference.py can compile")
+            self.explainer = ShapEngine.from_artifact(artifact, engine)
+
+    def __call__(self, row: np.ndarray) -> dict[str, Any] | None:
+        """What the app shows for `row`, or None if the inputs were rejected."""
+        artifact = self.artifact
+        values = dict(zip(self.features, row.tolist()))
+        if validate(values, artifact["feature_stats"]):
+            return None
+        started = time.perf_counter()
+        if self.cache is not None:
+            proba = self.cache.probabilities(row)
+        else:
+            proba = predict_proba(artifact, row.reshape(1, -1))[0]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        best = int(np.argmax(proba))
+        crop = str(self.classes[best])
+        rule = triggered_rule(artifact, values, self.classes, crop)
+        TELEMETRY.count("predictions")
+        MONITOR.observe(artifact, row, proba)
+        AUDIT.record(source="loadtest", variant=artifact.get("variant"),
+                     created_utc=artifact.get("created_utc"), inputs=values, proba=proba, crop=crop,
+                     rule="/".join(rule["classes"]) if rule is not None else None,
+                     latency_ms=elapsed_ms)
+        result = {"crop": crop, "confidence": float(proba[best]), "deferred": rule is not None}
+        if self.explainer is not None:
+            def explain() -> np.ndarray:
+                return self.explainer.shap_values(row.reshape(1, -1), best)[0]
+
+            contrib = self.cache.contributions(row, best, explain)
+            result["why"] = [self.features[j] for j in np.argsort(np.abs(contrib))[::-1][:3]]
+        return result
+
+
+# --------------------------------------------------------------------------- #
+# One scenario                                                                #
+# --------------------------------------------------------------------------- #
+
+
+def _latency(ms: np.ndarray) -> dict[str, float | None]:
+    if not len(ms):
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "max": round(float(ms.max()), 3), "mean": round(float(ms.mean()), 3)}
+
+
+def run_scenario(model: str, inputs: str | None, shap: bool, clients: int, rate: float,
+                 duration: float, drain: float, sample_interval: float, seed: int) -> dict[str, Any]:
+    """Load, then drive the path from `clients` threads; meant to run in a fresh process."""
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    artifact = load_model(model)
+    load_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    path = RecommendationPath(artifact, shap)
+    explainer_ms = (time.perf_counter() - started) * 1000 if shap else None
+    X = csv_inputs(inputs, artifact["feature_names"]) if inputs else sampled_inputs(artifact, seed=seed)
+    if not len(X):
+        raise ValueError(f"{inputs} has no rows")
+    rss_loaded = rss_mb()
+
+    # Per client: (scheduled, finished) seconds since start, and outcome
+    # 0 answered / 1 rejected / 2 error. Each list has one writer.
+    records: list[list[tuple[float, float, int]]] = [[] for _ in range(clients)]
+    dropped = [0] * clients
+    errors: dict[str, int] = {}
+    errors_lock = threading.Lock()
+    start = time.perf_counter() + 0.05
+    stop, give_up = start + duration, start + duration + drain
+
+    def client(i: int) -> None:
+        rng = np.random.default_rng(seed + 1 + i)
+        k, scheduled = i, start
+        while True:
+            if rate > 0:
+                scheduled += rng.exponential(clients / rate)
+                if scheduled >= stop:
+                    return
+                now = time.perf_counter()
+                if now >= give_up:
+                    dropped[i] += 1
+                    continue
+                if scheduled > now:
+                    time.sleep(scheduled - now)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled >= stop:
+                    return
+            row = X[k % len(X)]
+            k += clients
+            try:
+                outcome = 1 if path(row) is None else 0
+            except Exception as exc:  # counted, and the client carries on
+                outcome = 2
+                with errors_lock:
+                    name = type(exc).__name__
+                    errors[name] = errors.get(name, 0) + 1
+            records[i].append((scheduled - start, time.perf_counter() - start, outcome))
+
+    samples: list[tuple[float, float, float | None]] = []
+    done = threading.Event()
+
+    def sampler() -> None:
+        while True:
+            samples.append((time.perf_counter() - start, time.process_time(), rss_mb()))
+            if done.wait(sample_interval):
+                samples.append((time.perf_counter() - start, time.process_time(), rss_mb()))
+                return
+
+    threads = [threading.Thread(target=client, args=(i,), name=f"client-{i}") for i in range(clients)]
+    watcher = threading.Thread(target=sampler, name="sampler")
+    time.sleep(max(0.0, start - time.perf_counter()))
+    watcher.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    watcher.join()
+
+    flat = np.array([r for rs in records for r in rs], dtype=np.float64).reshape(-1, 3)
+    scheduled, finished, outcome = flat[:, 0], flat[:, 1], flat[:, 2].astype(int)
+    latency_ms = (finished - scheduled) * 1000
+    elapsed = float(finished.max()) if len(finished) else duration
+    n = len(flat)
+
+    timeline = []
+    for (t0, cpu0, _), (t1, cpu1, rss) in zip(samples, samples[1:]):
+        window = (finished >= t0) & (finished < t1)
+        window_ms = latency_ms[window]
+        timeline.append({
+            "t": round(t1, 2),
+            "requests_per_second": round(int(window.sum()) / (t1 - t0), 1) if t1 > t0 else None,
+            "p50_ms": round(float(np.percentile(window_ms, 50)), 3) if len(window_ms) else None,
+            "p95_ms": round(float(np.percentile(window_ms, 95)), 3) if len(window_ms) else None,
+            "cpu_percent": round((cpu1 - cpu0) / (t1 - t0) * 100, 1) if t1 > t0 else None,
+            "rss_mb": rss,
+        })
+    cpu = [row["cpu_percent"] for row in timeline if row["cpu_percent"] is not None]
+
+    return {
+        "shap": shap,
+        "artifact": {"path": model, "variant": artifact.get("variant"),
+                     "created_utc": artifact.get("created_utc"),
+                     "compiled": artifact["_engine"] is not None},
+        "inputs": {"source": inputs or "training distribution", "rows": len(X)},
+        "audit_enabled": AUDIT.enabled,
+        "monitor_enabled": MONITOR.enabled,
+        "load_ms": round(load_ms, 1),
+        "explainer_ms": round(explainer_ms, 1) if explainer_ms is not None else None,
+        "requests": n,
+        "answered": int((outcome == 0).sum()),
+        "rejected": int((outcome == 1).sum()),
+        "errors": int((outcome == 2).sum()),
+        "error_types": errors,
+        "dropped": sum(dropped),
+        "error_rate": round(float((outcome == 2).mean()), 6) if n else None,
+        "rejection_rate": round(float((outcome == 1).mean()), 6) if n else None,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(n / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": _latency(latency_ms),
+        "cpu_percent_mean": round(float(np.mean(cpu)), 1) if cpu else None,
+        "rss_mb": {"before_load": rss_before, "after_load": rss_loaded,
+                   "end": samples[-1][2] if samples else None, "peak": peak_rss_mb()},
+        "cell_cache": path.cache.stats() if path.cache is not None else None,
+        "timeline": timeline,
+    }
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Every requested scenario, each in its own spawned process."""
+    # As in benchmark.py: a fresh interpreter per scenario, not a daemonic Pool worker.
+    context = multiprocessing.get_context("spawn")
+    modes = {"off": [False], "on": [True], "both": [False, True]}[args.shap]
+    scenarios = {}
+    for shap in modes:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            result = pool.submit(run_scenario, args.model, args.inputs, shap, args.clients,
+                                 args.rate, args.duration, args.drain, args.sample_interval,
+                                 args.seed).result()
+        name = f"shap_{'on' if shap else 'off'}"
+        scenarios[name] = result
+        print(f"{name:9} {_summary(result)}", file=sys.stderr)
+    return {
+        "created_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {"clients": args.clients, "rate": args.rate, "duration": args.duration,
+                     "drain": args.drain, "sample_interval": args.sample_interval,
+                     "seed": args.seed, "model": args.model, "inputs": args.inputs},
+        "scenarios": scenarios,
+    }
+
+
+# --------------------------------------------------------------------------- #
+# Reporting                                                                   #
+# --------------------------------------------------------------------------- #
+
+# (label, key path, format); compare() also reports the relative change.
+SUMMARY_METRICS = (
+    ("throughput req/s", ("throughput_rps",), ".1f"),
+    ("p50 ms", ("latency_ms", "p50"), ".2f"),
+    ("p95 ms", ("latency_ms", "p95"), ".2f"),
+    ("p99 ms", ("latency_ms", "p99"), ".2f"),
+    ("error rate", ("error_rate",), ".4%"),
+    ("dropped", ("dropped",), "d"),
+    ("CPU % mean", ("cpu_percent_mean",), ".0f"),
+    ("RSS peak MB", ("rss_mb", "peak"), ".0f"),
+)
+
+
+def _metric(result: dict[str, Any], keys: tuple[str, ...]) -> Any:
+    for key in keys:
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def _fmt(value: Any, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def _summary(result: dict[str, Any]) -> str:
+    return " | ".join(f"{label} {_fmt(_metric(result, keys), spec)}"
+                      for label, keys, spec in SUMMARY_METRICS)
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any]) -> list[str]:
+    """Lines setting each scenario's summary metrics side by side."""
+    lines = []
+    for key in sorted(set(baseline["settings"]) | set(current["settings"])):
+        before, after = baseline["settings"].get(key), current["settings"].get(key)
+        if before != after:
+            lines.append(f"note: setting {key}: {before} -> {after}")
+    for key, value in baseline.get("environment", {}).items():
+        if current["environment"].get(key) != value:
+            lines.append(f"note: environment {key}: {value} -> {current['environment'].get(key)}")
+    for name in sorted(set(baseline["scenarios"]) | set(current["scenarios"])):
+        old, new = baseline["scenarios"].get(name), current["scenarios"].get(name)
+        if old is None or new is None:
+            lines.append(f"{name}: only in the {'current' if old is None else 'baseline'} report")
+            continue
+        lines.append(name)
+        for label, keys, spec in SUMMARY_METRICS:
+            a, b = _metric(old, keys), _metric(new, keys)
+            change = f"{(b - a) / a:+.0%}" if a and b is not None else ""
+            lines.append(f"  {label:17} {_fmt(a, spec):>12} -> {_fmt(b, spec):>12}  {change}")
+    return lines
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="load the recommendation path and write a report")
+    r.add_argument("--model", default="crop_model_v2.pkl",
+                   help="artefact: the .pkl or an array export directory")
+    r.add_argument("--inputs", help="CSV with the feature columns to replay "
+                                    "(default: sample the training distribution)")
+    r.add_argument("--clients", type=int, default=CLIENTS, help="concurrent client threads")
+    r.add_argument("--rate", type=float, default=RATE,
+                   help="arrivals per second over all clients; 0 for closed loop")
+    r.add_argument("--duration", type=float, default=DURATION, help="seconds of arrivals")
+    r.add_argument("--drain", type=float, default=DRAIN,
+                   help="seconds after --duration to send requests still scheduled")
+    r.add_argument("--shap", choices=("off", "on", "both"), default="both",
+                   help="which explanation paths to run")
+    r.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL,
+                   help="seconds between timeline samples")
+    r.add_argument("--seed", type=int, default=SEED)
+    r.add_argument("--out", help=f"report to write (default: {REPORT_DIR}/loadtest-<UTC time>.json)")
+    c = sub.add_parser("compare", help="set two reports side by side")
+    c.add_argument("baseline", type=Path)
+    c.add_argument("current", type=Path)
+    args = ap.parse_args()
+
+    if args.command == "compare":
+        baseline = json.loads(args.baseline.read_text())
+        current = json.loads(args.current.read_text())
+        print("\n".join(compare(baseline, current)))
+        return
+
+    if args.clients < 1 or args.rate < 0 or args.duration <= 0:
+        ap.error("--clients must be at least 1, --rate at least 0 and --duration positive")
+    report = run(args)
+    if args.out:
+        out = Path(args.out)
+    else:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        out = Path(REPORT_DIR) / f"loadtest-{stamp}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
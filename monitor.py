@@ -0,0 +1,528 @@
+"""
+monitor.py
+==========
+Input drift and calibration monitoring against the artefact's training data.
+
+`feature_stats` is a snapshot of what the model was trained on; nothing in
+the serving path says when the inputs it is asked about move away from it,
+or when its calibrated confidences stop matching outcomes. `MONITOR` (one per
+process, like TELEMETRY and AUDIT) keeps, per loaded artefact:
+
+  * per feature, counts over fixed bins -- the training deciles, plus one
+    bin below the trained minimum and one above the maximum -- and a
+    `sketches.FeatureSummary` of the values
+  * a histogram of the calibrated top-1 confidence over the ten ECE bins and,
+    for predictions whose true crop is reported back, the hits per bin
+
+`observe()` only queues: rows and their probabilities are appended as
+given, without the lock or a copy. The monitor's own thread drains the
+queue at least every FOLD_SECONDS (sooner once BUFFER_ROWS rows are waiting)
+and, under the lock, folds the rows into the histograms and sketches in
+vectorised passes of BUFFER_ROWS. The fold, about 4 us a row and mostly
+sketch merges, is never paid inside a request, so serve.py's event loop
+does not stall on it; it still shares the GIL, and a one-row call costs
+about 2-2.5 us with the fold running alongside on one core. Memory is
+constant apart from what is queued between drains (see
+`python monitor.py bench`).
+
+The reference comes from the artefact: the bins and their expected shares
+from `feature_sketches` (reconstructed from `feature_stats` for artefacts
+built without them), the expected confidences from its calibration_data run
+through the isotonic layer. Scores, recomputed every CROP_MONITOR_INTERVAL
+seconds by a background thread and on demand:
+
+    psi            population stability index over the bins (0.1: look, 0.25: shifted)
+    ks             largest CDF gap between the production and training sketches
+    below / above  share of inputs outside the trained range
+    confidence     PSI of the confidence histogram; with outcomes, the observed ECE
+
+They are exported as gauges through TELEMETRY (crop_drift_psi_<variant>_<feature>,
+...), as JSON at GET /drift in serve.py, and, with CROP_MONITOR_DIR set, each
+process writes its state there on the same schedule: histogram counts add and
+sketches merge, so `python monitor.py report DIR` scores all workers as one.
+CROP_MONITOR=off disables monitoring; `observe()` then returns at once.
+
+Usage
+-----
+    MONITOR.observe(artifact, X, proba)        # after every prediction
+    MONITOR.outcome(artifact, confidence, correct)
+    MONITOR.report()                           # scores per loaded artefact
+    python monitor.py report /var/lib/crop/monitor
+    python monitor.py bench
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from inference import confidence_bins, confidence_shares
+from sketches import FeatureSummary
+from telemetry import TELEMETRY
+
+BUFFER_ROWS = 1024
+FOLD_SECONDS = 1.0           # longest a queued row waits for the fold thread
+DECILES = np.linspace(0.1, 0.9, 9)
+PSI_FLOOR = 1e-4             # share given to empty bins, so PSI stays finite
+PSI_SHIFTED = 0.25
+
+
+def psi(observed: np.ndarray, expected: np.ndarray) -> float | None:
+    """Population stability index of observed counts against expected shares."""
+    total = observed.sum()
+    if not total:
+        return None
+    actual = np.maximum(observed / total, PSI_FLOOR)
+    expected = np.maximum(expected, PSI_FLOOR)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+def ks(production: FeatureSummary, training: FeatureSummary) -> float | None:
+    """Largest gap between the two sketches' CDFs, checked at both sets of centroids."""
+    if not production.running.n:
+        return None
+    grid = np.concatenate([production.sketch.values, training.sketch.values])
+    gap = (production.sketch.cdf(grid, production.running.min, production.running.max)
+           - training.sketch.cdf(grid, training.running.min, training.running.max))
+    return float(np.abs(gap).max())
+
+
+def reference(artifact: dict[str, Any]) -> dict[str, Any]:
+    """What production is compared against, as plain data (it travels in state files)."""
+    features = artifact["feature_names"]
+    sketches = artifact.get("feature_sketches") or {}
+    n = int(artifact.get("n_training_records") or 0) or 2200
+    out: dict[str, Any] = {"variant": artifact.get("variant"), "created_utc": artifact.get("created_utc"),
+                           "features": list(features), "n_classes": len(artifact["class_names"]),
+                           "edges": {}, "expected": {}, "range": {},
+                           "sketches": {}}
+    for f in features:
+        stats = artifact["feature_stats"][f]
+        summary = (FeatureSummary.from_dict(sketches[f]) if f in sketches
+                   else FeatureSummary.from_stats(stats, n))
+        r = summary.running
+        edges = np.unique(summary.sketch.quantile(DECILES, r.min, r.max))
+        shares = np.diff(np.concatenate([[0.0], summary.sketch.cdf(edges, r.min, r.max), [1.0]]))
+        out["edges"][f] = edges.tolist()
+        out["expected"][f] = [0.0, *shares.tolist(), 0.0]
+        out["range"][f] = [stats["min"], stats["max"]]
+        out["sketches"][f] = summary.to_dict()
+
+    # Array exports carry the shares precomputed (array_artifact.py).
+    out["confidence_expected"] = artifact.get("calibration_confidence")
+    engine, data = artifact.get("_engine"), artifact.get("calibration_data")
+    if engine is not None and data is not None:
+        out["confidence_expected"] = confidence_shares(engine, data["proba"])
+    return out
+
+
+class Tracker:
+    """Histograms, sketches and confidence counts for one artefact."""
+
+    def __init__(self, ref: dict[str, Any]):
+        self.ref = ref
+        self.features = ref["features"]
+        n_features = len(self.features)
+        self.edges = [np.asarray(ref["edges"][f]) for f in self.features]
+        self.low = np.array([ref["range"][f][0] for f in self.features])
+        self.high = np.array([ref["range"][f][1] for f in self.features])
+        self.counts = [np.zeros(len(e) + 3, dtype=np.int64) for e in self.edges]
+        self.summaries = [FeatureSummary() for _ in self.features]
+        self.confidence = np.zeros(10, dtype=np.int64)
+        self.outcomes = np.zeros(10, dtype=np.int64)
+        self.hits = np.zeros(10, dtype=np.int64)
+        self.outcome_confidence = np.zeros(10)
+        self.rows = 0
+        self._buffer = np.empty((BUFFER_ROWS, n_features))
+        self._buffer_proba = np.empty((BUFFER_ROWS, ref["n_classes"]))
+        self._fill = 0
+        # Single rows and 2-D batches as given, (X, proba); appended without
+        # the lock (deque.append is atomic) and drained under it.
+        self.pending: deque = deque()
+        self.pending_batches: deque = deque()
+
+    def drain(self) -> None:
+        """Move the queued rows into the buffer, folding whenever it fills."""
+        n = len(self.pending)  # rows appended meanwhile stay queued for the next drain
+        if n:
+            rows, probas = zip(*[self.pending.popleft() for _ in range(n)])
+            self.add(np.array(rows, dtype=np.float64), np.array(probas, dtype=np.float64))
+        for _ in range(len(self.pending_batches)):
+            X, proba = self.pending_batches.popleft()
+            self.add(np.asarray(X, dtype=np.float64), np.asarray(proba, dtype=np.float64))
+
+    def add(self, X: np.ndarray, proba: np.ndarray) -> None:
+        """Buffer (n_rows, n_features) rows and their probabilities."""
+        at = 0
+        while at < len(X):
+            take = min(len(X) - at, BUFFER_ROWS - self._fill)
+            self._buffer[self._fill:self._fill + take] = X[at:at + take]
+            self._buffer_proba[self._fill:self._fill + take] = proba[at:at + take]
+            self._fill += take
+            at += take
+            if self._fill == BUFFER_ROWS:
+                self._fold()
+
+    def flush(self) -> None:
+        """Fold the queued and buffered rows into the histograms and sketches."""
+        self.drain()
+        self._fold()
+
+    def _fold(self) -> None:
+        if not self._fill:
+            return
+        X = self._buffer[:self._fill]
+        confidence = self._buffer_proba[:self._fill].max(axis=1)
+        for j, edges in enumerate(self.edges):
+            column = X[:, j]
+            bins = np.searchsorted(edges, column, side="right") + 1
+            bins[column < self.low[j]] = 0
+            bins[column > self.high[j]] = len(edges) + 2
+            self.counts[j] += np.bincount(bins, minlength=len(edges) + 3)
+            self.summaries[j].update(column)
+        self.confidence += np.bincount(confidence_bins(confidence), minlength=10)
+        self.rows += self._fill
+        self._fill = 0
+
+    def outcome(self, confidence: np.ndarray, correct: np.ndarray) -> None:
+        bins = confidence_bins(confidence)
+        self.outcomes += np.bincount(bins, minlength=10)
+        self.hits += np.bincount(bins, weights=correct.astype(np.float64), minlength=10).astype(np.int64)
+        self.outcome_confidence += np.bincount(bins, weights=confidence, minlength=10)
+
+    def state(self) -> dict[str, Any]:
+        """Everything needed to merge and score elsewhere (flushes first)."""
+        self.flush()
+        return {
+            "reference": self.ref,
+            "rows": self.rows,
+            "counts": {f: c.tolist() for f, c in zip(self.features, self.counts)},
+            "summaries": {f: s.to_dict() for f, s in zip(self.features, self.summaries)},
+            "confidence": self.confidence.tolist(),
+            "outcomes": self.outcomes.tolist(),
+            "hits": self.hits.tolist(),
+            "outcome_confidence": self.outcome_confidence.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> "Tracker":
+        tracker = cls(state["reference"])
+        tracker.merge_state(state)
+        return tracker
+
+    def merge_state(self, state: dict[str, Any]) -> "Tracker":
+        """Add another process's state for the same artefact."""
+        self.flush()
+        for j, f in enumerate(self.features):
+            self.counts[j] += np.asarray(state["counts"][f], dtype=np.int64)
+            self.summaries[j].merge(FeatureSummary.from_dict(state["summaries"][f]))
+        self.confidence += np.asarray(state["confidence"], dtype=np.int64)
+        self.outcomes += np.asarray(state["outcomes"], dtype=np.int64)
+        self.hits += np.asarray(state["hits"], dtype=np.int64)
+        self.outcome_confidence += np.asarray(state["outcome_confidence"])
+        self.rows += state["rows"]
+        return self
+
+    def scores(self) -> dict[str, Any]:
+        self.flush()
+        features = {}
+        for j, f in enumerate(self.features):
+            counts, summary = self.counts[j], self.summaries[j]
+            training = FeatureSummary.from_dict(self.ref["sketches"][f])
+            features[f] = {
+                "psi": psi(counts, np.asarray(self.ref["expected"][f])),
+                "ks": ks(summary, training),
+                "below": float(counts[0] / self.rows) if self.rows else None,
+                "above": float(counts[-1] / self.rows) if self.rows else None,
+                "median": summary.sketch.quantile(0.5, summary.running.min, summary.running.max)
+                if self.rows else None,
+                "training_median": training.sketch.quantile(0.5, training.running.min,
+                                                            training.running.max),
+            }
+        expected = self.ref.get("confidence_expected")
+        n_outcomes = int(self.outcomes.sum())
+        ece = None
+        if n_outcomes:
+            seen = self.outcomes > 0
+            gap = np.abs(self.hits[seen] - self.outcome_confidence[seen]) / self.outcomes[seen]
+            ece = float((self.outcomes[seen] / n_outcomes * gap).sum())
+        return {
+            "variant": self.ref["variant"],
+            "created_utc": self.ref["created_utc"],
+            "rows": self.rows,
+            "features": features,
+            "shifted": [f for f, s in features.items() if s["psi"] is not None and s["psi"] >= PSI_SHIFTED],
+            "confidence": {
+                "histogram": self.confidence.tolist(),
+                "psi": psi(self.confidence, np.asarray(expected)) if expected is not None else None,
+                "outcomes": n_outcomes,
+                "ece": ece,
+            },
+        }
+
+
+class Monitor:
+    """Process-wide set of trackers, one per loaded artefact, with scheduled scoring."""
+
+    def __init__(self, enabled: bool = True, directory: str | None = None, interval: float = 60.0):
+        self.enabled = enabled
+        self.directory = Path(directory) if directory else None
+        self.interval = interval
+        self._trackers: dict[tuple[Any, Any], Tracker] = {}
+        self._latest: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()      # rows are waiting to be folded
+        self._thread: threading.Thread | None = None
+
+    def tracker(self, artifact: dict[str, Any]) -> Tracker:
+        """The artefact's tracker, cached on it as artifact["_monitor"]."""
+        tracker = artifact.get("_monitor")
+        if tracker is None:
+            key = (artifact.get("variant"), artifact.get("created_utc"))
+            with self._lock:
+                tracker = self._trackers.get(key)
+                if tracker is None:
+                    tracker = self._trackers[key] = Tracker(reference(artifact))
+            artifact["_monitor"] = tracker
+            self._start()
+        return tracker
+
+    def observe(self, artifact: dict[str, Any], X: Any, proba: np.ndarray) -> None:
+        """Record scored rows (in the artefact's feature order) and their probabilities.
+
+        X is a 2-D array (n_rows, n_features) with proba (n_rows, n_classes), or
+        one row of each (a sequence or 1-D array). Either is queued as given,
+        without the lock or a copy, and converted when the monitor's thread
+        drains the queue; it must not be modified afterwards.
+        """
+        if not self.enabled:
+            return
+        tracker = artifact.get("_monitor") or self.tracker(artifact)
+        if getattr(X, "ndim", 1) == 1:
+            tracker.pending.append((X, proba))
+            if len(tracker.pending) < BUFFER_ROWS or self._wake.is_set():
+                return
+        else:
+            tracker.pending_batches.append((X, proba))
+            if self._wake.is_set():
+                return
+        self._wake.set()
+
+    def drain(self) -> None:
+        """Fold what every tracker has queued; the monitor's thread calls this."""
+        with self._lock:
+            for tracker in self._trackers.values():
+                tracker.drain()
+
+    def outcome(self, artifact: dict[str, Any], confidence: Any, correct: Any) -> None:
+        """Record whether predictions made with these top-1 confidences were right."""
+        if not self.enabled:
+            return
+        tracker = self.tracker(artifact)
+        confidence = np.atleast_1d(np.asarray(confidence, dtype=np.float64))
+        correct = np.atleast_1d(np.asarray(correct, dtype=bool))
+        with self._lock:
+            tracker.outcome(confidence, correct)
+
+    def report(self) -> dict[str, Any]:
+        """Score every tracker now; also what GET /drift and the gauges show."""
+        with self._lock:
+            states = [t.state() for t in self._trackers.values()]
+        report = {
+            "computed_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "pid": os.getpid(),
+            "models": [Tracker.from_state(s).scores() for s in states],
+        }
+        self._latest = report
+        return report
+
+    def latest(self) -> dict[str, Any]:
+        return self._latest or self.report()
+
+    def write(self) -> Path | None:
+        """Write this process's state to CROP_MONITOR_DIR (temp file + rename)."""
+        if self.directory is None or not self.enabled:
+            return None
+        with self._lock:
+            states = [t.state() for t in self._trackers.values()]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        target = self.directory / f"monitor-{os.getpid()}.json"
+        fd, staging = tempfile.mkstemp(prefix=f".{target.name}.", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as handle:
+                json.dump({"written_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                           "states": states}, handle)
+            os.replace(staging, target)
+        except BaseException:
+            Path(staging).unlink(missing_ok=True)
+            raise
+        return target
+
+    def gauges(self) -> dict[str, float]:
+        out = {}
+        for model in self._latest.get("models", []):
+            variant = model["variant"] or "model"
+            out[f"monitor_rows_{variant}"] = model["rows"]
+            for f, s in model["features"].items():
+                for score in ("psi", "ks"):
+                    if s[score] is not None:
+                        out[f"drift_{score}_{variant}_{f}"] = s[score]
+            if model["confidence"]["psi"] is not None:
+                out[f"drift_psi_{variant}_confidence"] = model["confidence"]["psi"]
+            if model["confidence"]["ece"] is not None:
+                out[f"observed_ece_{variant}"] = model["confidence"]["ece"]
+        return out
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="drift-monitor", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        due = time.monotonic() + self.interval
+        while True:
+            self._wake.wait(min(FOLD_SECONDS, max(due - time.monotonic(), 0.0)))
+            self._wake.clear()
+            self.drain()
+            if time.monotonic() >= due:
+                self.report()
+                self.write()
+                due = time.monotonic() + self.interval
+
+
+MONITOR = Monitor(
+    enabled=os.environ.get("CROP_MONITOR", "on").lower() not in ("0", "off", "false", "no"),
+    directory=os.environ.get("CROP_MONITOR_DIR") or None,
+    interval=float(os.environ.get("CROP_MONITOR_INTERVAL", "60")),
+)
+TELEMETRY.add_collector(MONITOR.gauges)
+
+
+# --------------------------------------------------------------------------- #
+# Command line                                                                #
+# --------------------------------------------------------------------------- #
+
+
+def merged_report(directory: Path) -> dict[str, Any]:
+    """Merge every process's state file in `directory`, per artefact, and score it."""
+    trackers: dict[tuple[Any, Any], Tracker] = {}
+    files = sorted(directory.glob("monitor-*.json"))
+    for path in files:
+        for state in json.loads(path.read_text())["states"]:
+            ref = state["reference"]
+            key = (ref["variant"], ref["created_utc"])
+            if key in trackers:
+                trackers[key].merge_state(state)
+            else:
+                trackers[key] = Tracker.from_state(state)
+    return {"computed_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "processes": len(files), "models": [t.scores() for t in trackers.values()]}
+
+
+def bench(rows: int = 200_000, batch: int = 64) -> dict[str, float]:
+    """observe() cost with a synthetic artefact reference, per call and per row.
+
+    Each phase gets a fresh monitor and tracker. `single_row_us_per_call` and
+    the batch figure are what the caller pays, with the monitor's thread
+    folding alongside; `fold_us_per_row` is that thread's work, timed alone.
+    """
+    rng = np.random.default_rng(0)
+    features = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+    sample = rng.normal(50, 10, (10_000, len(features)))
+    sketches = {f: FeatureSummary.from_values(sample[:, j]).to_dict() for j, f in enumerate(features)}
+    X = rng.normal(52, 11, (rows, len(features)))
+    proba = rng.dirichlet(np.ones(22), rows)
+
+    def fresh() -> tuple[Monitor, dict[str, Any]]:
+        artifact = {
+            "variant": "bench", "created_utc": "bench", "feature_names": features,
+            "feature_stats": {f: {"min": 0.0, "max": 100.0} for f in features},
+            "class_names": [f"crop{k}" for k in range(22)],
+            "feature_sketches": sketches,
+        }
+        monitor = Monitor(enabled=True, interval=3600.0)
+        monitor.tracker(artifact)
+        return monitor, artifact
+
+    monitor, artifact = fresh()
+    started = time.perf_counter()
+    for i in range(rows):
+        monitor.observe(artifact, X[i], proba[i])
+    single = (time.perf_counter() - started) / rows
+    started = time.perf_counter()
+    report = monitor.report()
+    scoring = time.perf_counter() - started
+
+    tracker = Tracker(reference(fresh()[1]))
+    tracker.pending.extend(zip(X, proba))
+    started = time.perf_counter()
+    tracker.flush()
+    fold = (time.perf_counter() - started) / rows
+
+    monitor, artifact = fresh()
+    started = time.perf_counter()
+    for i in range(0, rows, batch):
+        monitor.observe(artifact, X[i:i + batch], proba[i:i + batch])
+    batched = (time.perf_counter() - started) / rows
+    batched_rows = monitor.report()["models"][0]["rows"]
+    return {
+        "single_row_us_per_call": round(single * 1e6, 3),
+        "fold_us_per_row": round(fold * 1e6, 3),
+        f"batch_{batch}_us_per_row": round(batched * 1e6, 3),
+        "report_ms": round(scoring * 1000, 2),
+        "rows": report["models"][0]["rows"],
+        "batch_rows": batched_rows,
+    }
+
+
+def _fmt(value: float | None, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("report", help="merge the state files in a directory and score them")
+    r.add_argument("directory", type=Path, help="CROP_MONITOR_DIR of the service")
+    r.add_argument("--json", action="store_true", help="print the full report as JSON")
+    b = sub.add_parser("bench", help="time observe()")
+    b.add_argument("--rows", type=int, default=200_000)
+    b.add_argument("--batch", type=int, default=64)
+    args = ap.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(bench(args.rows, args.batch), indent=2))
+        return
+    report = merged_report(args.directory)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['processes']} process state file(s)")
+    for model in report["models"]:
+        print(f"\n{model['variant']} ({model['created_utc']}): {model['rows']:,} rows"
+              + (f"; shifted: {', '.join(model['shifted'])}" if model["shifted"] else ""))
+        for f, s in model["features"].items():
+            outside = None if s["below"] is None else s["below"] + s["above"]
+            print(f"  {f:12} psi {_fmt(s['psi'], '.3f'):>6}  ks {_fmt(s['ks'], '.3f'):>6}  "
+                  f"outside {_fmt(outside, '.2%'):>7}  "
+                  f"median {_fmt(s['median'], '.4g'):>8} (trained {s['training_median']:.4g})")
+        c = model["confidence"]
+        print(f"  confidence   psi {_fmt(c['psi'], '.3f'):>6}  outcomes {c['outcomes']:,}"
+              + ("" if c["ece"] is None else f"  ECE {c['ece']:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
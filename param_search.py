@@ -0,0 +1,213 @@
+"""
+param_search.py
+===============
+Budget-aware Random Forest tuning for `build_model.py --search`.
+
+A plain grid over n_estimators x max_depth x max_features under the 10x3 CV
+protocol refits every forest from scratch on every fold. This search uses
+successive halving instead, with the number of CV folds and the number of
+trees as the budget:
+
+  * every configuration (max_depth, max_features, min_samples_leaf) starts on
+    a couple of folds with a few trees; after each rung only the best 1/eta
+    are kept, and the survivors get eta times the folds and the trees
+  * forests are grown with `warm_start`, so moving a configuration up a rung
+    adds trees to the forests it already has instead of refitting them (a
+    forest of k trees is the first k trees of a larger one, same seed)
+  * on the last rung the survivors run on every search fold, and each
+    n_estimators in the grid is scored from a prefix of the grown forest
+
+Every candidate is also compiled (inference.compile_forest) and timed on a
+single row and on a batch, so the choice can trade accuracy for serving cost:
+the chosen configuration is the cheapest per row whose CV accuracy is within
+`tolerance_pp` of the best.
+
+Usage
+-----
+    result = successive_halving(X, y, make_pipeline, RF_PARAMS)
+    result["chosen"]   # {"n_estimators": ..., "max_depth": ..., ...}
+"""
+
+from __future__ import annotations
+
+import copy
+import itertools
+import math
+import time
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import RepeatedStratifiedKFold
+
+from inference import compile_forest
+
+# The grid; n_estimators values are checkpoints of one grown forest.
+SEARCH_SPACE = {
+    "n_estimators": [25, 50, 100, 200],
+    "max_depth": [6, 10, 14, None],
+    "max_features": ["sqrt", "log2", 0.5],
+    "min_samples_leaf": [1, 2],
+}
+
+LATENCY_REPEATS = 200
+LATENCY_BATCH = 1000
+BATCH_REPEATS = 5
+
+
+def _configurations(space: dict[str, list]) -> list[dict[str, Any]]:
+    keys = [k for k in space if k != "n_estimators"]
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def _prefix_accuracy(pipeline: Any, X: pd.DataFrame, y: pd.Series,
+                     checkpoints: list[int]) -> dict[int, float]:
+    """Accuracy of the forest's first k trees, for each k in `checkpoints`.
+
+    Sums the per-tree probabilities as RandomForestClassifier.predict_proba
+    does, so every checkpoint costs one pass over the trees.
+    """
+    forest = pipeline[-1]
+    Xs = pipeline[:-1].transform(X).astype(np.float32)
+    truth = np.asarray(y)
+    total = np.zeros((len(Xs), len(forest.classes_)))
+    out = {}
+    for k, estimator in enumerate(forest.estimators_, start=1):
+        total += estimator.predict_proba(Xs)
+        if k in checkpoints:
+            out[k] = float((forest.classes_[total.argmax(axis=1)] == truth).mean())
+    return out
+
+
+def _prefix(pipeline: Any, n_trees: int) -> Any:
+    """A view of the pipeline with only its first `n_trees` trees."""
+    forest = copy.copy(pipeline[-1])
+    forest.estimators_ = pipeline[-1].estimators_[:n_trees]
+    forest.n_estimators = n_trees
+    view = copy.copy(pipeline)
+    view.steps = [*pipeline.steps[:-1], (pipeline.steps[-1][0], forest)]
+    return view
+
+
+def serving_latency(pipeline: Any, X: pd.DataFrame) -> dict[str, float]:
+    """Compiled-engine cost of a fitted pipeline.
+
+    Single-row latency is mostly fixed per-call overhead, so candidates are
+    compared on `batch_us_per_row`, which grows with the size of the forest.
+    """
+    engine = compile_forest(pipeline, list(X.columns))
+    row = X.to_numpy(dtype=np.float64)[:1]
+    batch = np.resize(X.to_numpy(dtype=np.float64), (LATENCY_BATCH, X.shape[1]))
+    engine.predict_proba(row)  # warm-up
+    times = []
+    for _ in range(LATENCY_REPEATS):
+        started = time.perf_counter()
+        engine.predict_proba(row)
+        times.append(time.perf_counter() - started)
+    batch_times = []
+    for _ in range(BATCH_REPEATS):
+        started = time.perf_counter()
+        engine.predict_proba(batch)
+        batch_times.append(time.perf_counter() - started)
+    return {
+        "latency_ms": round(float(np.median(times)) * 1000, 4),
+        "batch_us_per_row": round(float(np.median(batch_times)) / LATENCY_BATCH * 1e6, 3),
+        "nodes": int(len(engine.feature)),
+    }
+
+
+def successive_halving(X: pd.DataFrame, y: pd.Series, factory: Callable[[dict], Any],
+                       base_params: dict[str, Any], space: dict[str, list] | None = None,
+                       n_folds: int = 10, eta: int = 3, tolerance_pp: float = 0.25,
+                       random_state: int = 42) -> dict[str, Any]:
+    """Run the search and return its full record (rungs, finalists, choice).
+
+    `factory(params)` must return an unfitted scaler + forest pipeline; the
+    folds are the first `n_folds` of RepeatedStratifiedKFold(10, 3), the
+    protocol's own splits.
+    """
+    space = space or SEARCH_SPACE
+    started = time.perf_counter()
+    checkpoints = sorted(space["n_estimators"])
+    max_trees = checkpoints[-1]
+    rskf = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=random_state)
+    folds = list(itertools.islice(rskf.split(X, y), n_folds))
+
+    configurations = _configurations(space)
+    survivors = list(range(len(configurations)))
+    last = max(0, math.ceil(math.log(len(configurations) / eta, eta)))  # halve down to <= eta
+    models: dict[tuple[int, int], Any] = {}
+    trees_grown = 0
+    rungs = []
+
+    for rung in range(last + 1):
+        final = rung == last
+        scale = eta ** (rung - last)
+        rung_folds = len(folds) if final else max(1, math.ceil(len(folds) * scale))
+        rung_trees = max_trees if final else max(1, round(max_trees * scale))
+        scored = checkpoints if final else [rung_trees]
+
+        results = []
+        for index in survivors:
+            params = {**base_params, **configurations[index]}
+            accuracy = {k: [] for k in scored}
+            for j in range(rung_folds):
+                train, test = folds[j]
+                pipeline = models.pop((index, j), None)
+                if pipeline is None:
+                    pipeline = factory(params)
+                    pipeline[-1].set_params(warm_start=True)
+                grown = len(getattr(pipeline[-1], "estimators_", []))
+                pipeline[-1].set_params(n_estimators=rung_trees)
+                pipeline.fit(X.iloc[train], y.iloc[train])
+                trees_grown += rung_trees - grown
+                for k, acc in _prefix_accuracy(pipeline, X.iloc[test], y.iloc[test], scored).items():
+                    accuracy[k].append(acc)
+                if j == 0:
+                    timed = {k: serving_latency(_prefix(pipeline, k), X) for k in scored}
+                if not final:
+                    models[(index, j)] = pipeline
+            for k in scored:
+                results.append({
+                    "index": index,
+                    "params": {**configurations[index], "n_estimators": k},
+                    "cv_accuracy": round(float(np.mean(accuracy[k])) * 100, 3),
+                    "cv_accuracy_sd": round(float(np.std(accuracy[k], ddof=1)) * 100, 3)
+                    if len(accuracy[k]) > 1 else None,
+                    **timed[k],
+                })
+
+        # Best accuracy first; the cheaper configuration wins a tie.
+        results.sort(key=lambda r: (-r["cv_accuracy"], r["batch_us_per_row"]))
+        if not final:
+            keep = max(1, math.ceil(len(survivors) / eta))
+            survivors = [r["index"] for r in results[:keep]]
+            models = {key: m for key, m in models.items() if key[0] in survivors}
+        rungs.append({
+            "rung": rung,
+            "n_folds": rung_folds,
+            "n_estimators": rung_trees,
+            "candidates": [{k: v for k, v in r.items() if k != "index"} for r in results],
+        })
+
+    finalists = rungs[-1]["candidates"]
+    best = finalists[0]["cv_accuracy"]
+    eligible = [r for r in finalists if r["cv_accuracy"] >= best - tolerance_pp]
+    chosen = min(eligible, key=lambda r: (r["batch_us_per_row"], -r["cv_accuracy"]))
+
+    naive = len(configurations) * len(folds) * sum(checkpoints)
+    return {
+        "space": space,
+        "eta": eta,
+        "search_folds": len(folds),
+        "tolerance_pp": tolerance_pp,
+        "rungs": rungs,
+        "chosen": chosen["params"],
+        "chosen_cv_accuracy": chosen["cv_accuracy"],
+        "chosen_latency_ms": chosen["latency_ms"],
+        "chosen_batch_us_per_row": chosen["batch_us_per_row"],
+        "best_cv_accuracy": best,
+        "trees_grown": trees_grown,
+        "trees_grown_full_grid": naive,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
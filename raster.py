@@ -0,0 +1,264 @@
+"""
+raster.py
+=========
+Crop suitability maps from gridded soil and climate layers.
+
+The inputs are co-registered 2-D layers, one `.npy` file per model feature
+(N.npy, P.npy, ..., rainfall.npy, or any paths given with --layer). They are
+memory-mapped, never loaded whole, and cut into tiles that a process pool
+scores independently:
+
+  * every cell goes through the same range checks as a click in the app
+    (rule_engine.py); cells with a missing (NaN) or out-of-range value in any
+    layer are masked and not scored
+  * the remaining cells are reduced to their distinct forest cells first
+    (cell_cache.py: cells between the same split thresholds reach the same
+    leaves), so smooth rasters route far fewer rows than they have pixels;
+    the probabilities are still exactly `predict_proba`
+  * the deferral rules (Sec. 4.5) are applied to the top-1 crop
+
+Each worker writes its tile straight into output rasters that are
+memory-mapped `.npy` files as well, so peak memory per process is set by the
+tile size, not the map size, and throughput grows with --workers. Point
+--model at the array export so the workers share the model's pages instead
+of each unpickling its own copy.
+
+Usage
+-----
+    python raster.py layers/ --out suitability/ --tile 256 --workers 8
+    python raster.py --layer N=soil/n.npy --layer rainfall=clim/rain.npy ... --out maps/
+
+Outputs (in --out)
+------------------
+    top.npy          int16   top-1 class index, -1 where masked
+    confidence.npy   float32 calibrated probability of the top-1 crop, NaN where masked
+    deferred.npy     bool    an ambiguity rule fired for the cell
+    mask.npy         uint8   0 scored, 1 missing value, 2 out of the trained range
+    raster.json      class names, the rules, shapes and run totals
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+
+from inference import load_model, predict_proba
+from rule_engine import MISSING, OK, OUT_OF_RANGE, rule_engine
+
+TILE = 256
+OUTPUTS = {
+    "top": np.int16,
+    "confidence": np.float32,
+    "deferred": np.bool_,
+    "mask": np.uint8,
+}
+
+# Set in each worker by _init_worker: the artefact and the opened rasters.
+_ARTIFACT: dict[str, Any] | None = None
+_LAYERS: list[np.ndarray] | None = None
+_OUTPUTS: dict[str, np.ndarray] | None = None
+
+
+# --------------------------------------------------------------------------- #
+# Rasters                                                                     #
+# --------------------------------------------------------------------------- #
+
+
+def open_layers(paths: dict[str, Path], features: list[str]) -> list[np.ndarray]:
+    """Memory-map one 2-D layer per feature, in feature order, and check they align."""
+    missing = [f for f in features if f not in paths]
+    if missing:
+        raise SystemExit(f"no layer for: {', '.join(missing)}")
+    layers = [np.load(paths[f], mmap_mode="r") for f in features]
+    shapes = {layer.shape for layer in layers}
+    if len(shapes) != 1 or layers[0].ndim != 2:
+        raise SystemExit("layers must be 2-D arrays of the same shape, got "
+                         + ", ".join(f"{f} {layer.shape}" for f, layer in zip(features, layers)))
+    return layers
+
+
+def layer_paths(directory: Path | None, overrides: list[str]) -> dict[str, Path]:
+    """<feature>.npy files in `directory`, replaced by any name=path overrides."""
+    paths = {p.stem: p for p in sorted(directory.glob("*.npy"))} if directory else {}
+    for item in overrides:
+        name, sep, path = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--layer expects name=path, got {item!r}")
+        paths[name] = Path(path)
+    return paths
+
+
+def create_outputs(directory: Path, shape: tuple[int, int]) -> dict[str, np.ndarray]:
+    directory.mkdir(parents=True, exist_ok=True)
+    return {name: np.lib.format.open_memmap(directory / f"{name}.npy", mode="w+",
+                                            dtype=dtype, shape=shape)
+            for name, dtype in OUTPUTS.items()}
+
+
+def open_outputs(directory: Path) -> dict[str, np.ndarray]:
+    return {name: np.load(directory / f"{name}.npy", mmap_mode="r+") for name in OUTPUTS}
+
+
+def tiles(shape: tuple[int, int], tile: int) -> Iterator[tuple[int, int, int, int]]:
+    """(row0, row1, col0, col1) windows covering the raster in row-major order."""
+    for r in range(0, shape[0], tile):
+        for c in range(0, shape[1], tile):
+            yield r, min(r + tile, shape[0]), c, min(c + tile, shape[1])
+
+
+# --------------------------------------------------------------------------- #
+# Scoring                                                                     #
+# --------------------------------------------------------------------------- #
+
+
+def _init_worker(model_path: str, layers: dict[str, str], out_dir: str) -> None:
+    global _ARTIFACT, _LAYERS, _OUTPUTS
+    _ARTIFACT = load_model(model_path)
+    _LAYERS = open_layers({k: Path(v) for k, v in layers.items()}, _ARTIFACT["feature_names"])
+    _OUTPUTS = open_outputs(Path(out_dir))
+
+
+def _distinct_proba(artifact: dict[str, Any], X: np.ndarray) -> tuple[np.ndarray, int]:
+    """predict_proba(X), routing each distinct forest cell once."""
+    engine = artifact.get("_engine")
+    if engine is None:
+        return predict_proba(artifact, X), len(X)
+    cells = engine.cells(X)
+    distinct, inverse = np.unique(cells, axis=0, return_inverse=True)
+    raw = engine.leaf_proba(engine._route(distinct))
+    return engine.calibrate(raw)[inverse.ravel()], len(distinct)
+
+
+def score_tile(window: tuple[int, int, int, int], artifact: dict[str, Any] | None = None,
+               layers: list[np.ndarray] | None = None,
+               outputs: dict[str, np.ndarray] | None = None) -> dict[str, int]:
+    """Score one window of the layers into the output rasters; returns its counts."""
+    artifact = artifact if artifact is not None else _ARTIFACT
+    layers = layers if layers is not None else _LAYERS
+    outputs = outputs if outputs is not None else _OUTPUTS
+    r0, r1, c0, c1 = window
+    rules = rule_engine(artifact)
+
+    X = np.stack([np.asarray(layer[r0:r1, c0:c1], dtype=np.float64).ravel() for layer in layers],
+                 axis=1)
+    codes = rules.check(X)
+    mask = np.where((codes == MISSING).any(axis=1), MISSING, codes.max(axis=1)).astype(np.uint8)
+    valid = mask == OK
+
+    top = np.full(len(X), -1, dtype=np.int16)
+    confidence = np.full(len(X), np.nan, dtype=np.float32)
+    deferred = np.zeros(len(X), dtype=bool)
+    routed = 0
+    if valid.any():
+        proba, routed = _distinct_proba(artifact, X[valid])
+        best = proba.argmax(axis=1)
+        top[valid] = best
+        confidence[valid] = proba[np.arange(len(best)), best]
+        deferred[valid] = rules.triggered(X[valid], best) >= 0
+
+    shape = (r1 - r0, c1 - c0)
+    for name, values in (("top", top), ("confidence", confidence),
+                         ("deferred", deferred), ("mask", mask)):
+        outputs[name][r0:r1, c0:c1] = values.reshape(shape)
+    return {"cells": len(X), "scored": int(valid.sum()), "routed": routed,
+            "deferred": int(deferred.sum()), "missing": int((mask == MISSING).sum()),
+            "out_of_range": int((mask == OUT_OF_RANGE).sum())}
+
+
+def _max_rss_mb(who: int) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024  # kB on Linux
+
+
+def run(paths: dict[str, Path], out_dir: Path, model_path: Path, tile: int,
+        workers: int, report_every: float = 5.0) -> dict[str, Any]:
+    """Score every tile and return totals; progress goes to stderr."""
+    artifact = load_model(model_path)
+    features = artifact["feature_names"]
+    layers = open_layers(paths, features)
+    shape = layers[0].shape
+    outputs = create_outputs(out_dir, shape)
+    windows = list(tiles(shape, tile))
+
+    totals = {"cells": 0, "scored": 0, "routed": 0, "deferred": 0, "missing": 0, "out_of_range": 0}
+    started = last_report = time.perf_counter()
+
+    def collect(counts: dict[str, int]) -> None:
+        nonlocal last_report
+        for key, value in counts.items():
+            totals[key] += value
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            print(f"{totals['cells']:,} / {shape[0] * shape[1]:,} cells | "
+                  f"{totals['cells'] / (now - started):,.0f} cells/s", file=sys.stderr)
+            last_report = now
+
+    if workers <= 1:
+        for window in windows:
+            collect(score_tile(window, artifact, layers, outputs))
+    else:
+        for array in outputs.values():
+            array.flush()
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(str(model_path), {f: str(paths[f]) for f in features},
+                                           str(out_dir))) as pool:
+            for counts in pool.map(score_tile, windows):
+                collect(counts)
+        outputs = open_outputs(out_dir)
+    for array in outputs.values():
+        array.flush()
+
+    elapsed = time.perf_counter() - started
+    report = {
+        "model": str(model_path),
+        "features": features,
+        "layers": {f: str(paths[f]) for f in features},
+        "shape": list(shape),
+        "tile": tile,
+        "tiles": len(windows),
+        "workers": workers,
+        "class_names": [str(c) for c in artifact["class_names"]],
+        "ambiguity_rules": artifact.get("ambiguity_rules", []),
+        "outputs": {name: f"{name}.npy" for name in OUTPUTS},
+        **totals,
+        "seconds": round(elapsed, 3),
+        "cells_per_second": round(totals["cells"] / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_mb": {"main": round(_max_rss_mb(resource.RUSAGE_SELF), 1),
+                        "worker": round(_max_rss_mb(resource.RUSAGE_CHILDREN), 1) if workers > 1 else None},
+    }
+    (out_dir / "raster.json").write_text(json.dumps(report, indent=2))
+    return report
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("layers", nargs="?", type=Path, help="directory of <feature>.npy layers")
+    ap.add_argument("--layer", action="append", default=[], metavar="NAME=PATH",
+                    help="a layer file for one feature (repeatable; overrides the directory)")
+    ap.add_argument("--out", required=True, type=Path, help="output directory")
+    ap.add_argument("--model", default="crop_model_v2.pkl",
+                    help="artefact: the .pkl or an array export directory")
+    ap.add_argument("--tile", type=int, default=TILE, help="tile edge in cells")
+    ap.add_argument("--workers", type=int, default=1, help="scoring processes (1 = in-process)")
+    args = ap.parse_args()
+    if args.layers is None and not args.layer:
+        ap.error("give a layer directory or --layer NAME=PATH")
+
+    report = run(layer_paths(args.layers, args.layer), args.out, Path(args.model),
+                 args.tile, args.workers)
+    print(f"scored {report['scored']:,} of {report['cells']:,} cells in {report['seconds']:.1f} s "
+          f"({report['cells_per_second']:,.0f} cells/s, {report['routed']:,} routed): "
+          f"{report['deferred']:,} deferred, {report['missing']:,} missing, "
+          f"{report['out_of_range']:,} out of range")
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+registry.py
+===========
+Resident model variants with routing and hot reload.
+
+build_model.py exports a full 7-feature model and a 5-feature reduced model
+(Sec. 4.6) that needs neither temperature nor pH. The registry keeps every
+variant it finds in the model directory loaded, and routes each request to
+the richest variant whose features were all measured:
+
+    registry = ModelRegistry("models")
+    registry.load()
+    registry.start()                         # watch the directory
+    variant, artifact = registry.route(values)
+
+Hot reload: a background thread polls each variant's file (the header.json
+of the array or slim export, or the pickle, whichever was written last).
+When a file has changed and then stayed unchanged for one more poll, so a
+pickle still being written is not read half-way, the new artefact is loaded
+and probed off to the side. The probe scores rows built from its feature_stats,
+checks the probabilities, and checks the compiled engine against sklearn
+where both exist. Only then is it swapped in with a single reference
+assignment. Requests already holding the previous artefact finish on it; a
+failed load or probe leaves the previous artefact serving and is recorded.
+
+`stats()` reports per variant where it came from, its memory (resident set
+growth while loading, plus the compiled engine and sklearn trees split into
+heap and memory-mapped bytes) and the timings of its last swap.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import mmap
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from inference import check_agreement, predict_proba
+from telemetry import TELEMETRY
+
+# Variant -> file stem, richest first; the first one loaded is the primary.
+VARIANTS = {"full": "crop_model_v2", "reduced": "crop_model_v2_reduced"}
+POLL_SECONDS = 2.0
+PROBE_TOLERANCE = 1e-9
+
+
+def _rss_bytes() -> int | None:
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+# Where a variant may be stored, in the order that wins a tie of write times.
+SUFFIXES = (".arrays", ".slim", ".pkl")
+
+
+def _written_ns(path: Path) -> int | None:
+    target = path / "header.json" if path.suffix != ".pkl" else path
+    try:
+        return target.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def locate(directory: Path, stem: str) -> Path | None:
+    """The most recently written of the array export, the slim export and the
+    pickle, or None.
+
+    build_model.py writes them in the order pickle, arrays, slim, so a build
+    with --slim serves the slim export; ties go in SUFFIXES order. A pickle
+    written after the exports (by `--skip-arrays` in build_model.py or
+    update_model.py, which do not rewrite them) is newer than both, which
+    would otherwise keep serving the previous model.
+    """
+    candidates = [(path, _written_ns(path)) for path in (directory / f"{stem}{s}" for s in SUFFIXES)]
+    candidates = [(path, ns) for path, ns in candidates if ns is not None]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: c[1])[0]  # max keeps the first of equals
+
+
+def signature(path: Path | None) -> tuple | None:
+    """What changes when an artefact is rewritten: path, mtime and size."""
+    if path is None:
+        return None
+    target = path / "header.json" if path.is_dir() else path
+    try:
+        stat = target.stat()
+    except OSError:
+        return None
+    return (str(path), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def load_artifact(path: Path) -> dict[str, Any]:
+    """Either format with `_engine` attached and `_timings` (load_ms, compile_ms)."""
+    started = time.perf_counter()
+    if path.is_dir():
+        from array_artifact import load_arrays
+
+        artifact = load_arrays(path)  # already compiled
+        loaded = time.perf_counter()
+    else:
+        import joblib
+
+        from inference import attach_engine
+
+        artifact = joblib.load(path)
+        loaded = time.perf_counter()
+        attach_engine(artifact)
+    artifact["_timings"] = {
+        "load_ms": (loaded - started) * 1000,
+        "compile_ms": (time.perf_counter() - loaded) * 1000,
+    }
+    return artifact
+
+
+def _is_mapped(array: Any) -> bool:
+    """True for a memory map or any view of one."""
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def footprint(artifact: dict[str, Any]) -> dict[str, float]:
+    """Bytes held by the compiled engine and the sklearn trees, heap vs mapped."""
+    heap = mapped = 0
+
+    def add(array: Any) -> None:
+        nonlocal heap, mapped
+        if _is_mapped(array):
+            mapped += array.nbytes
+        elif isinstance(array, np.ndarray):
+            heap += array.nbytes
+
+    engine = artifact.get("_engine")
+    if engine is not None:
+        for field in dataclasses.fields(engine):
+            value = getattr(engine, field.name)
+            for array in value if isinstance(value, list) else [value]:
+                add(array)
+    if artifact.get("_cover") is not None:
+        add(artifact["_cover"])
+    pipeline = artifact.get("pipeline")
+    if pipeline is not None:
+        for estimator in pipeline[-1].estimators_:
+            tree = estimator.tree_
+            heap += tree.node_count * 64 + tree.value.nbytes  # 64: sklearn's node struct
+    return {"heap_mb": round(heap / 2 ** 20, 2), "mapped_mb": round(mapped / 2 ** 20, 2)}
+
+
+def probe(artifact: dict[str, Any], previous: dict[str, Any] | None = None) -> None:
+    """Raise ValueError unless the artefact answers sanely on its own feature_stats."""
+    features = artifact["feature_names"]
+    stats = artifact["feature_stats"]
+    if previous is not None and list(artifact["class_names"]) != list(previous["class_names"]):
+        raise ValueError("class_names differ from the artefact being replaced")
+    rows = np.array([[stats[f][q] for f in features] for q in ("min", "q1", "median", "q3", "max")],
+                    dtype=np.float64)
+    proba = predict_proba(artifact, rows)
+    if proba.shape != (len(rows), len(artifact["class_names"])):
+        raise ValueError(f"probe returned shape {proba.shape}")
+    if not np.isfinite(proba).all() or not np.allclose(proba.sum(axis=1), 1.0, atol=1e-6):
+        raise ValueError("probe probabilities are not finite distributions")
+    if artifact.get("_engine") is not None and "calibrated" in artifact:
+        import pandas as pd
+
+        agreement = check_agreement(artifact, artifact["_engine"], pd.DataFrame(rows, columns=features))
+        if agreement["max_abs_diff"] > PROBE_TOLERANCE:
+            raise ValueError(f"compiled engine disagrees with sklearn by {agreement['max_abs_diff']:.2e}")
+
+
+class ModelRegistry:
+    """The loaded variants of one model directory, swappable while serving."""
+
+    def __init__(self, directory: str | Path, variants: dict[str, str] | None = None,
+                 prepare: Callable[[dict[str, Any]], None] | None = None,
+                 poll: float = POLL_SECONDS):
+        self.directory = Path(directory)
+        self.variants = dict(variants or VARIANTS)
+        self.prepare = prepare
+        self.poll = poll
+        self._models: dict[str, dict[str, Any]] = {}
+        self._info: dict[str, dict[str, Any]] = {}
+        self._pending: dict[str, tuple | None] = {}
+        self._lock = threading.Lock()       # one load/swap at a time
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.errors: list[dict[str, Any]] = []
+        TELEMETRY.add_collector(self._gauges)
+
+    # -- lookup ------------------------------------------------------------- #
+
+    def get(self, variant: str) -> dict[str, Any] | None:
+        return self._models.get(variant)
+
+    def loaded(self) -> list[str]:
+        """Loaded variants, richest first."""
+        return [v for v in self.variants if v in self._models]
+
+    def primary(self) -> tuple[str, dict[str, Any]]:
+        variants = self.loaded()
+        if not variants:
+            if self.errors:  # there was a file, but it would not load
+                last = self.errors[-1]
+                raise LookupError(f"could not load {last['path']}: {last['error']}")
+            raise LookupError(f"no model found in {self.directory}")
+        return variants[0], self._models[variants[0]]
+
+    def route(self, values: dict[str, float | None]) -> tuple[str, dict[str, Any]]:
+        """The richest loaded variant whose features are all present in `values`."""
+        present = {k for k, v in values.items() if v is not None and np.isfinite(v)}
+        for variant in self.loaded():
+            artifact = self._models.get(variant)
+            if artifact is not None and set(artifact["feature_names"]) <= present:
+                TELEMETRY.count("routed", variant=variant)
+                return variant, artifact
+        raise LookupError("no loaded model can answer without "
+                          + ", ".join(sorted(set(self.primary()[1]["feature_names"]) - present)))
+
+    # -- loading ------------------------------------------------------------ #
+
+    def load(self) -> list[str]:
+        """Load every variant present now; returns the variants (re)loaded."""
+        return [v for v in self.variants if self._reload(v, signature(locate(self.directory, self.variants[v])))]
+
+    def check(self) -> list[str]:
+        """One watcher pass: reload variants whose file changed and has settled."""
+        swapped = []
+        for variant, stem in self.variants.items():
+            current = signature(locate(self.directory, stem))
+            if current is None or current == self._info.get(variant, {}).get("signature"):
+                self._pending.pop(variant, None)
+                continue
+            if self._pending.get(variant) != current:
+                self._pending[variant] = current  # changed; load once it stops changing
+                continue
+            self._pending.pop(variant, None)
+            if self._reload(variant, current):
+                swapped.append(variant)
+        return swapped
+
+    def _reload(self, variant: str, expected: tuple | None) -> bool:
+        if expected is None:
+            return False
+        path = Path(expected[0])
+        with self._lock:
+            started = time.perf_counter()
+            rss_before = _rss_bytes()
+            try:
+                artifact = load_artifact(path)
+                loaded = time.perf_counter()
+                probe(artifact, self._models.get(variant))
+                if self.prepare is not None:
+                    self.prepare(artifact)
+                probed = time.perf_counter()
+            except Exception as exc:  # keep serving the previous artefact
+                self.errors.append({"variant": variant, "path": str(path), "error": repr(exc),
+                                    "at_utc": datetime.now(timezone.utc).isoformat(timespec="seconds")})
+                self._info.setdefault(variant, {})["signature"] = expected  # do not retry until it changes
+                TELEMETRY.count("model_swap_failures", variant=variant)
+                return False
+            rss_after = _rss_bytes()
+
+            swap_started = time.perf_counter()
+            previous = self._models.get(variant)
+            self._models[variant] = artifact           # the swap
+            swap_us = (time.perf_counter() - swap_started) * 1e6
+
+            TELEMETRY.observe("model_swap", probed - started)
+            self._info[variant] = {
+                "path": str(path),
+                "signature": expected,
+                "format": {".arrays": "arrays", ".slim": "slim"}.get(path.suffix, "pickle"),
+                "created_utc": artifact.get("created_utc"),
+                "loaded_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "features": len(artifact["feature_names"]),
+                "memory": {
+                    **footprint(artifact),
+                    "rss_growth_mb": (round((rss_after - rss_before) / 2 ** 20, 1)
+                                      if rss_before is not None and rss_after is not None else None),
+                },
+                "last_swap": {
+                    "replaced": previous is not None,
+                    "load_ms": round((loaded - started) * 1000, 2),
+                    "probe_ms": round((probed - loaded) * 1000, 2),
+                    "swap_us": round(swap_us, 2),
+                },
+                "swaps": self._info.get(variant, {}).get("swaps", 0) + 1,
+            }
+            return True
+
+    # -- watching ----------------------------------------------------------- #
+
+    def start(self) -> None:
+        """Poll the directory from a daemon thread (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True, name="model-registry")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll):
+            self.check()
+
+    # -- reporting ---------------------------------------------------------- #
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "variants": {v: {k: i for k, i in info.items() if k != "signature"}
+                         for v, info in self._info.items() if v in self._models},
+            "errors": self.errors[-10:],
+        }
+
+    def _gauges(self) -> dict[str, float]:
+        gauges = {}
+        for variant, info in self._info.items():
+            if variant in self._models:
+                memory = info["memory"]
+                gauges[f"model_{variant}_heap_bytes"] = memory["heap_mb"] * 2 ** 20
+                gauges[f"model_{variant}_mapped_bytes"] = memory["mapped_mb"] * 2 ** 20
+                gauges[f"model_{variant}_swaps"] = info["swaps"]
+        return gauges
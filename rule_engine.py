@@ -0,0 +1,133 @@
+"""
+rule_engine.py
+==============
+Columnar input validation and deferral rules for batches of rows.
+
+`inference.validate()` and `inference.triggered_rule()` walk Python dicts one
+row at a time, which is right for the form and slow for bulk input. The
+engine compiles the same checks once per artefact into arrays:
+
+  * range checks: one [min, max] interval per feature from feature_stats,
+    tested against whole columns; each cell gets a problem code
+    (OK, MISSING for a non-finite value, OUT_OF_RANGE)
+  * ambiguity rules: one row per rule (feature column, [low, high] band,
+    a class-membership mask), tested for all rules at once against the rows'
+    feature values and top-1 classes; the first matching rule wins, as in
+    the loop
+
+Messages are built only for the cells that fail, with the exact wording of
+`validate()`, and rule ids index `artifact["ambiguity_rules"]`, so results
+are identical row for row to the per-row functions.
+
+Usage
+-----
+    engine = rule_engine(artifact)          # compiled once, kept on the artefact
+    codes = engine.check(X)                 # (n_rows, n_features) int8
+    problems = engine.problems(X, codes)    # list of message lists, as validate()
+    rule_ids = engine.triggered(X, top)     # (n_rows,) index into the rules, -1 for none
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+from inference import FEATURE_META
+from telemetry import TELEMETRY
+
+OK, MISSING, OUT_OF_RANGE = 0, 1, 2
+RULE_BLOCK_ROWS = 4096  # rows per (rows x rules) test, bounds the boolean matrix
+
+
+class RuleEngine:
+    """Range checks and ambiguity rules of one artefact, as column tests."""
+
+    def __init__(self, feature_names: list[str], feature_stats: dict[str, dict],
+                 rules: list[dict[str, Any]], class_names: list[str]):
+        self.feature_names = list(feature_names)
+        self.stats = feature_stats
+        self.rules = list(rules)
+        classes = [str(c) for c in class_names]
+        self.low = np.array([feature_stats[f]["min"] for f in self.feature_names], dtype=np.float64)
+        self.high = np.array([feature_stats[f]["max"] for f in self.feature_names], dtype=np.float64)
+
+        # Rules whose feature is not an input, or that name a class the model
+        # does not have, can never fire; they are compiled out.
+        active = [i for i, rule in enumerate(self.rules)
+                  if rule["feature"] in self.feature_names
+                  and all(name in classes for name in rule["classes"])]
+        self.rule_ids = np.array(active, dtype=np.int64)
+        self.rule_column = np.array([self.feature_names.index(self.rules[i]["feature"])
+                                     for i in active], dtype=np.int64)
+        self.rule_low = np.array([self.rules[i]["low"] for i in active], dtype=np.float64)
+        self.rule_high = np.array([self.rules[i]["high"] for i in active], dtype=np.float64)
+        self.rule_member = np.zeros((len(active), len(classes)), dtype=bool)
+        for r, i in enumerate(active):
+            self.rule_member[r, [classes.index(name) for name in self.rules[i]["classes"]]] = True
+        self._labels = ["/".join(rule["classes"]) for rule in self.rules]
+
+    @classmethod
+    def from_artifact(cls, artifact: dict[str, Any]) -> "RuleEngine":
+        return cls(artifact["feature_names"], artifact["feature_stats"],
+                   artifact.get("ambiguity_rules", []), artifact["class_names"])
+
+    def check(self, X: np.ndarray) -> np.ndarray:
+        """Per cell: OK, MISSING (not a finite number) or OUT_OF_RANGE."""
+        with TELEMETRY.stage("validate_batch"):
+            X = np.asarray(X, dtype=np.float64)
+            codes = np.where((X < self.low) | (X > self.high), OUT_OF_RANGE, OK).astype(np.int8)
+            codes[~np.isfinite(X)] = MISSING
+            return codes
+
+    def problems(self, X: np.ndarray, codes: np.ndarray | None = None) -> list[list[str]]:
+        """validate()'s messages for every row (empty lists for valid rows)."""
+        X = np.asarray(X, dtype=np.float64)
+        codes = self.check(X) if codes is None else codes
+        out: list[list[str]] = [[] for _ in range(len(X))]
+        rows, columns = np.nonzero(codes)
+        for i, f in zip(rows.tolist(), columns.tolist()):
+            name = self.feature_names[f]
+            label = FEATURE_META.get(name, {}).get("label", name)
+            if codes[i, f] == MISSING:
+                out[i].append(f"{label}: enter a number.")
+            else:
+                info, unit = self.stats[name], FEATURE_META.get(name, {}).get("unit", "")
+                out[i].append(
+                    f"{label} = {float(X[i, f]):g} is outside the trained range "
+                    f"{info['min']:g}–{info['max']:g} {unit}."
+                )
+        return out
+
+    def triggered(self, X: np.ndarray, top: np.ndarray) -> np.ndarray:
+        """Index into the artefact's ambiguity_rules per row, -1 where none fires.
+
+        `top` is each row's top-1 class index. Deferrals are counted in
+        telemetry per rule, as triggered_rule() does.
+        """
+        with TELEMETRY.stage("rules_batch"):
+            X = np.asarray(X, dtype=np.float64)
+            top = np.asarray(top, dtype=np.int64)
+            out = np.full(len(X), -1, dtype=np.int64)
+            if not len(self.rule_ids):
+                return out
+            for start in range(0, len(X), RULE_BLOCK_ROWS):
+                block = slice(start, start + RULE_BLOCK_ROWS)
+                value = X[block][:, self.rule_column]                  # (rows, rules)
+                hit = (self.rule_member[:, top[block]].T
+                       & (self.rule_low <= value) & (value <= self.rule_high))
+                fired = hit.any(axis=1)
+                out[block][fired] = self.rule_ids[hit[fired].argmax(axis=1)]
+            if TELEMETRY.enabled:
+                counts = np.bincount(out[out >= 0], minlength=len(self.rules))
+                for i in np.flatnonzero(counts):
+                    TELEMETRY.count("deferrals", int(counts[i]), rule=self._labels[i])
+            return out
+
+
+def rule_engine(artifact: dict[str, Any]) -> RuleEngine:
+    """The artefact's compiled RuleEngine, built on first use."""
+    engine = artifact.get("_rules")
+    if engine is None:
+        engine = artifact["_rules"] = RuleEngine.from_artifact(artifact)
+    return engine
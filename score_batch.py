@@ -0,0 +1,237 @@
+"""
+score_batch.py
+==============
+Streaming batch scoring of soil-test records against crop_model_v2.pkl
+or its array export (array_artifact.py).
+
+The input is read in fixed-size chunks and every chunk goes through the same
+steps as a click in the app:
+
+  * range checks against the artefact's feature_stats, as `validate()`; rows
+    that fail are written out with their problems and are not scored
+  * calibrated probabilities from the artefact (compiled engine when possible)
+  * deferral rules, as `triggered_rule()`, e.g. rice/jute inside the rainfall
+    overlap
+
+Both checks run column-wise on the whole chunk (rule_engine.py).
+
+Chunks are scored in a process pool with a bounded number in flight, and the
+results are appended to the output in input order, so memory stays flat
+whatever the size of the input.
+
+Usage
+-----
+    python score_batch.py records.csv --out scored.csv --top-k 3 --workers 4
+    python score_batch.py records.parquet --out scored.parquet --keep plot_id
+
+Output columns
+--------------
+    row            0-based position in the input
+    <keep>         any pass-through columns named with --keep
+    status         ok | deferred | invalid
+    recommendation the crop, "rice or jute" when deferred, empty when invalid
+    problems       validation messages joined with " | " (invalid rows only)
+    crop_1..k      top-k crops by calibrated probability
+    proba_1..k     their calibrated probabilities
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import pandas as pd
+
+from inference import load_model, predict_proba
+from rule_engine import rule_engine
+
+# Set in each worker by _init_worker; the artefact is loaded once per process.
+_ARTIFACT: dict[str, Any] | None = None
+
+
+# --------------------------------------------------------------------------- #
+# Input / output                                                              #
+# --------------------------------------------------------------------------- #
+
+
+def read_chunks(path: Path, columns: list[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Yield the needed columns of a CSV or Parquet file, `chunk_rows` at a time."""
+    if path.suffix.lower() in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise SystemExit("reading Parquet needs pyarrow: pip install pyarrow") from exc
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file as they arrive."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.parquet = path.suffix.lower() in (".parquet", ".pq")
+        self._writer = None
+        self._first = True
+
+    def write(self, frame: pd.DataFrame) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="w" if self._first else "a",
+                         header=self._first, index=False)
+        self._first = False
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+# --------------------------------------------------------------------------- #
+# Scoring                                                                     #
+# --------------------------------------------------------------------------- #
+
+
+def _init_worker(model_path: str) -> None:
+    global _ARTIFACT
+    _ARTIFACT = load_model(model_path)
+
+
+def score_chunk(chunk: pd.DataFrame, first_row: int, top_k: int, keep: list[str],
+                artifact: dict[str, Any] | None = None) -> pd.DataFrame:
+    """Validate, score and apply the deferral rules to one chunk."""
+    artifact = artifact if artifact is not None else _ARTIFACT
+    features = artifact["feature_names"]
+    classes = np.asarray(artifact["class_names"])
+    rules = rule_engine(artifact)
+    top_k = min(top_k, len(classes))
+
+    X = chunk[features].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    codes = rules.check(X)
+    valid = ~codes.any(axis=1)
+    problems = rules.problems(X, codes)
+
+    n = len(chunk)
+    status = np.full(n, "invalid", dtype=object)
+    recommendation = np.full(n, "", dtype=object)
+    top_crops = np.full((n, top_k), "", dtype=object)
+    top_proba = np.full((n, top_k), np.nan)
+
+    if valid.any():
+        proba = predict_proba(artifact, X[valid])
+        order = np.argsort(-proba, axis=1, kind="stable")[:, :top_k]
+        rows = np.flatnonzero(valid)
+        top_crops[rows] = classes[order]
+        top_proba[rows] = np.take_along_axis(proba, order, axis=1)
+        fired = rules.triggered(X[valid], order[:, 0])
+        status[rows], recommendation[rows] = "ok", classes[order[:, 0]]
+        for rule_id in np.unique(fired[fired >= 0]):
+            deferred = rows[fired == rule_id]
+            status[deferred] = "deferred"
+            recommendation[deferred] = " or ".join(rules.rules[rule_id]["classes"])
+
+    out = pd.DataFrame({"row": np.arange(first_row, first_row + n)})
+    for column in keep:
+        out[column] = chunk[column].to_numpy()
+    out["status"] = status
+    out["recommendation"] = recommendation
+    out["problems"] = [" | ".join(p) for p in problems]
+    for j in range(top_k):
+        out[f"crop_{j + 1}"] = top_crops[:, j]
+        out[f"proba_{j + 1}"] = np.round(top_proba[:, j], 6)
+    return out
+
+
+def run(input_path: Path, output_path: Path, model_path: Path, chunk_rows: int,
+        top_k: int, workers: int, keep: list[str], report_every: float = 5.0) -> dict:
+    """Score the whole file and return totals; progress goes to stderr."""
+    artifact = load_model(model_path)
+    features = artifact["feature_names"]
+    columns = list(dict.fromkeys(features + keep))
+    header = read_chunks(input_path, columns, 1)
+    try:
+        next(header)
+    except ValueError as exc:  # pandas: usecols not found
+        raise SystemExit(f"input is missing required columns: {exc}") from exc
+    except StopIteration:
+        pass
+
+    writer = ChunkWriter(output_path)
+    counts = {"rows": 0, "ok": 0, "deferred": 0, "invalid": 0}
+    started = last_report = time.perf_counter()
+
+    def collect(frame: pd.DataFrame) -> None:
+        nonlocal last_report
+        writer.write(frame)
+        counts["rows"] += len(frame)
+        for key, value in frame["status"].value_counts().items():
+            counts[key] += int(value)
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            print(f"{counts['rows']:,} rows | {counts['rows'] / (now - started):,.0f} rows/s",
+                  file=sys.stderr)
+            last_report = now
+
+    first_row = 0
+    try:
+        if workers <= 1:
+            for chunk in read_chunks(input_path, columns, chunk_rows):
+                collect(score_chunk(chunk, first_row, top_k, keep, artifact))
+                first_row += len(chunk)
+        else:
+            del artifact  # each worker loads its own (array exports share pages)
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(str(model_path),)) as pool:
+                pending: deque = deque()
+                for chunk in read_chunks(input_path, columns, chunk_rows):
+                    pending.append(pool.submit(score_chunk, chunk, first_row, top_k, keep))
+                    first_row += len(chunk)
+                    if len(pending) >= 2 * workers:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    counts["seconds"] = round(elapsed, 3)
+    counts["rows_per_second"] = round(counts["rows"] / elapsed, 1) if elapsed > 0 else None
+    return counts
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input", help="CSV or Parquet file with one record per row")
+    ap.add_argument("--out", required=True, help="output file (.csv or .parquet)")
+    ap.add_argument("--model", default="crop_model_v2.pkl",
+                    help="artefact: the .pkl or an array export directory")
+    ap.add_argument("--chunk-rows", type=int, default=50_000, help="rows read and scored at a time")
+    ap.add_argument("--top-k", type=int, default=3, help="crops reported per row")
+    ap.add_argument("--workers", type=int, default=1, help="scoring processes (1 = in-process)")
+    ap.add_argument("--keep", nargs="*", default=[], help="input columns copied to the output")
+    args = ap.parse_args()
+
+    totals = run(Path(args.input), Path(args.out), Path(args.model), args.chunk_rows,
+                 args.top_k, args.workers, args.keep)
+    print(f"scored {totals['rows']:,} rows in {totals['seconds']:.1f} s "
+          f"({totals['rows_per_second']:,.0f} rows/s): {totals['ok']:,} ok, "
+          f"{totals['deferred']:,} deferred, {totals['invalid']:,} invalid")
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
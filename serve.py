@@ -0,0 +1,516 @@
+"""
+serve.py
+========
+Asynchronous HTTP inference service for the Flutter tier.
+
+Loads crop_model_v2.pkl, or its array export, once and answers JSON requests
+with the same fields the Streamlit app shows: the crop, its calibrated
+confidence, the deferral note when an ambiguity rule fires, and the ranked
+alternatives. It is built on
+asyncio streams from the standard library, so it needs nothing beyond the
+app's own requirements.
+
+Concurrent single-row requests are queued and merged into micro-batches: the
+first queued row opens a window of `--max-wait-ms`, and everything that
+arrives before it closes (up to `--max-batch` rows) is scored in one call.
+Under light load a row waits at most the window; under heavy load the batches
+fill before the window closes and throughput scales with the batch size.
+
+Endpoints
+---------
+    GET  /health          {"status": "ok", "variant": ..., "created_utc": ...}
+    GET  /stats           batching counters
+    GET  /metrics         per-stage histograms and counters, Prometheus text (telemetry.py)
+    GET  /drift           input drift and confidence scores (monitor.py)
+    POST /predict         {"N": 90, "P": 42, ...}            -> one result
+    POST /predict/batch   {"records": [{"N": 90, ...}, ...]} -> {"results": [...]}
+    POST /outcomes        {"outcomes": [{"confidence": 0.93, "correct": true}, ...]}
+                          -> {"recorded": n}; feeds the monitor's observed ECE
+
+A record outside the trained ranges gets HTTP 422 (single) or a result with
+"problems" and no crop (batch).
+
+Every answered record is written to the audit log when CROP_AUDIT_DIR is set
+(audit.py). Records are enqueued without waiting, so when the audit queue is
+full they are dropped and counted, even with CROP_AUDIT_POLICY=block.
+
+Usage
+-----
+    python serve.py --port 8080 --max-wait-ms 2 --max-batch 64
+    python serve.py --self-test          # local server + concurrent client
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any
+
+import numpy as np
+
+from audit import AUDIT
+from inference import CROP_NOTES, load_model, predict_proba, triggered_rule, validate
+from monitor import MONITOR
+from rule_engine import rule_engine
+from telemetry import TELEMETRY
+
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+
+# --------------------------------------------------------------------------- #
+# Results                                                                     #
+# --------------------------------------------------------------------------- #
+
+
+def describe(artifact: dict[str, Any], values: dict[str, float],
+             probabilities: np.ndarray, n_alternatives: int) -> dict[str, Any]:
+    """The fields the app renders for one recommendation, as JSON-ready data."""
+    classes = np.asarray(artifact["class_names"])
+    crop = str(classes[int(np.argmax(probabilities))])
+    rule = triggered_rule(artifact, values, classes, crop)
+    return render_result(artifact, probabilities, rule, n_alternatives)
+
+
+def render_result(artifact: dict[str, Any], probabilities: np.ndarray,
+                  rule: dict[str, Any] | None, n_alternatives: int) -> dict[str, Any]:
+    """`describe()` once the deferral rule, if any, is known."""
+    classes = np.asarray(artifact["class_names"])
+    best = int(np.argmax(probabilities))
+    crop = str(classes[best])
+    TELEMETRY.count("predictions")
+    order = np.argsort(probabilities)[::-1][:n_alternatives]
+    result: dict[str, Any] = {
+        "crop": crop,
+        # Isotonic regression can saturate at exactly 1.0; never claim certainty.
+        "confidence": round(min(float(probabilities[best]), 0.999), 6),
+        "deferred": rule is not None,
+        "note": CROP_NOTES.get(crop, ""),
+        "alternatives": [
+            {"crop": str(classes[i]), "probability": round(float(probabilities[i]), 6)}
+            for i in order
+        ],
+    }
+    if rule is not None:
+        result["candidates"] = [
+            {"crop": name,
+             "probability": round(float(probabilities[int(np.where(classes == name)[0][0])]), 6)}
+            for name in rule["classes"]
+        ]
+        result["note"] = rule["note"]
+    return result
+
+
+def parse_record(artifact: dict[str, Any], record: Any) -> tuple[dict[str, float], list[str]]:
+    """Feature values from a JSON object, plus any validation problems."""
+    if not isinstance(record, dict):
+        return {}, ["each record must be a JSON object of feature values"]
+    values = {name: _number(record.get(name)) for name in artifact["feature_names"]}
+    return values, validate(values, artifact["feature_stats"])
+
+
+def parse_records(artifact: dict[str, Any], records: list[Any]) -> tuple[np.ndarray, list[list[str]]]:
+    """`parse_record()` for many records: a feature matrix and per-record problems.
+
+    The range checks run column-wise (rule_engine.py) with the same messages.
+    """
+    features = artifact["feature_names"]
+    X = np.full((len(records), len(features)), np.nan)
+    malformed = []
+    for i, record in enumerate(records):
+        if isinstance(record, dict):
+            X[i] = [_number(record.get(name)) for name in features]
+        else:
+            malformed.append(i)
+    problems = rule_engine(artifact).problems(X)
+    for i in malformed:
+        problems[i] = ["each record must be a JSON object of feature values"]
+    return X, problems
+
+
+def _number(raw: Any) -> float:
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# --------------------------------------------------------------------------- #
+# Micro-batching                                                              #
+# --------------------------------------------------------------------------- #
+
+
+@dataclass
+class BatchStats:
+    requests: int = 0
+    batches: int = 0
+    largest_batch: int = 0
+    sizes: dict[int, int] = field(default_factory=dict)
+
+    def record(self, size: int) -> None:
+        self.requests += size
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, size)
+        self.sizes[size] = self.sizes.get(size, 0) + 1
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
+
+
+class MicroBatcher:
+    """Merge concurrent single rows into one scoring call per wait window.
+
+    Scoring runs on a single worker thread so the event loop keeps accepting
+    and parsing requests while a batch is being evaluated.
+    """
+
+    def __init__(self, artifact: dict[str, Any], max_batch: int = 64, max_wait_ms: float = 2.0):
+        self.artifact = artifact
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchStats()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="scorer")
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def score(self, row: list[float]) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def score_many(self, rows: list[list[float]]) -> np.ndarray:
+        """Score an already-batched request on the same worker thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, predict_proba, self.artifact, np.asarray(rows))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            rows = np.asarray([row for row, _ in batch], dtype=float)
+            self.stats.record(len(batch))
+            try:
+                proba = await loop.run_in_executor(self._executor, predict_proba, self.artifact, rows)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, future), p in zip(batch, proba):
+                if not future.done():
+                    future.set_result(p)
+
+
+# --------------------------------------------------------------------------- #
+# HTTP                                                                        #
+# --------------------------------------------------------------------------- #
+
+
+class PredictionService:
+    """Minimal HTTP/1.1 JSON server (keep-alive, Content-Length bodies)."""
+
+    def __init__(self, artifact: dict[str, Any], max_batch: int = 64,
+                 max_wait_ms: float = 2.0, n_alternatives: int = 5):
+        self.artifact = artifact
+        self.n_alternatives = n_alternatives
+        self.batcher = MicroBatcher(artifact, max_batch, max_wait_ms)
+        self._server: asyncio.base_events.Server | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> int:
+        """Start listening; returns the bound port (useful with port 0)."""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "malformed request line"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                raw_length = headers.get("content-length", "") or "0"
+                if not (raw_length.isascii() and raw_length.isdigit()):  # also rejects "-5"
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "invalid Content-Length"}, False)
+                    break
+                length = int(raw_length)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version.upper() == "HTTP/1.1")
+                route = path.split("?", 1)[0]
+                if method.upper() == "GET" and route == "/metrics":
+                    status, payload = HTTPStatus.OK, TELEMETRY.render_prometheus()
+                else:
+                    started = time.perf_counter()
+                    try:
+                        status, payload = await self._route(method.upper(), route, body)
+                    except Exception as exc:  # e.g. a scoring failure; answer rather than drop
+                        TELEMETRY.count("request_errors", route=route)
+                        status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(exc)}
+                    if route.startswith("/predict"):
+                        TELEMETRY.observe("request", time.perf_counter() - started)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: HTTPStatus,
+                       payload: dict[str, Any] | str, keep_alive: bool) -> None:
+        """JSON for dicts; a str is sent as-is as Prometheus text."""
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, dict[str, Any]]:
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {
+                "status": "ok",
+                "variant": self.artifact.get("variant"),
+                "created_utc": self.artifact.get("created_utc"),
+                "feature_names": self.artifact["feature_names"],
+            }
+        if method == "GET" and path == "/stats":
+            return HTTPStatus.OK, self.batcher.stats.as_dict()
+        if method == "GET" and path == "/drift":
+            return HTTPStatus.OK, MONITOR.latest()
+        if method != "POST" or path not in ("/predict", "/predict/batch", "/outcomes"):
+            return HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {path}"}
+        try:
+            data = json.loads(body or b"null")
+        except (ValueError, UnicodeDecodeError):  # JSONDecodeError, or a body that is not UTF-8
+            return HTTPStatus.BAD_REQUEST, {"error": "body is not valid JSON"}
+
+        if path == "/outcomes":
+            return self._outcomes(data)
+
+        features = self.artifact["feature_names"]
+        started = time.perf_counter()
+        if path == "/predict":
+            values, problems = parse_record(self.artifact, data)
+            if problems:
+                return HTTPStatus.UNPROCESSABLE_ENTITY, {"problems": problems}
+            row = [values[f] for f in features]
+            proba = await self.batcher.score(row)
+            MONITOR.observe(self.artifact, row, proba)
+            result = describe(self.artifact, values, proba, self.n_alternatives)
+            self._audit(values, proba, result, started)
+            return HTTPStatus.OK, result
+
+        records = data.get("records") if isinstance(data, dict) else None
+        if not isinstance(records, list):
+            return HTTPStatus.BAD_REQUEST, {"error": 'expected {"records": [...]}'}
+        X, problems = parse_records(self.artifact, records)
+        good = [i for i, p in enumerate(problems) if not p]
+        results: list[dict[str, Any]] = [{"problems": p} for p in problems]
+        if good:
+            proba = await self.batcher.score_many(X[good].tolist())
+            MONITOR.observe(self.artifact, X[good], proba)
+            rules = rule_engine(self.artifact)
+            fired = rules.triggered(X[good], proba.argmax(axis=1))
+            for i, p, rule_id in zip(good, proba, fired):
+                rule = rules.rules[rule_id] if rule_id >= 0 else None
+                results[i] = render_result(self.artifact, p, rule, self.n_alternatives)
+                self._audit(dict(zip(features, X[i].tolist())), p, results[i], started)
+        return HTTPStatus.OK, {"results": results}
+
+    def _outcomes(self, data: Any) -> tuple[HTTPStatus, dict[str, Any]]:
+        outcomes = data.get("outcomes") if isinstance(data, dict) else None
+        if not isinstance(outcomes, list) or not all(
+                isinstance(o, dict) and isinstance(o.get("correct"), bool)
+                and isinstance(o.get("confidence"), (int, float)) and 0 <= o["confidence"] <= 1
+                for o in outcomes):
+            return HTTPStatus.BAD_REQUEST, {
+                "error": 'expected {"outcomes": [{"confidence": 0..1, "correct": true|false}, ...]}'}
+        MONITOR.outcome(self.artifact, [o["confidence"] for o in outcomes],
+                        [o["correct"] for o in outcomes])
+        return HTTPStatus.OK, {"recorded": len(outcomes)}
+
+    def _audit(self, values: dict[str, float], proba: np.ndarray, result: dict[str, Any],
+               started: float) -> None:
+        # On the event loop: never wait for queue room, even with policy "block".
+        AUDIT.record(wait=False, source="serve", variant=self.artifact.get("variant"),
+                     created_utc=self.artifact.get("created_utc"), inputs=values, proba=proba,
+                     crop=result["crop"],
+                     rule="/".join(c["crop"] for c in result["candidates"]) if result["deferred"] else None,
+                     latency_ms=(time.perf_counter() - started) * 1000)
+
+
+# --------------------------------------------------------------------------- #
+# Local client and self-test                                                  #
+# --------------------------------------------------------------------------- #
+
+
+async def request(host: str, port: int, method: str, path: str,
+                  payload: Any = None) -> tuple[int, dict[str, Any]]:
+    """One HTTP request on a fresh connection; returns (status, JSON body)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                  "Connection: close\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    data = json.loads(await reader.readexactly(length))
+    writer.close()
+    return status, data
+
+
+async def self_test(artifact: dict[str, Any], args: argparse.Namespace) -> None:
+    service = PredictionService(artifact, args.max_batch, args.max_wait_ms, args.alternatives)
+    port = await service.start("127.0.0.1", 0)
+    stats = artifact["feature_stats"]
+    features = artifact["feature_names"]
+    rng = np.random.default_rng(0)
+    records = [
+        {f: float(rng.uniform(stats[f]["q1"], stats[f]["q3"])) for f in features}
+        for _ in range(args.requests)
+    ]
+    try:
+        status, health = await request("127.0.0.1", port, "GET", "/health")
+        print(f"health {status}: {health['variant']} model built {health['created_utc']}")
+
+        latencies = []
+
+        async def one(record: dict[str, float]) -> None:
+            started = time.perf_counter()
+            code, _ = await request("127.0.0.1", port, "POST", "/predict", record)
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert code == 200, code
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(record: dict[str, float]) -> None:
+            async with semaphore:
+                await one(record)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(r) for r in records))
+        elapsed = time.perf_counter() - started
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{len(records)} single requests, {args.concurrency} concurrent: "
+              f"{len(records) / elapsed:,.0f} req/s | p50 {p50:.2f} ms | p99 {p99:.2f} ms")
+        print("batching:", service.batcher.stats.as_dict())
+        for stage, row in sorted(TELEMETRY.snapshot()["stages"].items()):
+            print(f"  {stage:16} n={row['count']:<6} mean {row['mean_ms']:.3f} ms | p99 <= {row['p99_ms']} ms")
+
+        status, batch = await request("127.0.0.1", port, "POST", "/predict/batch",
+                                      {"records": records[:100]})
+        print(f"batch {status}: {len(batch['results'])} results, first -> "
+              f"{batch['results'][0]['crop']} {batch['results'][0]['confidence']:.3f}")
+        bad = dict(records[0], N=stats["N"]["max"] + 100)
+        status, rejected = await request("127.0.0.1", port, "POST", "/predict", bad)
+        print(f"out-of-range {status}: {rejected['problems'][0]}")
+        status, recorded = await request("127.0.0.1", port, "POST", "/outcomes",
+                                         {"outcomes": [{"confidence": 0.9, "correct": True}]})
+        print(f"outcomes {status}: {recorded}")
+        status, drift = await request("127.0.0.1", port, "GET", "/drift")
+        model = drift["models"][0]
+        worst = max(model["features"], key=lambda f: model["features"][f]["psi"])
+        print(f"drift {status}: {model['rows']} rows, largest PSI {worst} "
+              f"{model['features'][worst]['psi']:.3f} (self-test inputs are uniform over q1..q3)")
+    finally:
+        await service.close()
+
+
+async def serve_forever(artifact: dict[str, Any], args: argparse.Namespace) -> None:
+    service = PredictionService(artifact, args.max_batch, args.max_wait_ms, args.alternatives)
+    port = await service.start(args.host, args.port)
+    print(f"serving {artifact.get('variant')} model on http://{args.host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default="crop_model_v2.pkl",
+                    help="artefact: the .pkl or an array export directory")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--max-batch", type=int, default=64, help="largest micro-batch")
+    ap.add_argument("--max-wait-ms", type=float, default=2.0, help="micro-batch wait window")
+    ap.add_argument("--alternatives", type=int, default=5, help="alternatives per result")
+    ap.add_argument("--self-test", action="store_true", help="run a local client against the service")
+    ap.add_argument("--requests", type=int, default=2000, help="self-test: number of requests")
+    ap.add_argument("--concurrency", type=int, default=64, help="self-test: concurrent clients")
+    args = ap.parse_args()
+
+    artifact = load_model(args.model)
+    runner = self_test if args.self_test else serve_forever
+    try:
+        asyncio.run(runner(artifact, args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
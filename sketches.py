@@ -0,0 +1,213 @@
+"""
+sketches.py
+===========
+Mergeable streaming summaries of numeric columns.
+
+`feature_stats` (Table 4: min, q1, median, q3, max, mean, sd) is computed
+with pandas over the whole training table. To keep it current as new
+observations arrive without rereading the history, each feature also carries
+a small summary that can absorb a batch, or be merged with another summary,
+in time proportional to the batch:
+
+  * `RunningStats`   count, mean, sum of squared deviations, min and max,
+                     combined with Chan et al.'s parallel update, so mean, sd,
+                     min and max are exact
+  * `QuantileSketch` at most `capacity` weighted centroids kept in value
+                     order; a batch is merged in and adjacent centroids are
+                     pooled into equal-weight groups, so any quantile is within
+                     about 1/capacity of its true rank. While nothing has been
+                     pooled the sketch is the data, and quantiles are exact
+
+Both serialise to plain JSON-ready dicts, which is how the artefact stores
+them (`artifact["feature_sketches"]`).
+
+Usage
+-----
+    summary = FeatureSummary.from_values(df["rainfall"])
+    summary.update(new["rainfall"])
+    summary.stats()                        # a feature_stats entry
+    FeatureSummary.from_dict(summary.to_dict())
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+import numpy as np
+
+CAPACITY = 256
+STATS_QUANTILES = {"q1": 0.25, "median": 0.5, "q3": 0.75}
+
+
+class RunningStats:
+    """Exact count, mean, variance, min and max over everything seen."""
+
+    def __init__(self, n: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 minimum: float = np.inf, maximum: float = -np.inf):
+        self.n, self.mean, self.m2 = int(n), float(mean), float(m2)
+        self.min, self.max = float(minimum), float(maximum)
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.mean += delta * other.n / n
+        self.n = n
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def update(self, values: Iterable[float]) -> "RunningStats":
+        x = np.asarray(values, dtype=np.float64).ravel()
+        if len(x):
+            mean = float(x.mean())
+            self.merge(RunningStats(len(x), mean, float(((x - mean) ** 2).sum()),
+                                    float(x.min()), float(x.max())))
+        return self
+
+    @property
+    def sd(self) -> float:
+        """Sample standard deviation (ddof=1), as pandas reports it."""
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else float("nan")
+
+    def to_dict(self) -> dict[str, float]:
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, float]) -> "RunningStats":
+        return cls(data["n"], data["mean"], data["m2"], data["min"], data["max"])
+
+
+class QuantileSketch:
+    """Bounded, mergeable quantile summary: value-ordered weighted centroids."""
+
+    def __init__(self, capacity: int = CAPACITY, values: Any = (), weights: Any = ()):
+        self.capacity = int(capacity)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    @property
+    def exact(self) -> bool:
+        """True while every centroid is a single observation."""
+        return bool((self.weights == 1).all())
+
+    def _absorb(self, values: np.ndarray, weights: np.ndarray) -> "QuantileSketch":
+        values = np.concatenate([self.values, values])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        if len(values) > self.capacity:
+            # Pool into `capacity` groups of (nearly) equal total weight.
+            before = np.cumsum(weights) - weights
+            group = np.minimum((before / weights.sum() * self.capacity).astype(np.int64),
+                               self.capacity - 1)
+            first = np.flatnonzero(np.diff(group, prepend=-1))  # group is non-decreasing
+            totals = np.add.reduceat(weights, first)
+            values = np.add.reduceat(values * weights, first) / totals
+            weights = totals
+        self.values, self.weights = values, weights
+        return self
+
+    def update(self, values: Iterable[float]) -> "QuantileSketch":
+        x = np.asarray(values, dtype=np.float64).ravel()
+        x = x[np.isfinite(x)]
+        return self._absorb(x, np.ones(len(x)))
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        return self._absorb(other.values, other.weights)
+
+    def quantile(self, q: float | np.ndarray, low: float | None = None,
+                 high: float | None = None) -> float | np.ndarray:
+        """Interpolated quantile(s); `low`/`high` pin the ends to the exact min/max."""
+        if not len(self.values):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float("nan")
+        if self.exact:
+            out = np.quantile(self.values, q)  # same interpolation as pandas
+        else:
+            cumulative = np.cumsum(self.weights)
+            mid = (cumulative - self.weights / 2) / cumulative[-1]
+            lo = self.values[0] if low is None else low
+            hi = self.values[-1] if high is None else high
+            out = np.interp(q, np.concatenate([[0.0], mid, [1.0]]),
+                            np.concatenate([[lo], self.values, [hi]]))
+        return float(out) if np.ndim(out) == 0 else out
+
+    def cdf(self, x: float | np.ndarray, low: float | None = None,
+            high: float | None = None) -> float | np.ndarray:
+        """Fraction of the weight at or below `x`; the inverse of `quantile`."""
+        if not len(self.values):
+            return np.full(np.shape(x), np.nan) if np.ndim(x) else float("nan")
+        if self.exact:
+            out = np.searchsorted(self.values, x, side="right") / len(self.values)
+        else:
+            cumulative = np.cumsum(self.weights)
+            mid = (cumulative - self.weights / 2) / cumulative[-1]
+            lo = self.values[0] if low is None else low
+            hi = self.values[-1] if high is None else high
+            out = np.interp(x, np.concatenate([[lo], self.values, [hi]]),
+                            np.concatenate([[0.0], mid, [1.0]]))
+        return float(out) if np.ndim(out) == 0 else out
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"capacity": self.capacity, "values": self.values.tolist(),
+                "weights": self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "QuantileSketch":
+        return cls(data["capacity"], data["values"], data["weights"])
+
+
+class FeatureSummary:
+    """RunningStats plus a QuantileSketch: everything a feature_stats entry needs."""
+
+    def __init__(self, running: RunningStats | None = None, sketch: QuantileSketch | None = None):
+        self.running = running or RunningStats()
+        self.sketch = sketch or QuantileSketch()
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], capacity: int = CAPACITY) -> "FeatureSummary":
+        x = np.asarray(values, dtype=np.float64)
+        return cls(RunningStats().update(x), QuantileSketch(capacity).update(x))
+
+    @classmethod
+    def from_stats(cls, stats: dict[str, float], n: int, capacity: int = CAPACITY) -> "FeatureSummary":
+        """Seed from a stored feature_stats entry, for artefacts built without sketches.
+
+        Mean, sd, min and max are carried over exactly; the distribution is
+        approximated as piecewise uniform between min, q1, median, q3 and max.
+        """
+        running = RunningStats(n, stats["mean"], stats["sd"] ** 2 * (n - 1), stats["min"], stats["max"])
+        knots = [stats["min"], stats["q1"], stats["median"], stats["q3"], stats["max"]]
+        points = min(capacity, n)
+        ranks = (np.arange(points) + 0.5) / points
+        values = np.interp(ranks, [0.0, 0.25, 0.5, 0.75, 1.0], knots)
+        return cls(running, QuantileSketch(capacity, values, np.full(points, n / points)))
+
+    def update(self, values: Iterable[float]) -> "FeatureSummary":
+        x = np.asarray(values, dtype=np.float64)
+        self.running.update(x)
+        self.sketch.update(x)
+        return self
+
+    def merge(self, other: "FeatureSummary") -> "FeatureSummary":
+        self.running.merge(other.running)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def stats(self) -> dict[str, float]:
+        """A feature_stats entry (min, q1, median, q3, max, mean, sd)."""
+        r = self.running
+        quantiles = {k: self.sketch.quantile(q, r.min, r.max) for k, q in STATS_QUANTILES.items()}
+        return {"min": r.min, **quantiles, "max": r.max, "mean": r.mean, "sd": r.sd}
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"running": self.running.to_dict(), "sketch": self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "FeatureSummary":
+        return cls(RunningStats.from_dict(data["running"]), QuantileSketch.from_dict(data["sketch"]))
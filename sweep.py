@@ -0,0 +1,129 @@
+"""
+sweep.py
+========
+What-if sensitivity sweeps for the app: vary one or two features across
+their trained range, hold the others, and score the whole grid at once.
+
+A 100 x 100 grid is 10,000 rows, but the compiled forest only sees cells
+(cell_cache.py): every value between two consecutive split thresholds of a
+feature reaches the same leaves. Each swept axis is therefore reduced to its
+distinct cells first, only the product of those is routed through the forest,
+and the result is broadcast back onto the grid. The probabilities are exactly
+`predict_proba` on every grid point; artefacts that cannot be compiled are
+scored point by point through sklearn in one batch.
+
+Deferral (Sec. 4.5) is evaluated on the grid the way `triggered_rule` does
+it per row: the top-1 crop is one of a rule's classes and the rule's feature
+lies in its band.
+
+Usage
+-----
+    axes = grid_axes(artifact["feature_stats"], ["rainfall"], points=200)
+    result = sweep(artifact, values, axes)
+    result.proba          # (200, n_classes), or (n1, n2, n_classes) for two axes
+    result.deferred       # (200,) bool
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from inference import predict_proba
+from telemetry import TELEMETRY
+
+MAX_POINTS = 1000  # per axis
+
+
+@dataclass
+class Sweep:
+    """A scored grid: axis values, probabilities, top-1 and deferral per point."""
+
+    features: list[str]
+    axes: list[np.ndarray]
+    proba: np.ndarray          # grid shape + (n_classes,)
+    top: np.ndarray            # grid shape, class index
+    deferred: np.ndarray       # grid shape, bool
+    rule: np.ndarray           # grid shape, index into ambiguity_rules or -1
+    points_scored: int         # rows that went through the forest
+
+    def top_classes(self, k: int) -> np.ndarray:
+        """Indices of the k classes with the highest peak probability on the grid."""
+        peak = self.proba.reshape(-1, self.proba.shape[-1]).max(axis=0)
+        return np.argsort(peak)[::-1][:k]
+
+
+def grid_axes(stats: dict[str, dict], features: list[str], points: int) -> dict[str, np.ndarray]:
+    """Evenly spaced values across each feature's trained min-max range."""
+    if not 1 <= len(features) <= 2:
+        raise ValueError("sweep one or two features")
+    if not 2 <= points <= MAX_POINTS:
+        raise ValueError(f"points per axis must be between 2 and {MAX_POINTS}")
+    return {f: np.linspace(stats[f]["min"], stats[f]["max"], points) for f in features}
+
+
+def _scored_grid(artifact: dict[str, Any], base: np.ndarray, columns: list[int],
+                 axes: list[np.ndarray]) -> tuple[np.ndarray, int]:
+    """Calibrated probabilities on the product grid, (n1[, n2], n_classes)."""
+    engine = artifact.get("_engine")
+    shape = tuple(len(a) for a in axes)
+    if engine is None:
+        grid = np.tile(base, (int(np.prod(shape)), 1))
+        for column, mesh in zip(columns, np.meshgrid(*axes, indexing="ij")):
+            grid[:, column] = mesh.ravel()
+        return predict_proba(artifact, grid).reshape(*shape, -1), len(grid)
+
+    # Distinct cells per axis; only their product is routed.
+    base_cells = engine.cells(base)[0]
+    distinct, inverse = [], []
+    for column, values in zip(columns, axes):
+        cells, back = np.unique(np.searchsorted(engine.split_values[column], values, side="left"),
+                                return_inverse=True)
+        distinct.append(cells)
+        inverse.append(back)
+    cells = np.tile(base_cells, (int(np.prod([len(d) for d in distinct])), 1))
+    for column, mesh in zip(columns, np.meshgrid(*distinct, indexing="ij")):
+        cells[:, column] = mesh.ravel()
+    with TELEMETRY.stage("sweep_forest"):
+        raw = engine.leaf_proba(engine._route(cells))
+    with TELEMETRY.stage("sweep_isotonic"):
+        proba = engine.calibrate(raw).reshape(*(len(d) for d in distinct), -1)
+    return proba[np.ix_(*inverse)], len(cells)
+
+
+def sweep(artifact: dict[str, Any], values: dict[str, float],
+          axes: dict[str, np.ndarray]) -> Sweep:
+    """Score every combination of `axes`, other features held at `values`."""
+    with TELEMETRY.stage("sweep"):
+        features = artifact["feature_names"]
+        classes = np.asarray(artifact["class_names"])
+        swept = list(axes)
+        columns = [features.index(f) for f in swept]
+        grid_values = [np.asarray(axes[f], dtype=np.float64) for f in swept]
+        base = np.array([[values[f] for f in features]], dtype=np.float64)
+
+        proba, scored = _scored_grid(artifact, base, columns, grid_values)
+        top = proba.argmax(axis=-1)
+
+        # triggered_rule on every grid point: the first matching rule wins.
+        shape = top.shape
+        meshes = dict(zip(swept, np.meshgrid(*grid_values, indexing="ij")))
+        rule_index = np.full(shape, -1)
+        for i, rule in enumerate(artifact.get("ambiguity_rules", [])):
+            if not all(name in classes for name in rule["classes"]) or rule["feature"] not in features:
+                continue
+            value = meshes.get(rule["feature"], np.full(shape, values[rule["feature"]]))
+            hit = (np.isin(classes[top], rule["classes"])
+                   & (rule["low"] <= value) & (value <= rule["high"]) & (rule_index < 0))
+            rule_index[hit] = i
+        return Sweep(features=swept, axes=grid_values, proba=proba, top=top,
+                     deferred=rule_index >= 0, rule=rule_index, points_scored=scored)
+
+
+def runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """(first, last) index of each run of True in a 1-D mask, for shading bands."""
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return [(int(a), int(b) - 1) for a, b in zip(edges[::2], edges[1::2])]
@@ -0,0 +1,233 @@
+"""
+telemetry.py
+============
+Per-stage timers, counters and latency histograms for the prediction hot path.
+
+One process-wide registry, `TELEMETRY`, is shared by the app, the HTTP
+service and the inference helpers. Stages are timed with a context manager:
+
+    with TELEMETRY.stage("validate"):
+        problems = validate(values, stats)
+    TELEMETRY.count("deferrals", rule="rice/jute")
+
+Stages recorded today:
+
+    validate, triggered_rule          inference.py, wherever they are called
+    scaling, forest, isotonic         CompiledForest.predict_proba (scaling is
+                                      folded into the threshold search)
+    sklearn_predict                   the sklearn fallback, all three in one
+    frame_build, top_contributions,   app.py
+    render
+    request                           serve.py, one /predict or /predict/batch
+    sweep                             sweep.py, one what-if grid
+    sweep_forest, sweep_isotonic      sweep.py, its distinct cells (kept apart
+                                      from forest and isotonic, which are per
+                                      prediction)
+    model_swap                        registry.py, load + probe of a new artefact
+    validate_batch                    rule_engine.py, range checks over a batch
+    rules_batch                       rule_engine.py, ambiguity rules over a batch
+
+Counters: `predictions`, `deferrals{rule}` and `explainer_fallbacks{reason}`.
+
+Each stage feeds a cumulative histogram with fixed buckets, so recording is
+a bisect and three additions under a lock. With CROP_TELEMETRY=off the
+registry is disabled: `stage()` hands back one shared no-op context manager
+and `count()` returns immediately, so instrumented code pays for an attribute
+lookup and nothing else.
+
+Export is the Prometheus text format, either served (`GET /metrics` in
+serve.py) or written to a file for node_exporter's textfile collector
+(CROP_TELEMETRY_FILE, rewritten atomically at most every
+CROP_TELEMETRY_INTERVAL seconds).
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable
+
+# Upper bounds in seconds, 50 µs to 2.5 s; +Inf is implicit.
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PREFIX = "crop"
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """Prometheus-style histogram: per-bucket counts, sum and count."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bucket bound holding the q-quantile (an over-estimate, as in PromQL)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Stage:
+    __slots__ = ("registry", "name", "started")
+
+    def __init__(self, registry: "Telemetry", name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self) -> "_Stage":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.registry.observe(self.name, time.perf_counter() - self.started)
+
+
+class Telemetry:
+    """Thread-safe registry of stage histograms and labelled counters."""
+
+    def __init__(self, enabled: bool = True, path: str | None = None, interval: float = 10.0):
+        self.enabled = enabled
+        self.path = Path(path) if path else None
+        self.interval = interval
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._collectors: list[Callable[[], dict[str, float]]] = []
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def stage(self, name: str):
+        """Context manager timing one stage (a shared no-op when disabled)."""
+        if not self.enabled:
+            return _NOOP
+        return _Stage(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name: str, n: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def add_collector(self, collect: Callable[[], dict[str, float]]) -> None:
+        """Register a callable whose {name: value} gauges are exported with the rest."""
+        self._collectors.append(collect)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        """Plain-data view: per stage count, mean and bucket p50/p95/p99 in ms."""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": h.count,
+                    "mean_ms": round(h.sum / h.count * 1000, 4) if h.count else None,
+                    **{f"p{int(q * 100)}_ms": _ms(h.quantile(q)) for q in (0.5, 0.95, 0.99)},
+                }
+                for name, h in self._histograms.items()
+            }
+            counters = {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                for (name, labels), value in self._counters.items()
+            }
+        return {"stages": stages, "counters": counters}
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            histograms = {name: (list(h.counts), h.sum, h.count)
+                          for name, h in self._histograms.items()}
+            counters = dict(self._counters)
+        if histograms:
+            metric = f"{PREFIX}_stage_seconds"
+            lines += [f"# HELP {metric} Time spent in each prediction stage.",
+                      f"# TYPE {metric} histogram"]
+            for name, (counts, total, count) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {total!r}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {count}')
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter"]
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f"{metric}{{{rendered}}} {value:g}" if rendered
+                                 else f"{metric} {value:g}")
+        for collect in self._collectors:
+            for name, value in sorted(collect().items()):
+                lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str | Path | None = None) -> Path | None:
+        """Write the Prometheus text atomically (temp file + rename)."""
+        target = Path(path) if path else self.path
+        if target is None or not self.enabled:
+            return None
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix=f".{target.name}.", dir=target.parent)
+        try:
+            with os.fdopen(fd, "w") as handle:
+                handle.write(self.render_prometheus())
+            os.replace(staging, target)
+        except BaseException:
+            Path(staging).unlink(missing_ok=True)
+            raise
+        self._written = time.monotonic()
+        return target
+
+    def maybe_write(self) -> None:
+        """Write to the configured file if the interval has passed since the last write."""
+        if self.path is not None and self.enabled and time.monotonic() - self._written >= self.interval:
+            self.write()
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else seconds * 1000
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+TELEMETRY = Telemetry(
+    enabled=os.environ.get("CROP_TELEMETRY", "on").lower() not in ("0", "off", "false", "no"),
+    path=os.environ.get("CROP_TELEMETRY_FILE") or None,
+    interval=float(os.environ.get("CROP_TELEMETRY_INTERVAL", "10")),
+)
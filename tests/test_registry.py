@@ -0,0 +1,60 @@
+"""registry: serve whichever of the array export and the pickle is newer, and say why
+nothing is served when the only candidate fails to load."""
+
+import os
+import time
+from pathlib import Path
+
+import joblib
+import pytest
+
+from array_artifact import export_arrays
+from registry import ModelRegistry, locate
+
+MODEL = Path(__file__).resolve().parents[1] / "crop_model_v2.pkl"
+
+
+def _written(path: Path, seconds_ago: float) -> None:
+    target = path / "header.json" if path.is_dir() else path
+    stamp = time.time() - seconds_ago
+    os.utime(target, (stamp, stamp))
+
+
+def test_locate_prefers_the_newer_file(tmp_path):
+    assert locate(tmp_path, "m") is None
+    pickle = tmp_path / "m.pkl"
+    pickle.write_bytes(b"")
+    assert locate(tmp_path, "m") == pickle
+
+    arrays = tmp_path / "m.arrays"
+    arrays.mkdir()
+    (arrays / "header.json").write_text("{}")
+    _written(pickle, 100)
+    _written(arrays, 100)
+    assert locate(tmp_path, "m") == arrays      # a tie goes to the export
+    _written(arrays, 200)
+    assert locate(tmp_path, "m") == pickle      # e.g. update_model.py --skip-arrays
+    _written(arrays, 50)
+    assert locate(tmp_path, "m") == arrays
+
+
+def test_registry_serves_a_pickle_written_over_an_older_export(tmp_path):
+    artifact = joblib.load(MODEL)
+    export_arrays(artifact, tmp_path / "crop_model_v2.arrays")
+    _written(tmp_path / "crop_model_v2.arrays", 600)
+    updated = {**artifact, "created_utc": "2099-01-01T00:00:00+00:00"}
+    joblib.dump(updated, tmp_path / "crop_model_v2.pkl", compress=0)
+
+    registry = ModelRegistry(tmp_path, variants={"full": "crop_model_v2"})
+    assert registry.load() == ["full"]
+    info = registry.stats()["variants"]["full"]
+    assert info["format"] == "pickle"
+    assert info["created_utc"] == updated["created_utc"]
+
+
+def test_primary_reports_why_the_model_did_not_load(tmp_path):
+    (tmp_path / "crop_model_v2.pkl").write_bytes(b"not a pickle")
+    registry = ModelRegistry(tmp_path, variants={"full": "crop_model_v2"})
+    assert registry.load() == []
+    with pytest.raises(LookupError, match="could not load .*crop_model_v2.pkl"):
+        registry.primary()
@@ -0,0 +1,260 @@
+"""
+tree_shap.py
+============
+Batched exact TreeSHAP for one class at a time, precomputed at load.
+
+`shap.TreeExplainer.shap_values` attributes all 22 classes for every row and
+the app then keeps one class. Path-dependent TreeSHAP is a sum over leaves:
+a leaf's share of the attribution depends on the row only through which of
+the conditions on its root-to-leaf path the row satisfies, and scales with
+the leaf's value for the class being explained. So, once per artefact:
+
+  * every leaf's path is reduced to its distinct features, each with a
+    cell-index interval (the conditions merged) and a zero fraction (the
+    product of cover ratios along the edges that test it)
+  * for every subset of satisfied path features, the leaf's Shapley weights
+    are tabulated; they do not depend on the class
+
+Explaining a row then means locating its cell (as `CompiledForest.cells`),
+reading one table entry per leaf and weighting it by the leaf's value for
+the requested class. Only leaves with a non-zero value for that class are
+touched, which in a Random Forest is a small fraction of them.
+
+Usage
+-----
+    explainer = ShapEngine.from_artifact(artifact, artifact["_engine"])
+    phi = explainer.shap_values(X, class_index)   # (n_rows, n_features)
+    explainer.expected_value(class_index)         # phi.sum(1) + this == forest proba
+
+    python tree_shap.py --data Crop_recommendation.csv   # check against shap + latency
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from math import factorial
+from typing import Any
+
+import numpy as np
+
+from inference import CompiledForest
+
+# Rows explained per block; bounds the (rows, leaves, features) gather.
+BLOCK_ROWS = 256
+
+
+def forest_cover(artifact: dict[str, Any]) -> np.ndarray:
+    """Training cover of every node, concatenated in CompiledForest order."""
+    if artifact.get("_cover") is not None:  # array artefact
+        return np.asarray(artifact["_cover"], dtype=np.float64)
+    forest = artifact["calibrated"].calibrated_classifiers_[0].estimator[-1]
+    return np.concatenate([
+        estimator.tree_.weighted_n_node_samples for estimator in forest.estimators_
+    ]).astype(np.float64)
+
+
+def _weights_table(zero: np.ndarray, n_features: int, path_feature: np.ndarray) -> np.ndarray:
+    """Shapley weights per leaf and satisfied-subset, (n_leaves, 2**m, n_features).
+
+    `zero` is (n_leaves, m): the zero fractions of the m path features. For
+    subset pattern `A` (bit p set when path feature p is satisfied), feature
+    p receives `(o_p - z_p) * sum_s w(s) e_s` where `e_s` sums over subsets of
+    size s of the other path features, with o for members and z otherwise,
+    and `w(s) = s! (m - s - 1)! / m!`.
+    """
+    n_leaves, m = zero.shape
+    patterns = np.arange(2 ** m)
+    one = ((patterns[:, None] >> np.arange(m)) & 1).astype(np.float64)   # (2**m, m)
+
+    # prod_k (z_k + o_k t), coefficients in t, (n_leaves, 2**m, m + 1)
+    poly = np.zeros((n_leaves, 2 ** m, m + 1))
+    poly[..., 0] = 1.0
+    for k in range(m):
+        z = zero[:, k][:, None]
+        o = one[:, k][None, :]
+        shifted = np.zeros_like(poly)
+        shifted[..., 1:] = poly[..., :-1]
+        poly = poly * z[..., None] + shifted * o[..., None]
+
+    weights = np.array([factorial(s) * factorial(m - s - 1) / factorial(m) for s in range(m)])
+    table = np.zeros((n_leaves, 2 ** m, n_features))
+    for p in range(m):
+        z = zero[:, p][:, None]
+        o = one[:, p][None, :] * np.ones((n_leaves, 1))
+        # divide out (z_p + o_p t): plain scaling when o_p = 0, synthetic
+        # division from the top coefficient when o_p = 1
+        quotient = np.zeros((n_leaves, 2 ** m, m))
+        carry = poly[..., m]
+        quotient[..., m - 1] = carry
+        for i in range(m - 1, 0, -1):
+            carry = poly[..., i] - z * carry
+            quotient[..., i - 1] = carry
+        quotient = np.where((o > 0)[..., None], quotient, poly[..., :m] / z[..., None])
+        table[np.arange(n_leaves), :, path_feature[:, p]] = (o - z) * (quotient @ weights)
+    return table
+
+
+class ShapEngine:
+    """Per-leaf path data and Shapley weight tables for a compiled forest."""
+
+    def __init__(self, engine: CompiledForest, cover: np.ndarray):
+        self.engine = engine
+        n_features = len(engine.feature_names)
+        n_nodes = len(engine.feature)
+        if cover.shape != (n_nodes,):
+            raise ValueError("cover must have one entry per compiled node")
+
+        # Walk every root-to-leaf path once, merging repeated features.
+        leaves, paths = [], []
+        for root in engine.roots:
+            stack = [(int(root), {})]
+            while stack:
+                node, path = stack.pop()
+                if engine.left[node] < 0:
+                    leaves.append(node)
+                    paths.append(path)
+                    continue
+                f = int(engine.feature[node])
+                rank = int(np.searchsorted(engine.split_values[f], engine.threshold[node]))
+                lo, hi, z = path.get(f, (0, len(engine.split_values[f]), 1.0))
+                for child, bounds in ((engine.left[node], (lo, min(hi, rank))),
+                                      (engine.right[node], (max(lo, rank + 1), hi))):
+                    child_path = dict(path)
+                    child_path[f] = (*bounds, z * cover[child] / cover[node])
+                    stack.append((int(child), child_path))
+
+        self.leaf = np.asarray(leaves, dtype=np.int64)
+        self.n_path = np.array([len(p) for p in paths], dtype=np.int64)
+        width = int(self.n_path.max()) if len(paths) else 0
+        self.path_feature = np.zeros((len(paths), max(width, 1)), dtype=np.int64)
+        self.path_lo = np.zeros_like(self.path_feature)
+        self.path_hi = np.full_like(self.path_feature, -1)       # empty slot: never satisfied
+        zero = np.ones((len(paths), max(width, 1)))
+        for i, path in enumerate(paths):
+            for p, f in enumerate(sorted(path)):
+                lo, hi, z = path[f]
+                self.path_feature[i, p], self.path_lo[i, p], self.path_hi[i, p] = f, lo, hi
+                zero[i, p] = z
+        self.zero_product = np.prod(np.where(self.path_hi >= 0, zero, 1.0), axis=1)
+
+        # Weight tables, grouped by path length and flattened with offsets.
+        self.offset = np.zeros(len(paths), dtype=np.int64)
+        blocks, position = [], 0
+        for m in np.unique(self.n_path):
+            rows = np.flatnonzero(self.n_path == m)
+            if m == 0:
+                block = np.zeros((len(rows), 1, n_features))
+            else:
+                block = _weights_table(zero[rows, :m], n_features, self.path_feature[rows, :m])
+            self.offset[rows] = position + np.arange(len(rows)) * block.shape[1] * n_features
+            position += block.size
+            blocks.append(block.reshape(-1))
+        self.table = np.concatenate(blocks) if blocks else np.zeros(0)
+        self.leaf_value = engine.value[self.leaf]
+        self._by_class: dict[int, np.ndarray] = {}
+
+    @classmethod
+    def from_artifact(cls, artifact: dict[str, Any], engine: CompiledForest) -> "ShapEngine":
+        return cls(engine, forest_cover(artifact))
+
+    def _leaves_for(self, class_index: int) -> np.ndarray:
+        """Leaves with a non-zero value for the class; the others add nothing."""
+        if class_index not in self._by_class:
+            self._by_class[class_index] = np.flatnonzero(self.leaf_value[:, class_index])
+        return self._by_class[class_index]
+
+    def expected_value(self, class_index: int) -> float:
+        """Mean forest output for the class over the training cover."""
+        return float(self.leaf_value[:, class_index] @ self.zero_product / self.engine.n_trees)
+
+    def shap_values(self, X: Any, class_index: int | np.ndarray) -> np.ndarray:
+        """Attributions of the uncalibrated forest probability, (n_rows, n_features).
+
+        `class_index` is one class for every row, or one class per row.
+        """
+        cells = self.engine.cells(X)
+        classes = np.broadcast_to(np.asarray(class_index), (len(cells),))
+        out = np.zeros((len(cells), cells.shape[1]))
+        for c in np.unique(classes):
+            rows = np.flatnonzero(classes == c)
+            chosen = self._leaves_for(int(c))
+            for start in range(0, len(rows), BLOCK_ROWS):
+                block = rows[start:start + BLOCK_ROWS]
+                out[block] = self._explain(cells[block], chosen, int(c))
+        return out / self.engine.n_trees
+
+    def _explain(self, cells: np.ndarray, chosen: np.ndarray, c: int) -> np.ndarray:
+        n_features = cells.shape[1]
+        feature = self.path_feature[chosen]
+        satisfied = ((cells[:, feature] >= self.path_lo[chosen])
+                     & (cells[:, feature] <= self.path_hi[chosen]))     # (rows, leaves, width)
+        pattern = satisfied.astype(np.int64) @ (1 << np.arange(feature.shape[1]))
+        index = self.offset[chosen] + pattern * n_features               # (rows, leaves)
+        slab = self.table[index[..., None] + np.arange(n_features)]      # (rows, leaves, F)
+        return np.einsum("rlf,l->rf", slab, self.leaf_value[chosen, c])
+
+
+# --------------------------------------------------------------------------- #
+# Verification                                                                #
+# --------------------------------------------------------------------------- #
+
+
+def main() -> None:
+    import joblib
+    import pandas as pd
+    import shap
+
+    from inference import compile_artifact
+
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--model", default="crop_model_v2.pkl", help="path to the artefact")
+    ap.add_argument("--data", default="Crop_recommendation.csv", help="dataset CSV to compare on")
+    args = ap.parse_args()
+
+    artifact = joblib.load(args.model)
+    engine = compile_artifact(artifact)
+    started = time.perf_counter()
+    explainer = ShapEngine.from_artifact(artifact, engine)
+    print(f"precomputed {len(explainer.leaf)} leaf paths ({explainer.table.nbytes / 1e6:.1f} MB) "
+          f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    frame = pd.read_csv(args.data)[engine.feature_names]
+    X = frame.to_numpy()
+    best = engine.predict_proba(X).argmax(axis=1)
+
+    reference = shap.TreeExplainer(artifact["pipeline"][-1])
+    scaled = artifact["pipeline"][:-1].transform(frame)
+    ref = np.asarray(reference.shap_values(scaled, check_additivity=False))[np.arange(len(X)), :, best]
+    ours = explainer.shap_values(X, best)
+    base = np.array([explainer.expected_value(c) for c in best])
+    forest = engine.forest_proba(X)[np.arange(len(X)), best]
+    print(f"max |phi - shap|          : {np.abs(ours - ref).max():.2e}")
+    print(f"max |sum phi + E - f(x)|  : {np.abs(ours.sum(1) + base - forest).max():.2e}")
+
+    row = X[:1]
+    times = []
+    for _ in range(50):
+        t0 = time.perf_counter()
+        explainer.shap_values(row, best[0])
+        times.append(time.perf_counter() - t0)
+    ref_times = []
+    for _ in range(10):
+        t0 = time.perf_counter()
+        reference.shap_values(artifact["pipeline"][:-1].transform(frame.iloc[:1]), check_additivity=False)
+        ref_times.append(time.perf_counter() - t0)
+    print(f"single row : engine {np.median(times) * 1000:.2f} ms | "
+          f"shap {np.median(ref_times) * 1000:.2f} ms")
+
+    rows = X[:1000]
+    t0 = time.perf_counter()
+    explainer.shap_values(rows, best[:1000])
+    ours_1k = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    reference.shap_values(scaled[:1000], check_additivity=False)
+    ref_1k = time.perf_counter() - t0
+    print(f"per {len(rows)} rows: engine {ours_1k * 1000:.0f} ms | shap {ref_1k * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+update_model.py
+===============
+Seasonal update of a trained artefact from newly labelled field observations,
+without rerunning the build_model.py protocol.
+
+  * the new observations are split into update rows and a guard holdout
+  * trees are appended to the deployed forest, warm-start style: the scaler
+    and the existing trees are untouched, and the new trees are grown on the
+    update rows plus a class-balanced replay sample of the history
+    (--history), so every class is represented in every bootstrap
+  * only the isotonic layer is refitted. The appended trees are cross-fitted
+    on 5 folds of the update rows, which gives out-of-sample probabilities of
+    the whole updated forest for every update row (the existing trees never
+    saw them). They are pooled with the out-of-fold probabilities the
+    artefact was calibrated on (`calibration_data`, kept by build_model.py)
+    and every class's isotonic map is refitted on the pool. Artefacts without
+    calibration_data only refit classes with MIN_POSITIVES update rows
+  * feature_stats is recomputed from the artefact's streaming summaries
+    (sketches.py) after absorbing the update rows
+  * the guard compares old and updated model on the guard holdout and refuses
+    to write the update if accuracy drops by more than the tolerance (or one
+    row, on a holdout too small to resolve the tolerance)
+  * the updated artefact gets its own created_utc, which the audit log, the
+    drift monitor and benchmark.py use to tell models apart; the parent's is
+    kept in the update record
+
+The work is six fits of `--trees` trees on the update rows plus replay, so it
+scales with the new data rather than with the history.
+
+Usage
+-----
+    python update_model.py --model models/crop_model_v2.pkl --new season_2026.csv \\
+        --history Crop_recommendation.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import KFold, StratifiedKFold, train_test_split
+
+from array_artifact import export_arrays
+from build_model import RANDOM_STATE, TARGET, expected_calibration_error
+from fold_engine import calibrated_from_folds
+from sketches import FeatureSummary
+
+TREES = 20
+GUARD_FRACTION = 0.2
+REPLAY_RATIO = 1.0       # replay rows per update row
+MIN_REPLAY_PER_CLASS = 5
+CROSS_FIT_FOLDS = 5
+MIN_POSITIVES = 50       # only without calibration_data
+TOLERANCE_PP = 1.0
+
+
+def read_observations(path: str | Path, features: list[str]) -> pd.DataFrame:
+    """Labelled rows with the artefact's features, labels normalised as build_model does."""
+    df = pd.read_csv(path)
+    missing = [c for c in features + [TARGET] if c not in df.columns]
+    if missing:
+        raise SystemExit(f"{path} is missing required columns: {missing}")
+    df = df[features + [TARGET]].copy()
+    df[TARGET] = df[TARGET].astype(str).str.strip().str.lower()
+    return df.reset_index(drop=True)
+
+
+def replay_sample(history: pd.DataFrame, n_rows: int, seed: int) -> pd.DataFrame:
+    """A class-balanced sample of the history, at least MIN_REPLAY_PER_CLASS per class."""
+    rng = np.random.default_rng(seed)
+    groups = history.groupby(TARGET).indices
+    per_class = max(MIN_REPLAY_PER_CLASS, math.ceil(n_rows / len(groups)))
+    rows = [rng.choice(index, per_class, replace=len(index) < per_class) for index in groups.values()]
+    return history.iloc[np.concatenate(rows)].reset_index(drop=True)
+
+
+def grow(forest: Any, Xs: np.ndarray, y: np.ndarray, n_trees: int) -> Any:
+    """A copy of the fitted forest with `n_trees` more trees grown on (Xs, y)."""
+    missing = sorted(set(forest.classes_) - set(y))
+    if missing:
+        raise ValueError(f"the training rows lack {missing}; pass --history to replay them")
+    grown = copy.copy(forest)
+    grown.estimators_ = list(forest.estimators_)  # fit() extends this list in place
+    grown.set_params(warm_start=True, n_estimators=len(forest.estimators_) + n_trees)
+    grown.fit(Xs, y)
+    grown.set_params(warm_start=False)
+    if list(grown.classes_) != list(forest.classes_):
+        raise ValueError("class set changed while growing the forest")
+    return grown
+
+
+def _folds(y: pd.Series, n_splits: int, seed: int):
+    if y.value_counts().min() >= n_splits:
+        return StratifiedKFold(n_splits, shuffle=True, random_state=seed).split(y, y)
+    return KFold(n_splits, shuffle=True, random_state=seed).split(y)
+
+
+def _split_guard(new: pd.DataFrame, fraction: float, seed: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    if fraction <= 0:
+        return new, new.iloc[:0]
+    stratify = new[TARGET] if new[TARGET].value_counts().min() >= 2 else None
+    update, guard = train_test_split(new, test_size=fraction, stratify=stratify, random_state=seed)
+    return update.reset_index(drop=True), guard.reset_index(drop=True)
+
+
+def _scores(calibrated: Any, X: pd.DataFrame, y: pd.Series) -> dict[str, float]:
+    proba = calibrated.predict_proba(X)
+    classes = calibrated.classes_
+    return {
+        "accuracy": round(accuracy_score(y, classes[proba.argmax(axis=1)]) * 100, 3),
+        "log_loss": round(float(log_loss(y, proba, labels=list(classes))), 4),
+        "ece": round(expected_calibration_error(y, proba, classes), 4),
+    }
+
+
+def update_artifact(artifact: dict[str, Any], new: pd.DataFrame,
+                    history: pd.DataFrame | None = None, trees: int = TREES,
+                    guard_fraction: float = GUARD_FRACTION, replay_ratio: float = REPLAY_RATIO,
+                    min_positives: int = MIN_POSITIVES, tolerance_pp: float = TOLERANCE_PP,
+                    seed: int | None = None) -> tuple[dict[str, Any], dict[str, Any]]:
+    """The updated artefact (a new dict; the input is not modified) and its update record."""
+    started = time.perf_counter()
+    features = artifact["feature_names"]
+    pipeline, old_calibrated = artifact["pipeline"], artifact["calibrated"]
+    classes = np.asarray(pipeline.classes_)
+    seed = RANDOM_STATE + len(artifact.get("updates", [])) + 1 if seed is None else seed
+
+    unknown = sorted(set(new[TARGET]) - set(classes))
+    if unknown:
+        raise ValueError(f"new data has classes the model was not built with: {unknown}; "
+                         "rerun build_model.py")
+    update, guard = _split_guard(new, guard_fraction, seed)
+    replay = (replay_sample(history, int(len(update) * replay_ratio), seed)
+              if history is not None else new.iloc[:0])
+
+    scaler, forest = pipeline[:-1], pipeline[-1]
+    Xs_update = scaler.transform(update[features])
+    Xs_replay = scaler.transform(replay[features]) if len(replay) else Xs_update[:0]
+    y_update, y_replay = update[TARGET].to_numpy(), replay[TARGET].to_numpy()
+
+    # Out-of-sample probabilities of the updated forest for every update row.
+    oof = np.zeros((len(update), len(classes)))
+    for train, test in _folds(update[TARGET], CROSS_FIT_FOLDS, seed):
+        fold_forest = grow(forest, np.vstack([Xs_update[train], Xs_replay]),
+                           np.concatenate([y_update[train], y_replay]), trees)
+        oof[test] = fold_forest.predict_proba(Xs_update[test])
+    grown = grow(forest, np.vstack([Xs_update, Xs_replay]), np.concatenate([y_update, y_replay]), trees)
+    updated = copy.copy(pipeline)
+    updated.steps = [*pipeline.steps[:-1], (pipeline.steps[-1][0], grown)]
+    fitted = time.perf_counter()
+
+    # Isotonic layer: refit on the stored calibration rows plus the update rows.
+    # The stored probabilities came from the forest before the update; the
+    # appended trees are a small share of it, so they are reused as they are.
+    label = np.searchsorted(classes, y_update).astype(np.int16)
+    history_data = artifact.get("calibration_data")
+    if history_data is not None:
+        calibration_data = {"proba": np.vstack([history_data["proba"], oof]),
+                            "label": np.concatenate([history_data["label"], label])}
+    else:
+        calibration_data = {"proba": oof, "label": label}
+    calibrated = calibrated_from_folds(updated, calibration_data["proba"],
+                                       classes[calibration_data["label"]], method="isotonic",
+                                       cv=CROSS_FIT_FOLDS, classes=classes)
+    if calibrated is None:
+        raise RuntimeError("this scikit-learn cannot assemble the calibrated model")
+    positives = np.bincount(calibration_data["label"], minlength=len(classes))
+    if history_data is None:
+        calibrators = calibrated.calibrated_classifiers_[0].calibrators
+        previous = old_calibrated.calibrated_classifiers_[0].calibrators
+        for k in np.flatnonzero(positives < min_positives):
+            calibrators[k] = previous[k]
+    refit = classes if history_data is not None else classes[positives >= min_positives]
+
+    # Streaming feature_stats.
+    if "feature_sketches" in artifact:
+        summaries, source = ({f: FeatureSummary.from_dict(artifact["feature_sketches"][f])
+                              for f in features}, "feature_sketches")
+    elif history is not None:
+        summaries, source = {f: FeatureSummary.from_values(history[f]) for f in features}, "history"
+    else:
+        n = int(artifact.get("n_training_records", 0))
+        summaries, source = ({f: FeatureSummary.from_stats(artifact["feature_stats"][f], n)
+                              for f in features}, "feature_stats")
+    for f in features:
+        summaries[f].update(update[f])
+
+    guard_record: dict[str, Any] = {"rows": int(len(guard)), "tolerance_pp": tolerance_pp}
+    if len(guard):
+        guard_record["before"] = _scores(old_calibrated, guard[features], guard[TARGET])
+        guard_record["after"] = _scores(calibrated, guard[features], guard[TARGET])
+        # On a small holdout one row is worth more than the tolerance; always allow it.
+        allowed = max(tolerance_pp, 100 / len(guard))
+        guard_record["passed"] = (guard_record["after"]["accuracy"]
+                                  >= guard_record["before"]["accuracy"] - allowed - 1e-9)
+    else:
+        guard_record["passed"] = True
+
+    record = {
+        "updated_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parent_created_utc": artifact.get("created_utc"),
+        "seed": seed,
+        "new_rows": int(len(new)),
+        "update_rows": int(len(update)),
+        "replay_rows": int(len(replay)),
+        "trees_added": trees,
+        "n_estimators": len(grown.estimators_),
+        "calibration_rows": int(len(calibration_data["label"])),
+        "calibrators_refit": [str(c) for c in refit],
+        "feature_stats_source": source,
+        "guard": guard_record,
+        "seconds": {"fit": round(fitted - started, 2),
+                    "total": round(time.perf_counter() - started, 2)},
+    }
+    out = {
+        **artifact,
+        "created_utc": record["updated_utc"],  # a new identity for audit, monitor and benchmark
+        "pipeline": updated,
+        "calibrated": calibrated,
+        "feature_stats": {f: summaries[f].stats() for f in features},
+        "feature_sketches": {f: summaries[f].to_dict() for f in features},
+        "calibration_data": calibration_data,
+        "n_training_records": int(artifact.get("n_training_records", 0)) + len(update),
+        "model_params": {**artifact.get("model_params", {}), "n_estimators": len(grown.estimators_)},
+        "updates": [*artifact.get("updates", []), record],
+    }
+    return out, record
+
+
+def _dump(artifact: dict[str, Any], path: Path) -> None:
+    """joblib.dump to a temporary file, then rename over `path`.
+
+    The result keeps `path`'s previous mode (mkstemp's is 0600), or takes the
+    umask's for a new file, so servers running as other users can still read it.
+    """
+    fd, staging = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    os.close(fd)
+    try:
+        joblib.dump(artifact, staging, compress=0)
+        if path.exists():
+            mode = path.stat().st_mode & 0o7777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(staging, mode)
+        os.replace(staging, path)
+    except BaseException:
+        Path(staging).unlink(missing_ok=True)
+        raise
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default="models/crop_model_v2.pkl", help="artefact to update")
+    ap.add_argument("--new", required=True, help="CSV of newly labelled observations")
+    ap.add_argument("--history", help="previous training CSV, sampled for replay")
+    ap.add_argument("--out", help="where to write the updated artefact (default: --model)")
+    ap.add_argument("--trees", type=int, default=TREES, help="trees to append")
+    ap.add_argument("--guard-fraction", type=float, default=GUARD_FRACTION,
+                    help="share of the new rows held out for the regression guard")
+    ap.add_argument("--replay", type=float, default=REPLAY_RATIO,
+                    help="history rows replayed per update row")
+    ap.add_argument("--min-positives", type=int, default=MIN_POSITIVES,
+                    help="update rows a class needs before its calibrator is refitted "
+                         "(artefacts without calibration_data)")
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE_PP,
+                    help="guard accuracy drop (pp) still accepted")
+    ap.add_argument("--force", action="store_true", help="write the update even if the guard fails")
+    ap.add_argument("--skip-arrays", action="store_true", help="do not rewrite the array export")
+    args = ap.parse_args()
+
+    model_path = Path(args.model)
+    out = Path(args.out) if args.out else model_path
+    artifact = joblib.load(model_path)
+    features = artifact["feature_names"]
+    new = read_observations(args.new, features)
+    history = read_observations(args.history, features) if args.history else None
+
+    try:
+        updated, record = update_artifact(
+            artifact, new, history, trees=args.trees, guard_fraction=args.guard_fraction,
+            replay_ratio=args.replay, min_positives=args.min_positives, tolerance_pp=args.tolerance)
+    except ValueError as exc:
+        raise SystemExit(f"update refused: {exc}")
+
+    guard = record["guard"]
+    print(f"update: {record['update_rows']} new + {record['replay_rows']} replayed rows -> "
+          f"{record['trees_added']} trees appended ({record['n_estimators']} total), "
+          f"{len(record['calibrators_refit'])} calibrators refitted, "
+          f"{record['seconds']['total']:.1f} s")
+    if "before" in guard:
+        print(f"guard ({guard['rows']} rows): accuracy {guard['before']['accuracy']:.2f}% -> "
+              f"{guard['after']['accuracy']:.2f}%, ECE {guard['before']['ece']:.4f} -> "
+              f"{guard['after']['ece']:.4f}")
+    if not guard["passed"] and not args.force:
+        raise SystemExit(f"guard failed: accuracy dropped by more than {args.tolerance} pp; "
+                         "nothing written (use --force to override)")
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    _dump(updated, out)
+    print(f"wrote {out} ({out.stat().st_size / 1e6:.2f} MB)")
+    if not args.skip_arrays:
+        print(f"wrote {export_arrays(updated, out.parent / f'{out.stem}.arrays')}")
+    report = out.parent / "update_report.json"
+    report.write_text(json.dumps(record, indent=2))
+    print(f"wrote {report}")
+
+
+if __name__ == "__main__":
+    main()